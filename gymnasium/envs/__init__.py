@@ -457,6 +457,7 @@ register(
 register(
     id="MUMT",
     entry_point="gymnasium.envs.custom_env.mumt:MUMT",
+    vector_entry_point="gymnasium.envs.custom_env.mumt:MUMTVectorEnv",
     max_episode_steps=6000,
 )
 
@@ -1,3 +1,3 @@
 from gymnasium.envs.custom_env.uav1target1 import UAV1Target1
 from gymnasium.envs.custom_env.uav1target1_v2 import UAV1Target1_v2
-from gymnasium.envs.custom_env.mumt import MUMT
\ No newline at end of file
+from gymnasium.envs.custom_env.mumt import MUMT, MUMTVectorEnv
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""Reproducible performance benchmarks of the custom UAV environments and solvers.
+
+Run ``python -m gymnasium.envs.custom_env.benchmark --output results.json`` to write
+the results as JSON, and ``--baseline previous.json`` to fail on throughput
+regressions against an earlier run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import scipy
+
+from gymnasium.envs.custom_env.mdp import (
+    Actions,
+    LookupTableController,
+    MarkovDecisionProcess,
+    Policy,
+    PolicyIteration,
+    States,
+    ValueIteration,
+    unicycle_transitions,
+)
+from gymnasium.envs.custom_env.utils import Verbose
+from gymnasium.utils.performance import benchmark_step
+
+
+MUMT_SIZES = ((1, 1), (2, 2), (4, 4), (8, 8))
+
+
+def _throughput(fn, target_duration):
+    # calls per second of fn, run for at least target_duration seconds
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > target_duration:
+            return calls / elapsed
+
+
+def _result(name, value, unit, **params):
+    return {"name": name, "params": params, "value": value, "unit": unit}
+
+
+def _synthetic_grid(n_r, n_alpha, n_u):
+    # the (r, alpha) grid and turn rates of the DP models, with n_u actions
+    states = States(
+        np.linspace(0.0, 80.0, n_r, dtype=np.float32),
+        np.linspace(-np.pi, np.pi - np.pi / n_alpha, n_alpha, dtype=np.float32),
+        cycles=[np.inf, np.pi * 2],
+    )
+    actions = Actions(
+        np.linspace(-1.0 / 4.5, 1.0 / 4.5, n_u, dtype=np.float32).reshape((-1, 1))
+    )
+    return states, actions
+
+
+def _synthetic_mdp(n_r, n_alpha, n_u, dt=0.05, sigma=0.05, d=10.0):
+    # distance keeping of the unicycle: the reward is minus the distance error
+    states, actions = _synthetic_grid(n_r, n_alpha, n_u)
+    state_transition_probability, rewards = unicycle_transitions(
+        states,
+        actions,
+        dt,
+        sigma=sigma,
+        reward=lambda next_states: -np.abs(next_states[:, 0] - d),
+    )
+    return MarkovDecisionProcess(
+        states,
+        actions,
+        rewards,
+        state_transition_probability,
+        Policy(states, actions),
+        discount=0.99,
+    )
+
+
+def benchmark_mumt(sizes=MUMT_SIZES, target_duration=5, seed=0):
+    """Steps per second of ``MUMT`` with random actions for every (m, n) in sizes."""
+
+    from gymnasium.envs.custom_env.mumt import MUMT
+
+    return [
+        _result(
+            "mumt.step",
+            benchmark_step(MUMT(m=m, n=n, seed=seed), target_duration, seed),
+            "steps/s",
+            m=m,
+            n=n,
+        )
+        for m, n in sizes
+    ]
+
+
+def benchmark_uav1target1_v2(future=10, target_duration=5, seed=0):
+    """Steps per second of ``UAV1Target1_v2`` with and without ``dry_step`` lookahead.
+
+    The lookahead rolls out both actions ``future`` steps ahead before every step,
+    as the Q-value heuristics of the environment do.
+    """
+
+    from uav1target1_v2 import UAV1Target1_v2
+
+    env = UAV1Target1_v2(seed=seed)
+    rng = np.random.default_rng(seed)
+    results = [
+        _result(
+            "uav1target1_v2.step",
+            benchmark_step(env, target_duration, seed),
+            "steps/s",
+            future=0,
+        )
+    ]
+
+    env.reset(seed=seed)
+
+    def lookahead_step():
+        for action in range(env.action_space.n):
+            env.dry_step(action, future, env.discount)
+        _, _, terminal, truncated, _ = env.step(rng.integers(env.action_space.n))
+        if terminal or truncated:
+            env.reset()
+
+    results.append(
+        _result(
+            "uav1target1_v2.step",
+            _throughput(lookahead_step, target_duration),
+            "steps/s",
+            future=future,
+        )
+    )
+    return results
+
+
+def benchmark_controller(
+    batch_sizes=(1, 64, 4096), n_r=800, n_alpha=360, n_u=2, target_duration=5, seed=0
+):
+    """Queries per second of the barycentric ``LookupTableController``.
+
+    The controller interpolates a random policy on the environments' grid; a batch
+    size of 1 times ``get_action``, larger sizes ``get_actions``.
+    """
+
+    rng = np.random.default_rng(seed)
+    states, actions = _synthetic_grid(n_r, n_alpha, n_u)
+    controller = LookupTableController(
+        states, actions, rng.integers(n_u, size=int(states.num_states))
+    )
+    queries = np.stack(
+        [rng.uniform(0.0, 80.0, 4096), rng.uniform(-np.pi, np.pi, 4096)], axis=1
+    ).astype(np.float32)
+    results = []
+    for batch_size in batch_sizes:
+        batches = np.resize(queries, (max(4096 // batch_size, 1), batch_size, 2))
+        counter = iter(range(1 << 62))
+
+        def query():
+            batch = batches[next(counter) % len(batches)]
+            if batch_size == 1:
+                controller.get_action(batch[0])
+            else:
+                controller.get_actions(batch)
+
+        results.append(
+            _result(
+                "controller.get_actions",
+                _throughput(query, target_duration) * batch_size,
+                "states/s",
+                batch_size=batch_size,
+            )
+        )
+    return results
+
+
+def benchmark_dynamic_programming(
+    n_r=200, n_alpha=90, n_u=21, evaluation_sweeps=20, target_duration=5, seed=0
+):
+    """Seconds per iteration of ``ValueIteration`` and ``PolicyIteration``.
+
+    Both solve the distance keeping model of the unicycle on an ``n_r`` x
+    ``n_alpha`` grid with ``n_u`` turn rates, built by ``unicycle_transitions``,
+    from the same random initial policy.
+    """
+
+    np.random.seed(seed)
+    mdp = _synthetic_mdp(n_r, n_alpha, n_u)
+    policy = mdp.policy.toarray(copy=True)
+    params = dict(n_r=n_r, n_alpha=n_alpha, n_u=n_u)
+    solvers = [
+        ("value_iteration.update", dict(method=method), ValueIteration, method)
+        for method in ("jacobi", "gauss-seidel", "prioritized")
+    ] + [
+        (
+            "policy_iteration.update",
+            dict(evaluation_sweeps=sweeps),
+            PolicyIteration,
+            sweeps,
+        )
+        for sweeps in (None, evaluation_sweeps)
+    ]
+    results = []
+    for name, extra_params, solver_class, option in solvers:
+        mdp.policy.update(policy.copy())
+        solver = solver_class(mdp)
+        solver.verbose = Verbose(False)
+        if solver_class is PolicyIteration:
+            # the first update only initializes the values
+            solver.update()
+
+        def update():
+            if solver_class is ValueIteration:
+                solver.update(parallel=False, method=option)
+            else:
+                solver.update(evaluation_sweeps=option)
+
+        results.append(
+            _result(
+                name,
+                1 / _throughput(update, target_duration),
+                "s/iteration",
+                **extra_params,
+                **params,
+            )
+        )
+    return results
+
+
+BENCHMARKS = {
+    "mumt": benchmark_mumt,
+    "uav1target1_v2": benchmark_uav1target1_v2,
+    "controller": benchmark_controller,
+    "dynamic_programming": benchmark_dynamic_programming,
+}
+
+
+def run_benchmarks(names=None, target_duration=5, seed=0):
+    """Runs the named benchmarks (default: all) and returns the results as a dict."""
+
+    results = []
+    for name in BENCHMARKS if names is None else names:
+        results += BENCHMARKS[name](target_duration=target_duration, seed=seed)
+    return {
+        "metadata": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target_duration": target_duration,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Returns the results that are more than ``tolerance`` slower than the baseline.
+
+    Results are matched by name and parameters; throughputs (``*/s``) regress when
+    they drop, durations when they grow.
+    """
+
+    def key(result):
+        return result["name"], json.dumps(result["params"], sort_keys=True)
+
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        old = previous.get(key(result))
+        if old is None or old["unit"] != result["unit"]:
+            continue
+        if result["unit"].endswith("/s"):
+            slowdown = old["value"] / result["value"] - 1
+        else:
+            slowdown = result["value"] / old["value"] - 1
+        if slowdown > tolerance:
+            regressions.append(dict(result, baseline=old["value"], slowdown=slowdown))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "names", nargs="*", help="benchmarks to run: " + ", ".join(BENCHMARKS)
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: {}".format(name))
+
+    results = run_benchmarks(args.names or None, args.duration, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for result in results["results"]:
+        print(
+            "{:<28} {:<60} {:>12.6g} {}".format(
+                result["name"],
+                json.dumps(result["params"]),
+                result["value"],
+                result["unit"],
+            )
+        )
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for result in regressions:
+            print(
+                "regression: {} {} {:.0%} slower".format(
+                    result["name"], json.dumps(result["params"]), result["slowdown"]
+                )
+            )
+        sys.exit(1 if regressions else 0)
@@ -3,21 +3,30 @@
 # desired_path = os.path.expanduser("~/Project/PERSISTENT/Gymnasium/gymnasium")
 # sys.path.append(desired_path)
 import warnings
+from typing import Optional
+
 import numpy as np
-from gymnasium import Env
-from gymnasium.spaces import Box
-from gymnasium.utils import seeding
 from numpy import arctan2, array, cos, pi, sin
-# import rendering
+
+from gymnasium import Env, logger
+from gymnasium.envs.custom_env import headless_rendering
+from gymnasium.spaces import Box
+
+
+try:
+    from gymnasium.envs.custom_env import rendering
+except ImportError:  # no pyglet or OpenGL: frames are rasterized offscreen only
+    rendering = None
 
 warnings.filterwarnings("ignore")
 
 
 class DKC_Unicycle(Env):
-    metadata = {"render.modes": ["human", "rgb_array"], "video.frames_per_second": 30}
+    metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 30}
 
     def __init__(
         self,
+        render_mode: Optional[str] = None,
         r_max=80,
         r_min=0.0,
         sigma=0.0,
@@ -28,7 +37,9 @@ class DKC_Unicycle(Env):
         k1=0.0181,
         max_step=2000, # is max_step=2000 sufficient for the uav(r=75) to reach the target? -> Yes it is. it takes less than 1800 steps.
     ):  # 0.07273
+        self.render_mode = render_mode
         self.viewer = None
+        self.rendering = None
         self.observation_space = Box(
             low=array([r_min, -pi]), high=array([r_max, pi]), dtype=np.float32
         )
@@ -47,14 +58,10 @@ class DKC_Unicycle(Env):
         self.max_step = max_step
         self.step_count = None
         self.state = None
-        self.seed()
         self.tol = 1e-12
 
-    def seed(self, seed=None):
-        self.np_random, seed = seeding.np_random(seed)
-        return [seed]
-
-    def reset(self, pose=None):
+    def reset(self, pose=None, seed: Optional[int] = None, options: Optional[dict] = None):
+        super().reset(seed=seed)
         self.step_count = 0
         if pose is None:
             r = self.np_random.uniform(
@@ -66,18 +73,15 @@ class DKC_Unicycle(Env):
                 (r * cos(theta), r * sin(theta), self.np_random.uniform(-pi, pi))
             )
         else:
-            self.state = pose
-        return self.observation
+            self.state = array(pose, dtype=np.float64)
+        return self.observation, {}
 
     def step(self, action):
         terminal = False
         truncated = False
-        # clipping action
-        if action[0] > self.omega_max:
-            action[0] = self.omega_max
-        elif action[0] < -self.omega_max:
-            action[0] = -self.omega_max
-        dtheta = action[0] * self.dt
+        # clipping action, without changing the caller's array
+        omega = float(np.clip(np.ravel(action)[0], -self.omega_max, self.omega_max))
+        dtheta = omega * self.dt
         _lambda = dtheta / 2
         if _lambda == 0.0:
             self.state[0] += self.vdt * cos(self.state[-1])
@@ -101,9 +105,24 @@ class DKC_Unicycle(Env):
         # is_done = terminal or truncated
         return obs, reward, terminal, truncated, {}
 
-    def render(self, mode="human"):
+    def batch_reward(self, observations):  # reward of step for (N, 2) next observations, e.g. for mdp.unicycle_transitions
+        reward = self.k1 * (observations[:, 0] - self.d) ** 2 + (-self.v * cos(observations[:, 1])) ** 2
+        return -reward
+
+    def render(self):
+        if self.render_mode is None:
+            assert self.spec is not None
+            logger.warn(
+                "You are calling render method without specifying any render mode. "
+                "You can specify the render_mode at initialization, "
+                f'e.g. gym.make("{self.spec.id}", render_mode="rgb_array")'
+            )
+            return
         if self.viewer is None:
-            self.viewer = rendering.Viewer(1000, 1000)
+            # rgb_array frames never need a window or display
+            human = self.render_mode == "human" and rendering is not None
+            self.rendering = rendering if human else headless_rendering
+            self.viewer = self.rendering.Viewer(1000, 1000)
             bound = self.observation_space.high[0] * 1.05
             self.viewer.set_bounds(-bound, bound, -bound, bound)
         x, y, theta = self.state
@@ -111,18 +130,18 @@ class DKC_Unicycle(Env):
         target.set_color(1, 0.6, 0)
         circle = self.viewer.draw_circle(radius=self.d, filled=False)
         circle.set_color(1,1,1)
-        tf = rendering.Transform(translation=(x, y), rotation=theta)
+        tf = self.rendering.Transform(translation=(x, y), rotation=theta)
         tri = self.viewer.draw_polygon([(-0.8, 0.8), (-0.8, -0.8), (1.6, 0)])
         tri.set_color(0.5, 0.5, 0.9)
         tri.add_attr(tf)
-        return self.viewer.render(return_rgb_array=mode == "rgb_array")
+        return self.viewer.render(return_rgb_array=self.render_mode == "rgb_array")
 
     @property
     def observation(self):
         x, y = self.state[:2] #+ self.sigma * self.np_random.randn(2)  # self.sigma=0 anyways
         r = (x**2 + y**2) ** 0.5
         alpha = wrap(arctan2(y, x) - wrap(self.state[-1]) - pi)
-        return array([r, alpha])
+        return array([r, alpha], dtype=np.float32)
 
     def close(self):
         if self.viewer:
@@ -138,7 +157,7 @@ def wrap(theta):
     return theta
 
 if __name__ == '__main__':
-    uav_env = DKC_Unicycle()
+    uav_env = DKC_Unicycle(render_mode="human")
     action_sample = uav_env.action_space.sample()
     print("action_sample: ", action_sample)
 
@@ -154,4 +173,4 @@ if __name__ == '__main__':
         step += 1
         action_sample = uav_env.action_space.sample()
         uav_env.step(action_sample)
-        uav_env.render(action_sample)
\ No newline at end of file
+        uav_env.render()
\ No newline at end of file
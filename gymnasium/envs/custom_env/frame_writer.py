@@ -0,0 +1,144 @@
+"""
+Writing rendered frames off the simulation thread
+
+``write_frame`` encodes one rgb_array frame (with optional text labels) to an image
+file. ``FrameWriter`` queues frames for a background thread that does the same, or
+streams the frames of every episode directory into one video file.
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from gymnasium import error
+
+VIDEO_FORMATS = ("mp4", "avi", "mkv", "webm", "gif")
+
+
+def _label(frame, texts, font):
+    image = Image.fromarray(frame)
+    draw = ImageDraw.Draw(image)
+    for xy, text, color in texts:
+        draw.text(xy, text, fill=color, font=font)
+    return image
+
+
+def write_frame(path, frame, texts=(), font=None, compress_level=1):
+    """Writes an rgb_array frame to path, drawing (xy, text, color) labels first."""
+
+    _label(frame, texts, font).save(path, compress_level=compress_level)
+
+
+class FrameWriter:
+    """Encodes and writes rendered frames from a background thread.
+
+    ``write`` takes the same arguments as :func:`write_frame` and returns once the
+    frame is queued. With ``format`` the extension of every path is replaced, e.g.
+    by ``"png"``; a video format such as ``"mp4"`` instead appends the frames of
+    each directory to ``<directory>.mp4`` (this needs ``imageio`` with ffmpeg).
+    When ``max_queue`` frames are pending, ``policy="block"`` makes ``write`` wait
+    and ``policy="drop"`` discards the new frame and counts it in ``dropped``.
+    Frames must not be modified after they are written. Errors of the background
+    thread are re-raised by the next call; ``close`` flushes all pending frames.
+    """
+
+    def __init__(
+        self, format=None, max_queue=64, policy="block", fps=30, compress_level=1
+    ):
+        if policy not in ("block", "drop"):
+            raise ValueError("Unknown frame writer policy: {}.".format(policy))
+        self.format = format
+        self.policy = policy
+        self.fps = fps
+        self.compress_level = compress_level
+        self.dropped = 0
+        self.__queue = queue.Queue(max_queue)
+        self.__video = None
+        self.__error = None
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, path, frame, texts=(), font=None):
+        self.__raise()
+        if self.__closed:
+            raise ValueError("Cannot write to a closed FrameWriter.")
+        job = (path, frame, texts, font)
+        if self.policy == "block":
+            self.__queue.put(job)
+            return True
+        try:
+            self.__queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        # waits until every queued frame is written
+        self.__queue.join()
+        self.__raise()
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.__queue.put(None)
+            self.__thread.join()
+        self.__raise()
+
+    def __raise(self):
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+            try:
+                if job is None:
+                    self.__close_video()
+                    return
+                if self.__error is None:
+                    self.__write(*job)
+            except BaseException as error:
+                self.__error = error
+            finally:
+                self.__queue.task_done()
+
+    def __write(self, path, frame, texts, font):
+        if self.format is None:
+            write_frame(path, frame, texts, font, self.compress_level)
+        elif self.format in VIDEO_FORMATS:
+            if texts:
+                frame = np.asarray(_label(frame, texts, font))
+            self.__video_stream(path).append_data(frame)
+        else:
+            path = os.path.splitext(path)[0] + "." + self.format
+            write_frame(path, frame, texts, font, self.compress_level)
+
+    def __video_stream(self, path):
+        # one stream per directory: a frame of a new episode closes the previous one
+        filename = os.path.dirname(os.path.abspath(path)) + "." + self.format
+        if self.__video is None or self.__video[0] != filename:
+            self.__close_video()
+            try:
+                import imageio
+            except ImportError as e:
+                raise error.DependencyNotInstalled(
+                    "imageio is not installed, run `pip install imageio imageio-ffmpeg`"
+                ) from e
+            self.__video = (filename, imageio.get_writer(filename, fps=self.fps))
+        return self.__video[1]
+
+    def __close_video(self):
+        if self.__video is not None:
+            video, self.__video = self.__video[1], None
+            video.close()
@@ -0,0 +1,378 @@
+"""
+2D rendering without a display
+
+A NumPy/PIL rasterizer with the ``Viewer``/``Geom``/``Transform`` API of
+``rendering``. Frames are drawn into an RGB array instead of an OpenGL window, so
+``rgb_array`` frames can be produced on machines without pyglet or a display.
+"""
+import math
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL import ImageDraw, ImageFont
+
+# rasterized geometry kept between frames, e.g. the coverage donuts of static targets
+MASK_CACHE_SIZE = 256
+# vertices are snapped to 1/16 pixel before they are used as a cache key
+SUBPIXELS = 16
+
+
+class Viewer:
+    def __init__(self, width, height, display=None):
+        # display is accepted for compatibility with rendering.Viewer and ignored
+        self.width = width
+        self.height = height
+        self.isopen = True
+        self.geoms = []
+        self.label = []
+        self.onetime_geoms = []
+        self.onetime_label = []
+        self.transform = Transform()
+        self.background = (0, 0, 0)
+        self.frame = None
+        self.__background = None
+        self.__masks = {}
+
+    def close(self):
+        self.isopen = False
+
+    def set_bounds(self, left, right, bottom, top):
+        assert right > left and top > bottom
+        scalex = self.width / (right - left)
+        scaley = self.height / (top - bottom)
+        self.transform = Transform(
+            translation=(-left * scalex, -bottom * scaley), scale=(scalex, scaley)
+        )
+
+    def add_geom(self, geom):
+        self.geoms.append(geom)
+
+    def add_label(self, label):
+        self.label.append(label)
+
+    def add_onetime(self, geom):
+        self.onetime_geoms.append(geom)
+
+    def add_onetime_label(self, label):
+        self.onetime_label.append(label)
+
+    def render(self, return_rgb_array=False):
+        if self.__background is None or self.__background.shape[:2] != (
+            self.height,
+            self.width,
+        ):
+            self.__background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            self.__background[:] = self.background
+        self.frame = self.__background.copy()
+        for geom in self.geoms + self.onetime_geoms:
+            geom.render(self, [self.transform], Color((0, 0, 0, 1.0)))
+        for label in self.label + self.onetime_label:
+            label.render(self)
+        self.onetime_geoms = []
+        self.onetime_label = []
+        return self.frame.copy() if return_rgb_array else self.isopen
+
+    # Convenience
+    def draw_circle(self, radius=10, res=30, x=0, y=0, filled=True, **attrs):
+        geom = make_circle(radius=radius, res=res, x=x, y=y, filled=filled)
+        _add_attrs(geom, attrs)
+        self.add_onetime(geom)
+        return geom
+
+    def add_text(self, text, x, y, color=(255, 255, 255, 255), font_size=10):
+        label = Label(text, x, y, color, font_size)
+        self.add_onetime_label(label)
+        return label
+
+    def draw_polygon(self, v, filled=True, **attrs):
+        geom = make_polygon(v=v, filled=filled)
+        _add_attrs(geom, attrs)
+        self.add_onetime(geom)
+        return geom
+
+    def draw_polyline(self, v, **attrs):
+        geom = make_polyline(v=v)
+        _add_attrs(geom, attrs)
+        self.add_onetime(geom)
+        return geom
+
+    def draw_line(self, start, end, **attrs):
+        geom = Line(start, end)
+        _add_attrs(geom, attrs)
+        self.add_onetime(geom)
+        return geom
+
+    def get_array(self):
+        if self.frame is None:
+            self.render()
+        return self.frame.copy()
+
+    def to_pixels(self, points):
+        # window coordinates (origin at the bottom left) to (column, row) pixels
+        points = np.array(points, dtype=np.float64).reshape((-1, 2))
+        points[:, 1] = self.height - points[:, 1]
+        return points
+
+    def fill(self, points, color, kind="polygon", width=1, text=None):
+        # blends the color into the frame through the (cached) pixels of a shape
+        points = self.to_pixels(points)
+        snapped = np.round(points * SUBPIXELS).astype(np.int64)
+        key = (kind, width, text, snapped.tobytes())
+        if key not in self.__masks:
+            if len(self.__masks) >= MASK_CACHE_SIZE:
+                self.__masks.clear()
+            self.__masks[key] = self.__rasterize(snapped / SUBPIXELS, kind, width, text)
+        index = self.__masks[key]
+        pixels = self.frame.reshape((-1, 3))
+        r, g, b, alpha = color.vec4
+        rgb = np.clip(np.array([r, g, b]) * 255, 0, 255)
+        if alpha >= 1:
+            pixels[index] = np.round(rgb).astype(np.uint8)
+        elif alpha > 0:
+            # glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+            blended = pixels[index] * (1 - alpha) + rgb * alpha
+            pixels[index] = np.round(blended).astype(np.uint8)
+
+    def __rasterize(self, points, kind, width, text):
+        # flat frame indices of the pixels covered by a shape
+        if kind == "text":
+            font = _font(width)
+            bbox = [int(v) for v in font.getbbox(text, anchor="mm")]
+            x, y = np.round(points[0]).astype(int)
+            box = (x + bbox[0], y + bbox[1], x + bbox[2], y + bbox[3])
+        else:
+            pad = int(math.ceil(width / 2)) + 1
+            box = (
+                int(math.floor(points[:, 0].min())) - pad,
+                int(math.floor(points[:, 1].min())) - pad,
+                int(math.ceil(points[:, 0].max())) + pad,
+                int(math.ceil(points[:, 1].max())) + pad,
+            )
+        left, top, right, bottom = box
+        if right <= left or bottom <= top:
+            return np.zeros((0,), dtype=np.intp)
+        image = PILImage.new("L", (right - left, bottom - top), 0)
+        draw = ImageDraw.Draw(image)
+        xy = [(x - left, y - top) for x, y in points]
+        if kind == "text":
+            draw.text(xy[0], text, fill=255, font=_font(width), anchor="mm")
+        elif kind == "polygon":
+            draw.polygon(xy, fill=255)
+        elif kind == "point":
+            draw.point(xy, fill=255)
+        else:
+            if kind == "loop":
+                xy.append(xy[0])
+            draw.line(xy, fill=255, width=max(int(round(width)), 1))
+        rows, cols = np.nonzero(np.asarray(image) > 127)
+        rows += top
+        cols += left
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        return rows[inside] * self.width + cols[inside]
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap font size
+        return ImageFont.load_default()
+
+
+def _add_attrs(geom, attrs):
+    if "color" in attrs:
+        geom.set_color(*attrs["color"])
+    if "linewidth" in attrs:
+        geom.set_linewidth(attrs["linewidth"])
+
+
+class Geom:
+    def __init__(self):
+        self._color = Color((0, 0, 0, 1.0))
+        self.attrs = [self._color]
+
+    def render(self, viewer, transforms, color):
+        # transforms is the matrix stack of the enclosing geoms, outermost first; the
+        # transforms of self.attrs are pushed in reverse, as in rendering.Geom.render
+        # the first color attribute is enabled last, so it wins
+        own = [attr for attr in self.attrs if isinstance(attr, Transform)]
+        colors = [attr for attr in self.attrs if isinstance(attr, Color)]
+        color = colors[0] if colors else color
+        self.render1(viewer, transforms + own[::-1], color)
+
+    def render1(self, viewer, transforms, color):
+        raise NotImplementedError
+
+    def add_attr(self, attr):
+        self.attrs.append(attr)
+
+    def set_color(self, r, g, b, alpha=1):
+        self._color.vec4 = (r, g, b, alpha)
+
+    def _linewidth(self):
+        widths = [attr.stroke for attr in self.attrs if isinstance(attr, LineWidth)]
+        return widths[-1] if widths else 1
+
+
+def _apply(transforms, points):
+    # the innermost transform of the stack applies first
+    points = np.array(points, dtype=np.float64).reshape((-1, 2))
+    for transform in transforms[::-1]:
+        points = transform.apply(points)
+    return points
+
+
+class Attr:
+    def enable(self):
+        pass
+
+    def disable(self):
+        pass
+
+
+class Transform(Attr):
+    def __init__(self, translation=(0.0, 0.0), rotation=0.0, scale=(1, 1)):
+        self.set_translation(*translation)
+        self.set_rotation(rotation)
+        self.set_scale(*scale)
+
+    def apply(self, points):
+        # translate(rotate(scale(points))), as glTranslatef, glRotatef, glScalef
+        points = points * self.scale
+        c, s = math.cos(self.rotation), math.sin(self.rotation)
+        points = points @ np.array([[c, s], [-s, c]])
+        return points + self.translation
+
+    def set_translation(self, newx, newy):
+        self.translation = (float(newx), float(newy))
+
+    def set_rotation(self, new):
+        self.rotation = float(new)
+
+    def set_scale(self, newx, newy):
+        self.scale = (float(newx), float(newy))
+
+
+class Color(Attr):
+    def __init__(self, vec4):
+        self.vec4 = vec4
+
+
+class LineStyle(Attr):
+    # stippled lines are drawn solid
+    def __init__(self, style):
+        self.style = style
+
+
+class LineWidth(Attr):
+    def __init__(self, stroke):
+        self.stroke = stroke
+
+
+class Point(Geom):
+    def __init__(self):
+        Geom.__init__(self)
+
+    def render1(self, viewer, transforms, color):
+        viewer.fill(_apply(transforms, [(0.0, 0.0)]), color, kind="point")
+
+
+class FilledPolygon(Geom):
+    def __init__(self, v):
+        Geom.__init__(self)
+        self.v = v
+
+    def render1(self, viewer, transforms, color):
+        viewer.fill(_apply(transforms, self.v), color)
+
+
+def make_circle(radius=10, res=30, x=0, y=0, filled=True):
+    points = []
+    for i in range(res):
+        ang = 2 * math.pi * i / res
+        points.append((x + math.cos(ang) * radius, y + math.sin(ang) * radius))
+    if filled:
+        return FilledPolygon(points)
+    else:
+        return PolyLine(points, True)
+
+
+def make_polygon(v, filled=True):
+    if filled:
+        return FilledPolygon(v)
+    else:
+        return PolyLine(v, True)
+
+
+def make_polyline(v):
+    return PolyLine(v, False)
+
+
+def make_capsule(length, width):
+    l, r, t, b = 0, length, width / 2, -width / 2
+    box = make_polygon([(l, b), (l, t), (r, t), (r, b)])
+    circ0 = make_circle(width / 2)
+    circ1 = make_circle(width / 2)
+    circ1.add_attr(Transform(translation=(length, 0)))
+    geom = Compound([box, circ0, circ1])
+    return geom
+
+
+class Compound(Geom):
+    def __init__(self, gs):
+        Geom.__init__(self)
+        self.gs = gs
+        for g in self.gs:
+            g.attrs = [a for a in g.attrs if not isinstance(a, Color)]
+
+    def render1(self, viewer, transforms, color):
+        for g in self.gs:
+            g.render(viewer, transforms, color)
+
+
+class PolyLine(Geom):
+    def __init__(self, v, close):
+        Geom.__init__(self)
+        self.v = v
+        self.close = close
+        self.linewidth = LineWidth(1)
+        self.add_attr(self.linewidth)
+
+    def render1(self, viewer, transforms, color):
+        kind = "loop" if self.close else "strip"
+        viewer.fill(
+            _apply(transforms, self.v), color, kind=kind, width=self._linewidth()
+        )
+
+    def set_linewidth(self, x):
+        self.linewidth.stroke = x
+
+
+class Line(Geom):
+    def __init__(self, start=(0.0, 0.0), end=(0.0, 0.0)):
+        Geom.__init__(self)
+        self.start = start
+        self.end = end
+        self.linewidth = LineWidth(1)
+        self.add_attr(self.linewidth)
+
+    def render1(self, viewer, transforms, color):
+        points = _apply(transforms, [self.start, self.end])
+        viewer.fill(points, color, kind="strip", width=self._linewidth())
+
+    def set_linewidth(self, x):
+        self.linewidth.stroke = x
+
+
+class Label:
+    # text centered at (x, y) in the coordinates of the viewer, as a pyglet Label
+    def __init__(self, text, x, y, color=(255, 255, 255, 255), font_size=10):
+        self.text = text
+        self.x = x
+        self.y = y
+        self.color = color
+        self.font_size = font_size
+
+    def render(self, viewer):
+        point = _apply([viewer.transform], [(self.x, self.y)])
+        color = Color(tuple(c / 255 for c in self.color))
+        viewer.fill(point, color, kind="text", width=self.font_size, text=self.text)
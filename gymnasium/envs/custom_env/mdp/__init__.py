@@ -1,4 +1,11 @@
-from .dynamic_programming import PolicyIteration, ValueIteration
+from .checkpoint import Checkpointer, load_checkpoint
+from .controller import LookupTableController, RunLengthPolicy, load_policy_table
+from .dynamic_programming import (
+    BatchValueIteration,
+    PolicyIteration,
+    ValueIteration,
+    multigrid_solve,
+)
 from .mdp import (
     Actions,
     MarkovDecisionProcess,
@@ -7,6 +14,7 @@ from .mdp import (
     States,
     StateTransitionProbability,
 )
+from .unicycle import unicycle_transitions
 
 __all__ = [
     "States",
@@ -15,6 +23,14 @@ __all__ = [
     "StateTransitionProbability",
     "Policy",
     "MarkovDecisionProcess",
+    "LookupTableController",
+    "RunLengthPolicy",
+    "load_policy_table",
+    "Checkpointer",
+    "load_checkpoint",
     "PolicyIteration",
     "ValueIteration",
+    "BatchValueIteration",
+    "multigrid_solve",
+    "unicycle_transitions",
 ]
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import tempfile
+import threading
+from time import monotonic
+
+import numpy as np
+
+__all__ = ["Checkpointer", "load_checkpoint"]
+
+
+def _savez_atomic(filename, **arrays):
+    if not filename.endswith(".npz"):
+        filename += ".npz"
+    # write to a temporary file first so a crash never leaves a partial checkpoint
+    fd, temp_filename = tempfile.mkstemp(
+        suffix=".npz", dir=os.path.dirname(os.path.abspath(filename))
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def load_checkpoint(filename, shape=None):
+    """Returns the iteration, values and policy of a checkpoint, or None if absent.
+
+    With ``shape``, the shape of the state grid, a checkpoint written for another
+    grid raises a ``ValueError`` instead of being loaded.
+    """
+
+    if not filename.endswith(".npz"):
+        filename += ".npz"
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as data:
+        iteration = int(data["iteration"])
+        values, policy = data["values"], data["policy"]
+        # checkpoints written before the grid shape was stored only have their size
+        saved_shape = tuple(data["shape"].tolist()) if "shape" in data.files else None
+    if shape is not None:
+        shape = tuple(int(n) for n in shape)
+        sizes = {len(values), len(policy)}
+        if saved_shape not in (None, shape) or sizes != {int(np.prod(shape))}:
+            raise ValueError(
+                "Checkpoint %s of %d states (grid %s) does not match the grid %s."
+                % (filename, len(values), saved_shape, shape)
+            )
+    return iteration, values, policy
+
+
+class Checkpointer:
+    """Writes solver snapshots from a background thread.
+
+    Jobs are submitted under a key; a pending job is replaced by a newer one with
+    the same key, so a slow disk never holds up the solver. Before writing, the
+    arrays of a job are hashed and the write is dropped if they are unchanged
+    since the last write of that key. :meth:`checkpoint` additionally limits the
+    periodic checkpoint to one every ``interval`` seconds. Errors raised by a
+    write are re-raised in the solver thread on the next call.
+    """
+
+    def __init__(self, filename=None, interval=60.0, shape=None):
+        self.filename = filename
+        self.interval = interval
+        # the shape of the state grid is stored with every checkpoint
+        self.shape = shape
+        self.__last_checkpoint = monotonic()
+        self.__pending = {}
+        self.__digests = {}
+        self.__error = None
+        self.__closed = False
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, key, write, **arrays):
+        # write(**arrays) is called from the background thread with private copies
+        self.__raise()
+        arrays = {name: np.array(array, copy=True) for name, array in arrays.items()}
+        with self.__condition:
+            self.__pending[key] = (write, arrays)
+            self.__condition.notify()
+
+    def checkpoint(self, iteration, values, policy, force=False):
+        if self.filename is None:
+            return False
+        if not force and monotonic() - self.__last_checkpoint < self.interval:
+            return False
+        self.__last_checkpoint = monotonic()
+        arrays = {} if self.shape is None else {"shape": np.array(self.shape)}
+        self.submit(
+            "checkpoint",
+            lambda **arrays: _savez_atomic(self.filename, **arrays),
+            iteration=iteration,
+            values=values,
+            policy=policy,
+            **arrays,
+        )
+        return True
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+        self.__raise()
+
+    def __raise(self):
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__closed:
+                    self.__condition.wait()
+                if not self.__pending:
+                    return
+                key = next(iter(self.__pending))
+                write, arrays = self.__pending.pop(key)
+            digest = hashlib.blake2b()
+            for name, array in arrays.items():
+                if name != "iteration":
+                    digest.update(name.encode())
+                    digest.update(array.tobytes())
+            digest = digest.digest()
+            if self.__digests.get(key) == digest:
+                continue
+            try:
+                write(**arrays)
+            except BaseException as error:
+                self.__error = error
+            else:
+                self.__digests[key] = digest
+
+    # End of class Checkpointer
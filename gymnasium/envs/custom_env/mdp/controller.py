@@ -0,0 +1,420 @@
+import bisect
+import math
+import os
+import tempfile
+
+import numpy as np
+
+__all__ = ["LookupTableController", "RunLengthPolicy", "load_policy_table"]
+
+_policy_tables = {}
+
+
+def _compact_policy_filename(filename, key, directory=None, compressed=False):
+    root = os.path.splitext(filename)[0]
+    if directory is not None:
+        root = os.path.join(directory, os.path.basename(root))
+    suffix = "" if key is None else "." + key
+    return root + suffix + (".actions.rle.npz" if compressed else ".actions.npy")
+
+
+def _index_dtype(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _write_compact_policy(filename, key, compact_filename, compressed=False):
+    data = np.load(filename)
+    if isinstance(data, np.lib.npyio.NpzFile):
+        with data:
+            policy = data[key]
+    else:
+        policy = data if key is None else data[key]
+    indices = policy.astype(np.int64)
+    if not np.array_equal(indices, policy) or indices.min() < 0:
+        raise ValueError(
+            "Policy table {} does not hold action indices.".format(filename)
+        )
+    indices = indices.astype(_index_dtype(indices.max()))
+    if compressed:
+        _write_atomic(
+            compact_filename, RunLengthPolicy.from_array(indices.ravel()).save
+        )
+    else:
+        _write_atomic(compact_filename, lambda f: np.save(f, indices))
+
+
+def _write_atomic(filename, write):
+    # write to a temporary file first so concurrent workers never map a partial table
+    fd, temp_filename = tempfile.mkstemp(
+        suffix=os.path.splitext(filename)[1], dir=os.path.dirname(filename)
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def _load_cell_actions(policy, corners, layout):
+    # the corner actions of every cell of a memory-mapped policy table, written
+    # once next to the table and memory-mapped like it; in memory if not writable
+    filename = "{}.cells-{}.npy".format(os.path.splitext(policy.filename)[0], layout)
+    if not os.path.exists(filename) or os.path.getmtime(filename) < os.path.getmtime(
+        policy.filename
+    ):
+        cell_actions = np.asarray(policy)[corners]
+        try:
+            _write_atomic(filename, lambda f: np.save(f, cell_actions))
+        except OSError:
+            return cell_actions
+    return np.load(filename, mmap_mode="r")
+
+
+def load_policy_table(filename, key=None, compressed=False):
+    """Loads a per-state policy table as a read-only memory map of action indices.
+
+    On first use the table (``filename`` or entry ``key`` of an ``.npz`` archive) is
+    converted to a compact ``.actions.npy`` file of uint8 (or wider, if needed)
+    action indices next to ``filename``, or in the temporary directory if that is
+    not writable. The compact file is memory-mapped so that every process shares
+    one page-cache copy, and repeated loads within a process reuse the mapping.
+    :class:`LookupTableController` keeps the corner actions of its grid cells in a
+    ``.cells-<grid>.npy`` file next to it, memory-mapped the same way.
+    With ``compressed`` the table is converted to an ``.actions.rle.npz`` file and
+    returned as a :class:`RunLengthPolicy` instead.
+    """
+
+    filename = os.path.abspath(filename)
+    if (filename, key, compressed) not in _policy_tables:
+        compact_filename = None
+        for directory in (None, tempfile.gettempdir()):
+            candidate = _compact_policy_filename(filename, key, directory, compressed)
+            if os.path.exists(candidate) and os.path.getmtime(
+                candidate
+            ) >= os.path.getmtime(filename):
+                compact_filename = candidate
+                break
+            try:
+                _write_compact_policy(filename, key, candidate, compressed)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # e.g. a read-only directory (EACCES, EPERM or EROFS)
+                continue
+            compact_filename = candidate
+            break
+        if compact_filename is None:
+            raise PermissionError(
+                "Cannot write the compact policy table for {}.".format(filename)
+            )
+        if compressed:
+            table = RunLengthPolicy.load(compact_filename)
+        else:
+            table = np.load(compact_filename, mmap_mode="r")
+        _policy_tables[(filename, key, compressed)] = table
+    return _policy_tables[(filename, key, compressed)]
+
+
+class RunLengthPolicy:
+    """Lossless run-length encoding of a per-state table of action indices.
+
+    The table is stored as the first state index and the action of every run of
+    equal actions along the flattened state grid, so the runs follow the rows of
+    the last (fastest varying) state axis. Lookups bisect the run starts instead
+    of decompressing the table. It indexes like the action index array, so it can
+    be used as the data of a :class:`Policy` (``policy.update(table)``), which
+    decompresses it on the first ``toarray`` or item assignment, and as the
+    policy of a :class:`LookupTableController`.
+    """
+
+    def __init__(self, starts, values, size):
+        self.starts = np.asarray(starts)
+        self.values = np.asarray(values)
+        self.size = int(size)
+        self.__starts = self.starts.tolist()
+
+    @classmethod
+    def from_array(cls, policy):
+        policy = np.asarray(policy).ravel()
+        starts = np.flatnonzero(np.diff(policy)) + 1
+        if len(policy):
+            starts = np.concatenate([[0], starts])
+        starts = starts.astype(_index_dtype(len(policy)))
+        values = policy[starts]
+        if len(values) and values.dtype.kind in "iu" and values.min() >= 0:
+            values = values.astype(_index_dtype(values.max()))
+        return cls(starts, values, len(policy))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data["starts"], data["values"], data["size"])
+
+    def save(self, filename):
+        np.savez(filename, starts=self.starts, values=self.values, size=self.size)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def shape(self):
+        return (self.size,)
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if not -self.size <= key < self.size:
+                raise IndexError("index {} is out of bounds".format(key))
+            key = int(key) % self.size
+            return self.values[bisect.bisect_right(self.__starts, key) - 1]
+        key = np.arange(self.size)[key] if isinstance(key, slice) else np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.where(key < 0, key + self.size, key)
+        if np.any((key < 0) | (key >= self.size)):
+            raise IndexError("index out of bounds for size {}".format(self.size))
+        return self.values[np.searchsorted(self.starts, key, side="right") - 1]
+
+    def __iter__(self):
+        return iter(self.toarray())
+
+    def __array__(self, dtype=None):
+        return self.toarray() if dtype is None else self.toarray().astype(dtype)
+
+    def copy(self):
+        # the decompressed table, as ndarray.copy() of the dense table would be
+        return self.toarray()
+
+    def toarray(self, copy=False):
+        # always a new array; copy is accepted for compatibility with Policy.toarray
+        lengths = np.diff(np.append(self.starts.astype(np.int64), self.size))
+        return np.repeat(self.values, lengths)
+
+
+class LookupTableController:
+    """Barycentric lookup-table controller compiled from a per-state policy.
+
+    The controller precomputes the action indices at the corners of every grid
+    cell and the origin and spacing of each (uniform) state axis, so a query is
+    resolved by arithmetic indexing instead of ``np.searchsorted``. Results are
+    identical to :meth:`Policy.get_action` on the same ``States`` grid.
+    """
+
+    __cache = {}
+    small_batch_size = 8
+
+    def __init__(self, states, actions, policy):
+        state_lists, cycles = states.info(return_data=True, return_cycles=True)
+        self.dtype = states.dtype
+        mapped = isinstance(policy, np.memmap)
+        if not isinstance(policy, RunLengthPolicy):
+            policy = policy if mapped else np.asarray(policy)
+        self.policy = policy
+        layout = []
+        self.__axes = []
+        corners = np.zeros((1, 1), dtype=int)
+        for state_list, cycle in zip(state_lists, cycles):
+            n = len(state_list)
+            if n < 2:
+                raise ValueError("Every state list needs at least two grid points.")
+            spacing = (float(state_list[-1]) - float(state_list[0])) / (n - 1)
+            if not np.allclose(
+                np.diff(state_list.astype(np.float64)), spacing, rtol=1e-3
+            ):
+                raise ValueError(
+                    "LookupTableController requires uniformly spaced state lists."
+                )
+            cyclic = bool(np.isfinite(cycle))
+            zero = np.zeros((), dtype=state_list.dtype)[()]
+            # row idx describes a query with idx grid points below it: the two
+            # neighbours (U, L) and wrap offsets (cU, cL) of the distances
+            # d_up = (U - x) + cU and d_lo = (x - L) + cL, whether the weights are
+            # swapped, and the cell. The wrap-around cell of a cyclic axis has the
+            # corners (0, n - 1), in the same order as States.computeBarycentric.
+            rows = [
+                (state_list[idx], zero, state_list[idx - 1], zero, False, idx - 1)
+                for idx in range(1, n)
+            ]
+            if cyclic:
+                cycle = state_list.dtype.type(cycle)
+                rows.insert(
+                    0, (state_list[0], zero, state_list[-1], cycle, True, n - 1)
+                )
+                rows.append((state_list[0], cycle, state_list[-1], zero, True, n - 1))
+                first = np.append(np.arange(n - 1), 0)
+                second = np.append(np.arange(1, n), n - 1)
+            else:
+                # non-cyclic queries are clamped onto the grid first
+                rows.insert(0, rows[0])
+                first = np.arange(n - 1)
+                second = np.arange(1, n)
+            table = np.array([row[:4] for row in rows], dtype=state_list.dtype)
+            layout.append("{}{}".format(n, "c" if cyclic else ""))
+            self.__axes.append(
+                {
+                    "grid": state_list,
+                    "padded": [-np.inf] + state_list.tolist() + [np.inf],
+                    "origin": float(state_list[0]),
+                    "inv_spacing": 1.0 / spacing,
+                    "n": n,
+                    "cyclic": cyclic,
+                    "rows": rows,
+                    "padded_array": np.concatenate([[-np.inf], state_list, [np.inf]]),
+                    "table": table,
+                    "swap": np.array([row[4] for row in rows]),
+                    "cells": np.array([row[5] for row in rows]),
+                    "num_cells": len(first),
+                    "corners": np.stack([first, second], axis=1),
+                    "corner_list": list(zip(first.tolist(), second.tolist())),
+                }
+            )
+            # corner state indices of every cell, ordered like computeBarycentric
+            pair = np.stack([first, second], axis=1)
+            corners = corners[:, np.newaxis, :, np.newaxis] * n
+            corners = corners + pair[np.newaxis, :, np.newaxis, :]
+            corners = corners.reshape((-1, corners.shape[2] * 2))
+        self.__action_values = actions.toarray()
+        if isinstance(policy, RunLengthPolicy):
+            # the corners of a query are looked up in the compressed table itself
+            self.__cell_actions = None
+            self.__run_start_array = policy.starts.astype(int)
+            self.__run_starts = policy.starts.tolist()
+            self.__run_actions = policy.values.tolist()
+        elif mapped:
+            # the compact table already holds narrow action indices
+            self.__cell_actions = _load_cell_actions(policy, corners, "x".join(layout))
+        else:
+            self.__cell_actions = self.policy[corners].astype(
+                np.uint8 if actions.num_actions <= 256 else int
+            )
+
+    @classmethod
+    def load(cls, filename, states, actions, key=None, compressed=False):
+        """Builds the controller for a policy file once per process and shares it.
+
+        The policy table itself is memory-mapped through :func:`load_policy_table`,
+        or kept as a :class:`RunLengthPolicy` with ``compressed``.
+        """
+
+        state_lists, cycles = states.info(return_data=True, return_cycles=True)
+        signature = (
+            os.path.abspath(filename),
+            key,
+            tuple(
+                (
+                    state_list.dtype.str,
+                    len(state_list),
+                    float(state_list[0]),
+                    float(state_list[-1]),
+                    float(c),
+                )
+                for state_list, c in zip(state_lists, cycles)
+            ),
+            actions.toarray().tobytes(),
+            compressed,
+        )
+        if signature not in cls.__cache:
+            cls.__cache[signature] = cls(
+                states,
+                actions,
+                load_policy_table(filename, key=key, compressed=compressed),
+            )
+        return cls.__cache[signature]
+
+    def get_action(self, state):
+        if not isinstance(state, np.ndarray):
+            state = np.array(state, dtype=self.dtype)
+        cell = 0
+        probs = [1]
+        corners = [0]
+        for x, axis in zip(state, self.__axes):
+            grid, padded, n = axis["grid"], axis["padded"], axis["n"]
+            xf = float(x)
+            if not axis["cyclic"]:
+                if xf < padded[1]:
+                    x, xf = grid[0], padded[1]
+                elif xf > padded[n]:
+                    x, xf = grid[-1], padded[n]
+            idx = min(max(math.ceil((xf - axis["origin"]) * axis["inv_spacing"]), 0), n)
+            while xf <= padded[idx]:
+                idx -= 1
+            while xf > padded[idx + 1]:
+                idx += 1
+            upper, upper_offset, lower, lower_offset, swap, c = axis["rows"][idx]
+            d_up = (upper - x) + upper_offset
+            d_lo = (x - lower) + lower_offset
+            p_up = d_up / (d_up + d_lo)
+            p_lo = d_lo / (d_up + d_lo)
+            p = (p_lo, p_up) if swap else (p_up, p_lo)
+            cell = cell * axis["num_cells"] + c
+            probs = [q * pk for q in probs for pk in p]
+            if self.__cell_actions is None:
+                corners = [k * n + i for k in corners for i in axis["corner_list"][c]]
+        if self.__cell_actions is None:
+            starts, run_actions = self.__run_starts, self.__run_actions
+            values = self.__action_values.take(
+                [run_actions[bisect.bisect_right(starts, k) - 1] for k in corners],
+                axis=0,
+            )
+        else:
+            values = self.__action_values[self.__cell_actions[cell]]
+        weights = np.array(probs, dtype=values.dtype)
+        return np.add.reduce(weights[:, np.newaxis] * values, axis=0)
+
+    def get_actions(self, states):
+        if not isinstance(states, np.ndarray):
+            states = np.array(states, dtype=self.dtype)
+        states = states.reshape((-1, len(self.__axes)))
+        num_states = states.shape[0]
+        if num_states <= self.small_batch_size:
+            # array overhead dominates for a handful of agents
+            return np.array([self.get_action(state) for state in states])
+        cells = np.zeros((num_states,), dtype=int)
+        probs = np.ones((num_states, 1), dtype=self.dtype)
+        corners = np.zeros((num_states, 1), dtype=int)
+        for x, axis in zip(states.T, self.__axes):
+            grid, n = axis["grid"], axis["n"]
+            x = x.astype(np.result_type(x, grid))
+            if not axis["cyclic"]:
+                x = np.minimum(np.maximum(x, grid[:1]), grid[-1:])
+            idx = np.ceil((x - axis["origin"]) * axis["inv_spacing"])
+            idx = np.minimum(np.maximum(idx, 0), n).astype(int)
+            idx -= x <= axis["padded_array"][idx]
+            idx += x > axis["padded_array"][idx + 1]
+            row = axis["table"][idx]
+            d_up = (row[:, 0] - x) + row[:, 1]
+            d_lo = (x - row[:, 2]) + row[:, 3]
+            p_up = d_up / (d_up + d_lo)
+            p_lo = d_lo / (d_up + d_lo)
+            if axis["cyclic"]:
+                swap = axis["swap"][idx]
+                p_up, p_lo = np.where(swap, p_lo, p_up), np.where(swap, p_up, p_lo)
+            cells = cells * axis["num_cells"] + axis["cells"][idx]
+            probs = (
+                probs[:, :, np.newaxis] * np.stack([p_up, p_lo], axis=1)[:, np.newaxis]
+            )
+            probs = probs.reshape((num_states, -1))
+            if self.__cell_actions is None:
+                pair = axis["corners"][axis["cells"][idx]]
+                corners = corners[:, :, np.newaxis] * n + pair[:, np.newaxis, :]
+                corners = corners.reshape((num_states, -1))
+        if self.__cell_actions is None:
+            runs = np.searchsorted(self.__run_start_array, corners, side="right") - 1
+            values = self.__action_values[self.policy.values[runs]]
+        else:
+            values = self.__action_values[self.__cell_actions[cells]]
+        return np.sum(probs.astype(values.dtype)[..., np.newaxis] * values, axis=1)
+
+    # End of class LookupTableController
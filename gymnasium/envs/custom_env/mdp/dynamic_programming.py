@@ -1,4 +1,6 @@
-from multiprocessing import Array, Process, Value, cpu_count
+import os
+from multiprocessing import Process, RawValue, Semaphore, cpu_count
+from multiprocessing.shared_memory import SharedMemory
 from time import time
 
 import matplotlib.pyplot as plt
@@ -7,13 +9,234 @@ from scipy import sparse as sp
 from scipy.sparse.linalg import bicgstab, lgmres, spsolve
 from utils import Verbose
 
-__all__ = ["ValueIteration", "PolicyIteration"]
+from .checkpoint import Checkpointer, load_checkpoint
+
+__all__ = [
+    "ValueIteration",
+    "PolicyIteration",
+    "BatchValueIteration",
+    "multigrid_solve",
+]
+
+# scipy's sparse-matrix times dense-matrix product beats separate products from
+# about four value vectors on
+BATCH_MIN_MODELS = 4
+
+
+def _csr_rows(data, indices, indptr, rows, num_states):
+    # CSR view of a contiguous block of rows that shares data and indices
+    first, last = indptr[rows[0]], indptr[rows[1]]
+    return sp.csr_matrix(
+        (
+            data[first:last],
+            indices[first:last],
+            indptr[rows[0] : rows[1] + 1] - first,
+        ),
+        shape=(rows[1] - rows[0], num_states),
+        copy=False,
+    )
+
+
+def _policy_loss(discount, value_diff):
+    # bound on the loss of the greedy policy from the span of T(V) - V
+    if discount >= 1:
+        return np.inf
+    return discount / (1 - discount) * float(np.ptp(value_diff))
+
+
+class _AndersonMixing:
+    # Anderson acceleration of the fixed point iteration V <- T(V): the next
+    # iterate combines the last depth backups with the weights that minimize the
+    # combined residual T(V) - V, from the normal equations of the residual
+    # differences, which are kept up to date one column at a time. As a safeguard
+    # the history is cleared when the residual grows to growth times the smallest
+    # one since the last restart.
+
+    def __init__(self, depth=10, growth=10.0):
+        self.depth = depth
+        self.growth = growth
+        self.reset()
+
+    def reset(self):
+        self.__residual = self.__backup = None
+        self.__dF = []
+        self.__dG = []
+        self.__gram = np.zeros((0, 0))
+        self.__best = np.inf
+
+    def __call__(self, values, backup):
+        backup = backup.astype(np.float64)
+        residual = backup - values
+        residual_norm = np.max(np.abs(residual))
+        if residual_norm > self.growth * self.__best:
+            self.reset()
+        self.__best = min(self.__best, residual_norm)
+        if self.__residual is not None:
+            dF = residual - self.__residual
+            self.__dF.append(dF)
+            self.__dG.append(backup - self.__backup)
+            dots = np.array([np.dot(column, dF) for column in self.__dF])
+            gram = np.zeros((len(dots), len(dots)))
+            gram[:-1, :-1] = self.__gram
+            gram[-1, :] = gram[:, -1] = dots
+            if len(self.__dF) > self.depth:
+                del self.__dF[0], self.__dG[0]
+                gram = gram[1:, 1:]
+            self.__gram = gram
+        self.__residual, self.__backup = residual, backup
+        if not self.__dF:
+            return backup
+        rhs = np.array([np.dot(column, residual) for column in self.__dF])
+        gamma = np.linalg.lstsq(self.__gram, rhs, rcond=1e-12)[0]
+        mixed = backup.copy()
+        for weight, column in zip(gamma, self.__dG):
+            mixed -= weight * column
+        return mixed
+
+
+def _result_writer(sigma, n_r, n_alpha):
+    # writes the best result so far and its plots in the Tips paper format
+    def write(values, policy):
+        np.savez("result_" + str(sigma)[:3], values=values, policy=policy)
+        value_tips = np.flipud(values.reshape((n_r, n_alpha)).T)
+        plt.imsave("value_" + str(sigma)[:3] + ".png", value_tips, cmap="gray")
+        policy_tips = np.flipud(policy.reshape((n_r, n_alpha)).T)
+        plt.imsave("policy_" + str(sigma)[:3] + ".png", policy_tips, cmap="gray")
+
+    return write
+
+
+def _bellman_worker(specs, rows, num_states, command, start, done, parent, timeout):
+    # attach the shared arrays by name and compute P[rows] @ values on request
+    segments = [SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [
+        np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        for segment, (_, shape, dtype) in zip(segments, specs)
+    ]
+    data, indices, indptr, values, out = arrays
+    P = _csr_rows(data, indices, indptr, rows, num_states)
+    try:
+        while True:
+            while not start.acquire(timeout=timeout):
+                if os.getppid() != parent:
+                    return
+            if command.value < 0:
+                return
+            out[rows[0] : rows[1]] = P.dot(values)
+            done.release()
+    finally:
+        # the views have to be released before the segments can be closed
+        del P, data, indices, indptr, values, out, arrays
+        for segment in segments:
+            segment.close()
+
+
+class _BellmanBackup:
+    # Computes P @ values in worker processes over named shared memory. Each worker
+    # owns a contiguous block of rows (balanced by non-zeros) and writes its slice
+    # of the result, so no locks are needed; the workers sleep on semaphores
+    # between backups instead of polling.
+
+    def __init__(self, state_transition_probability, dtype, processes=None):
+        state_transition_probability.tocsr()
+        P = state_transition_probability.tospmat()
+        num_rows, num_states = P.shape
+        processes = min(processes or cpu_count(), num_rows)
+        self.timeout = 1.0
+        self.__segments = []
+        self.__processes = []
+        self.__starts = []
+        self.__command = RawValue("b", 0)
+        self.__done = Semaphore(0)
+        try:
+            specs = [
+                self.__share(P.data),
+                self.__share(P.indices),
+                self.__share(P.indptr),
+                self.__share(np.zeros(num_states, dtype=dtype)),
+                self.__share(np.zeros(num_rows, dtype=np.result_type(P.dtype, dtype))),
+            ]
+            self.__values, self.__out = [shared for _, shared in self.__segments[3:]]
+            bounds = np.searchsorted(
+                P.indptr, np.linspace(0, P.nnz, processes + 1), side="left"
+            )
+            bounds[0], bounds[-1] = 0, num_rows
+            for rows in zip(bounds[:-1], bounds[1:]):
+                if rows[0] == rows[1]:
+                    continue
+                start = Semaphore(0)
+                process = Process(
+                    target=_bellman_worker,
+                    args=(
+                        specs,
+                        (int(rows[0]), int(rows[1])),
+                        num_states,
+                        self.__command,
+                        start,
+                        self.__done,
+                        os.getpid(),
+                        self.timeout,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                self.__starts.append(start)
+                self.__processes.append(process)
+        except BaseException:
+            self.close()
+            raise
+
+    def __share(self, array):
+        segment = SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+        shared[...] = array
+        self.__segments.append((segment, shared))
+        return (segment.name, array.shape, array.dtype)
+
+    def dot(self, values):
+        self.__values[:] = values
+        for start in self.__starts:
+            start.release()
+        for _ in self.__processes:
+            while not self.__done.acquire(timeout=self.timeout):
+                if not all(process.is_alive() for process in self.__processes):
+                    raise RuntimeError("A Bellman backup worker exited unexpectedly.")
+        return self.__out
+
+    def close(self):
+        self.__command.value = -1
+        for start in self.__starts:
+            start.release()
+        for process in self.__processes:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.__processes = []
+        self.__starts = []
+        self.__values = self.__out = None
+        segments = [segment for segment, _ in self.__segments]
+        self.__segments = []
+        for segment in segments:
+            segment.close()
+            segment.unlink()
 
 
 class ValueIteration:
-    def __init__(self, mdp):
+    def __init__(self, mdp, values=None):
         self.mdp = mdp
-        self.values = np.max(self.mdp.rewards.toarray(), axis=1)
+        # given values warm-start the iteration, e.g. from a coarser grid
+        if values is None:
+            self.values = np.max(self.mdp.rewards.toarray(), axis=1)
+        else:
+            self.values = np.array(values, dtype=self.mdp.rewards.dtype)
+        self.policy_loss = np.inf
+        self.backup = None
+        self.__blocks = None
+        self.__predecessors = None
+        self.__priority = None
+        self.__self_loops = None
+        self.__off_diagonal = None
 
     def solve(
         self,
@@ -26,96 +249,128 @@ class ValueIteration:
         verbose=True,
         callback=None,
         parallel=True,
+        processes=None,
+        method="jacobi",
+        block_size=4096,
+        threshold=None,
+        checkpoint=None,
+        checkpoint_interval=60.0,
+        resume=True,
+        epsilon=None,
+        acceleration=None,
+        anderson_depth=10,
     ):
 
+        # method is "jacobi" (synchronous backups of all states, optionally in
+        # parallel), "gauss-seidel" (in-place sweeps over blocks of block_size
+        # states) or "prioritized" (prioritized sweeping of the states whose
+        # successors changed by more than threshold, block_size states at a time)
+        if method not in ("jacobi", "gauss-seidel", "prioritized"):
+            raise ValueError("Unknown value iteration method: {}.".format(method))
+        # with epsilon, the iteration stops as soon as the greedy policy is provably
+        # epsilon-optimal (span seminorm bound); acceleration="anderson" mixes the
+        # last anderson_depth iterates. Both need the synchronous jacobi backups.
+        if acceleration not in (None, "anderson"):
+            raise ValueError("Unknown acceleration: {}.".format(acceleration))
+        if method != "jacobi" and (epsilon is not None or acceleration is not None):
+            raise ValueError("epsilon and acceleration need method='jacobi'.")
         self.verbose = Verbose(verbose)
         self.verbose("solving with Value Iteration...")
-        best_iter = 0
-        min_val_diff = 0.001
         start_time = time()
-        last_time = time()
-        current_time = time()
+        self.__blocks = None
+        self.__predecessors = None
+        self.__priority = None
+        self.__self_loops = None
+        self.__off_diagonal = None
+        parallel = parallel and method == "jacobi"
+        sweep = {
+            "method": method,
+            "block_size": block_size,
+            "threshold": tolerance if threshold is None else threshold,
+        }
+        anderson = None if acceleration is None else _AndersonMixing(anderson_depth)
+        if epsilon is not None or anderson is not None:
+            # near discount 1 the span of T(V) - V soon drops to the resolution of
+            # float32 values, times 1 / (1 - discount) in the bound
+            self.values = self.values.astype(np.float64)
+
+        # values and policy are checkpointed to the file checkpoint every
+        # checkpoint_interval seconds and when solve returns or raises; with resume,
+        # an existing checkpoint is loaded and its iteration continued
+        self.iteration = -1
+        shape = self.mdp.states.shape
+        state = load_checkpoint(checkpoint, shape) if checkpoint and resume else None
+        if state is not None:
+            self.iteration, values, policy = state
+            self.values[:] = values
+            self.mdp.policy.update(policy)
+            self.verbose("resuming from iteration %d...\n" % (self.iteration + 1))
+        self.checkpointer = Checkpointer(checkpoint, checkpoint_interval, shape)
 
         if parallel:
-            self.shared = np.frombuffer(
-                Array(
-                    np.ctypeslib.as_ctypes_type(self.mdp.rewards.dtype),
-                    int(self.mdp.states.num_states * self.mdp.actions.num_actions),
-                ).get_obj(),
-                dtype=self.mdp.rewards.dtype,
+            self.backup = _BellmanBackup(
+                self.mdp.state_transition_probability,
+                self.values.dtype,
+                processes=processes,
             )
-            self.values = np.frombuffer(
-                Array(
-                    np.ctypeslib.as_ctypes_type(self.mdp.rewards.dtype), self.values
-                ).get_obj(),
-                dtype=self.mdp.rewards.dtype,
+        try:
+            self.__iterate(
+                sigma,
+                n_r,
+                n_alpha,
+                max_iteration,
+                tolerance,
+                earlystop,
+                callback,
+                parallel,
+                sweep,
+                epsilon,
+                anderson,
             )
-
-            def _worker(P, key, flag):
-                while True:
-                    if flag.value > 0:
-                        self.shared[key] = P.dot(self.values)
-                        flag.value = 0
-                    elif flag.value < 0:
-                        break
-
-            chunksize = np.ceil(
-                self.mdp.states.num_states * self.mdp.actions.num_actions / cpu_count()
+        finally:
+            if parallel:
+                self.backup.close()
+                self.backup = None
+            self.checkpointer.checkpoint(
+                self.iteration, self.values, self.mdp.policy.toarray(), force=True
             )
-            self.workers = []
-            for pid in range(cpu_count()):
-                key = slice(
-                    int(chunksize * pid),
-                    int(
-                        min(
-                            chunksize * (pid + 1),
-                            self.mdp.states.num_states * self.mdp.actions.num_actions,
-                        )
-                    ),
-                    None,
-                )
-                flag = Value("i", 0)
-                self.workers.append(
-                    (
-                        Process(
-                            target=_worker,
-                            args=(
-                                self.mdp.state_transition_probability[key],
-                                key,
-                                flag,
-                            ),
-                        ),
-                        flag,
-                    )
-                )
-                self.workers[-1][0].start()
+            self.checkpointer.close()
+            del self.checkpointer
+        self.verbose("Time elapsed: %f (sec).\n" % (time() - start_time))
+        del self.verbose
 
-        for iter in range(int(max_iteration)):
-            value_diff = self.update(parallel=parallel)
+    def __iterate(
+        self,
+        sigma,
+        n_r,
+        n_alpha,
+        max_iteration,
+        tolerance,
+        earlystop,
+        callback,
+        parallel,
+        sweep,
+        epsilon,
+        anderson,
+    ):
+
+        best_iter = self.iteration + 1
+        min_val_diff = 0.001
+        last_time = time()
+        for iter in range(self.iteration + 1, int(max_iteration)):
+            previous_values = None if anderson is None else self.values.copy()
+            value_diff = self.update(parallel=parallel, **sweep)
+            self.iteration = iter
             if value_diff <= 0.001:
                 min_val_diff = min(value_diff, min_val_diff)
                 if value_diff <= min_val_diff:
                     best_iter = iter
-                    # save the best result
-                    result_filename = "result_" + str(sigma)[:3]
-                    self.save(result_filename)
-
-                    value_filename = "value_" + str(sigma)[:3] + ".png"
-                    value_plot = self.values.reshape((n_r, n_alpha))
-                    value_tips = np.flipud(
-                        value_plot.T
-                    )  # value plot of Tips paper format
-                    plt.imsave(value_filename, value_tips, cmap="gray")
-
-                    policy_filename = "policy_" + str(sigma)[:3] + ".png"
-                    policy_plot = self.mdp.policy.toarray().reshape((n_r, n_alpha))
-                    policy_tips = np.flipud(
-                        policy_plot.T
-                    )  # policy plot of Tips paper format
-                    plt.imsave(
-                        policy_filename,
-                        policy_tips,
-                        cmap="gray",
+                    # save the best result in the background
+                    self.checkpointer.submit(
+                        "best",
+                        _result_writer(sigma, n_r, n_alpha),
+                        values=self.values,
+                        policy=self.mdp.policy.toarray(),
                     )
                     self.verbose("possible best model saved...")
 
@@ -129,38 +384,42 @@ class ValueIteration:
 
             current_time = time()
             self.verbose(
-                "Iter.: %d, Value diff.: %f, Step time: %f (sec).\n"
-                % (iter + 1, value_diff, current_time - last_time)
+                "Iter.: %d, Value diff.: %f, Policy loss: %f, Step time: %f (sec).\n"
+                % (iter + 1, value_diff, self.policy_loss, current_time - last_time)
             )
             last_time = current_time
 
             if callback is not None:
                 callback(self)
+            self.checkpointer.checkpoint(
+                self.iteration, self.values, self.mdp.policy.toarray()
+            )
 
             if value_diff is np.nan or value_diff is np.inf:
                 raise OverflowError("Divergence detected.")
 
             if value_diff < tolerance:
                 break
+            if epsilon is not None and self.policy_loss < epsilon:
+                self.verbose(
+                    "The policy is %g-optimal after %d iterations.\n"
+                    % (epsilon, iter + 1)
+                )
+                break
+            if anderson is not None:
+                self.values[:] = anderson(previous_values, self.values)
 
-        for p, flag in self.workers:
-            flag.value = -1
-            p.join()
-        self.verbose("Time elapsed: %f (sec).\n" % (current_time - start_time))
-        del self.verbose
-
-    def update(self, parallel=True):
+    def update(self, parallel=True, method="jacobi", block_size=4096, threshold=1e-8):
 
+        if method == "gauss-seidel":
+            return self.__gauss_seidel_update(block_size)
+        if method == "prioritized":
+            return self.__prioritized_update(block_size, threshold)
         self.verbose("Computing action values...")
-        if parallel:
-            for _, flag in self.workers:
-                flag.value = 1
-            for _, flag in self.workers:
-                while True:
-                    if flag.value == 0:
-                        break
+        if parallel and self.backup is not None:
             q = self.mdp.rewards.toarray() + np.multiply(
-                self.mdp.discount, self.shared.reshape(self.mdp.rewards.shape)
+                self.mdp.discount,
+                self.backup.dot(self.values).reshape(self.mdp.rewards.shape),
             )
         else:
             q = self.mdp.rewards.toarray() + np.multiply(
@@ -176,6 +435,9 @@ class ValueIteration:
         self.mdp.policy.update(policy)
 
         value_diff = self.values[:] - new_values[:]
+        # the greedy policy of the backed up values loses at most
+        # discount / (1 - discount) * span(T(V) - V) against the optimal one
+        self.policy_loss = _policy_loss(self.mdp.discount, value_diff)
         value_diff = np.sqrt(
             np.dot(value_diff, value_diff) / self.mdp.states.num_states
         )
@@ -184,14 +446,126 @@ class ValueIteration:
 
         return value_diff
 
+    def __transition_matrix(self):
+        # the in-place methods solve for the self-transition of every state,
+        # q = (r + discount * P_off @ V) / (1 - discount * p_ss), which has the same
+        # fixed point and converges much faster on fine grids where most of the
+        # probability mass stays in the same cell. P_off, the transition matrix
+        # without its self-transitions, is kept as a separate CSR matrix.
+        if self.__off_diagonal is None:
+            self.mdp.state_transition_probability.tocsr()
+            P = self.mdp.state_transition_probability.tospmat()
+            rows = np.repeat(np.arange(P.shape[0]), np.diff(P.indptr))
+            loops = P.indices == rows // self.mdp.actions.num_actions
+            self.__self_loops = np.bincount(
+                rows[loops], weights=P.data[loops], minlength=P.shape[0]
+            ).reshape(self.mdp.rewards.shape)
+            self.__off_diagonal = sp.csr_matrix(
+                (P.data[~loops], (rows[~loops], P.indices[~loops])), shape=P.shape
+            )
+        return self.__off_diagonal
+
+    def __backup(self, P, rewards, states):
+        loops = self.mdp.discount * self.__self_loops[states]
+        q = (
+            rewards
+            + np.multiply(
+                self.mdp.discount,
+                P.dot(self.values).reshape(
+                    (len(rewards), self.mdp.actions.num_actions)
+                ),
+            )
+        ) / (1 - loops)
+        policy = np.argmax(q, axis=1)
+        new_values = np.take_along_axis(q, policy[:, np.newaxis], axis=1).ravel()
+        new_values = new_values.astype(self.values.dtype)
+        self.mdp.policy.toarray()[states] = policy
+        value_diff = new_values - self.values[states]
+        self.values[states] = new_values
+        return value_diff
+
+    def __gauss_seidel_update(self, block_size):
+
+        self.verbose("Sweeping state blocks...")
+        num_states, num_actions = self.mdp.rewards.shape
+        if self.__blocks is None:
+            P = self.__transition_matrix()
+            bounds = list(range(0, num_states, block_size)) + [num_states]
+            self.__blocks = [
+                (
+                    slice(first, last),
+                    _csr_rows(
+                        P.data,
+                        P.indices,
+                        P.indptr,
+                        (first * num_actions, last * num_actions),
+                        num_states,
+                    ),
+                )
+                for first, last in zip(bounds[:-1], bounds[1:])
+            ]
+        rewards = self.mdp.rewards.toarray()
+        squared_diff = 0.0
+        for states, P in self.__blocks:
+            # later blocks already see the values updated by earlier ones
+            value_diff = self.__backup(P, rewards[states], states)
+            squared_diff += np.dot(value_diff, value_diff)
+
+        return np.sqrt(squared_diff / num_states)
+
+    def __prioritized_update(self, block_size, threshold):
+
+        self.verbose("Backing up prioritized states...")
+        num_states, num_actions = self.mdp.rewards.shape
+        P = self.__transition_matrix()
+        if self.__predecessors is None:
+            # row s of the predecessor index holds, for every state that can reach
+            # s, the probability to do so summed over the actions
+            sources = np.repeat(np.arange(P.shape[0]) // num_actions, np.diff(P.indptr))
+            self.__predecessors = sp.csr_matrix(
+                (P.data, (P.indices, sources)), shape=(num_states, num_states)
+            )
+            self.__priority = np.full(num_states, np.inf)
+        rewards = self.mdp.rewards.toarray()
+        priority = self.__priority
+        # one update backs up as many states as a full sweep would
+        budget = num_states
+        squared_diff = 0.0
+        while budget > 0:
+            states = np.flatnonzero(priority > threshold)
+            if len(states) == 0:
+                break
+            size = min(block_size, budget)
+            if len(states) > size:
+                states = np.sort(
+                    states[np.argpartition(priority[states], -size)[-size:]]
+                )
+            budget -= len(states)
+            priority[states] = 0
+            rows = (
+                states[:, np.newaxis] * num_actions + np.arange(num_actions)
+            ).ravel()
+            value_diff = np.abs(self.__backup(P[rows], rewards[states], states))
+            squared_diff += np.dot(value_diff, value_diff)
+            # the priority of a state bounds how much a backup would change it since
+            # its last one: discount * sum over actions of p(s'|s, a) * |change of s'|
+            changed = value_diff > threshold
+            if np.any(changed):
+                priority += self.mdp.discount * self.__predecessors[
+                    states[changed]
+                ].T.dot(value_diff[changed])
+
+        return np.sqrt(squared_diff / num_states)
+
     def save(self, filename):
         np.savez(filename, values=self.values, policy=self.mdp.policy.toarray())
 
 
 class PolicyIteration:
-    def __init__(self, mdp):
+    def __init__(self, mdp, values=None):
         self.mdp = mdp
-        self.values = None
+        # given values warm-start the iteration together with the current policy
+        self.values = None if values is None else np.array(values)
         # Identity matrix $I_{|s|}$ and $I_{|a|}$ for computation
         self.terminal_state = False
         self.__I = sp.identity(
@@ -213,40 +587,76 @@ class PolicyIteration:
         earlystop=100,
         verbose=True,
         callback=None,
+        evaluation_sweeps=None,
+        checkpoint=None,
+        checkpoint_interval=60.0,
+        resume=True,
     ):
 
+        # with evaluation_sweeps=k, modified policy iteration evaluates each policy
+        # with k in-place backups from the previous values instead of a linear solve;
+        # checkpoint, checkpoint_interval and resume work as in ValueIteration.solve
         self.verbose = Verbose(verbose)
         self.verbose("solving with Policy Iteration...")
-        best_iter = 0
-        min_val_diff = 0.001
         start_time = time()
-        last_time = time()
-        current_time = time()
 
-        for iter in range(int(max_iteration)):
+        self.iteration = -1
+        shape = self.mdp.states.shape
+        state = load_checkpoint(checkpoint, shape) if checkpoint and resume else None
+        if state is not None:
+            self.iteration, self.values, policy = state
+            self.mdp.policy.update(policy)
+            self.verbose("resuming from iteration %d...\n" % (self.iteration + 1))
+        self.checkpointer = Checkpointer(checkpoint, checkpoint_interval, shape)
+        try:
+            self.__iterate(
+                sigma,
+                n_r,
+                n_alpha,
+                max_iteration,
+                tolerance,
+                earlystop,
+                callback,
+                evaluation_sweeps,
+            )
+        finally:
+            if self.values is not None:
+                self.checkpointer.checkpoint(
+                    self.iteration, self.values, self.mdp.policy.toarray(), force=True
+                )
+            self.checkpointer.close()
+            del self.checkpointer
+        self.verbose("Time elapsed: %f (sec).\n" % (time() - start_time))
+        del self.verbose
+
+    def __iterate(
+        self,
+        sigma,
+        n_r,
+        n_alpha,
+        max_iteration,
+        tolerance,
+        earlystop,
+        callback,
+        evaluation_sweeps,
+    ):
+
+        best_iter = self.iteration + 1
+        min_val_diff = 0.001
+        last_time = time()
+        for iter in range(self.iteration + 1, int(max_iteration)):
 
-            value_diff = self.update()
+            value_diff = self.update(evaluation_sweeps=evaluation_sweeps)
+            self.iteration = iter
             min_val_diff = min(value_diff, min_val_diff)
             if value_diff <= min_val_diff:
                 best_iter = iter
-                # save the best result
-                result_filename = "result_" + str(sigma)[:3]
-                self.save(result_filename)
-
-                value_filename = "value_" + str(sigma)[:3] + ".png"
-                value_plot = self.values.reshape((n_r, n_alpha))
-                value_tips = np.flipud(value_plot.T)  # value plot of Tips paper format
-                plt.imsave(value_filename, value_tips, cmap="gray")
-
-                policy_filename = "policy_" + str(sigma)[:3] + ".png"
-                policy_plot = self.mdp.policy.toarray().reshape((n_r, n_alpha))
-                policy_tips = np.flipud(
-                    policy_plot.T
-                )  # policy plot of Tips paper format
-                plt.imsave(
-                    policy_filename,
-                    policy_tips,
-                    cmap="gray",
+                # save the best result in the background
+                self.checkpointer.submit(
+                    "best",
+                    _result_writer(sigma, n_r, n_alpha),
+                    values=self.values,
+                    policy=self.mdp.policy.toarray(),
                 )
                 self.verbose("possible best model saved...")
 
@@ -267,6 +677,9 @@ class PolicyIteration:
 
             if callback is not None:
                 callback(self)
+            self.checkpointer.checkpoint(
+                self.iteration, self.values, self.mdp.policy.toarray()
+            )
             if iter > 0:
                 if value_diff is np.nan or value_diff is np.inf:
                     raise OverflowError("Divergence detected.")
@@ -274,11 +687,22 @@ class PolicyIteration:
             if value_diff < tolerance:
                 break
 
-        current_time = time()
-        self.verbose("Time elapsed: %f (sec).\n" % (current_time - start_time))
-        del self.verbose
+    def policy_matrix(self, policy=None):
+        # P^pi as one gather of the rows (s, policy[s]) of the CSR transition matrix
+        policy = self.mdp.policy.toarray() if policy is None else policy
+        self.mdp.state_transition_probability.tocsr()
+        P = self.mdp.state_transition_probability.tospmat()
+        rows = np.arange(self.mdp.states.num_states) * self.mdp.actions.num_actions
+        return P[rows + policy.astype(int)]
 
-    def update(self, direct_method=False):
+    def __action_values(self, values):
+        # $Q(s, a) = R(s, a) + \gamma \sum_{s'} P(s' | s, a) V(s')$
+        return self.mdp.rewards.toarray() + np.multiply(
+            self.mdp.discount,
+            self.mdp.state_transition_probability.dot(values),
+        ).reshape(self.mdp.rewards.shape)
+
+    def update(self, direct_method=False, evaluation_sweeps=None):
 
         # Compute the value difference $|\V_{k}-V_{k+1}|\$ for check the convergence
         if self.values is None:
@@ -297,61 +721,60 @@ class PolicyIteration:
             self.mdp.policy.update(policy)
             value_diff = np.inf
         else:
-            # Compute the value $V(s)$ via solving the linear system $(I-\gamma P^{\pi}), R^{\pi}$
-            self.verbose("Constructing linear system...")
-            A = self.__I - self.mdp.discount * sp.vstack(
-                [
-                    self.mdp.state_transition_probability[s, a, :]
-                    for s, a in enumerate(self.mdp.policy)
-                ],
-                format="csr",
-            )
-            if np.all(A.diagonal()):
-                b = self.mdp.rewards[self.mdp.policy.one_hot()]
-                if self.mdp.rewards.issparse:
-                    b = b.T
-                if direct_method:
-                    self.verbose("Solving linear system (SuperLU)...")
-                    new_values = spsolve(A, b)
-                else:
-                    self.verbose("Solving linear system (BiCGstab)...")
-                    new_values, info = bicgstab(
-                        A, b, x0=self.values, tol=1e-8, maxiter=self.__innerloop_maxiter
-                    )
-                    if info < 0:
-                        self.verbose("BiCGstab failed. Call LGMRES...")
-                        new_values, info = lgmres(
+            if evaluation_sweeps is not None:
+                # Approximate $V^{\pi}$ with k backups $V \leftarrow R^{\pi} + \gamma P^{\pi} V$
+                self.verbose("Evaluating policy (%d sweeps)..." % evaluation_sweeps)
+                P = self.policy_matrix()
+                b = np.take_along_axis(
+                    self.mdp.rewards.toarray(),
+                    self.mdp.policy.toarray()[:, np.newaxis].astype(int),
+                    axis=1,
+                ).ravel()
+                new_values = self.values
+                for _ in range(evaluation_sweeps):
+                    new_values = b + np.multiply(self.mdp.discount, P.dot(new_values))
+            else:
+                # Compute the value $V(s)$ via solving the linear system $(I-\gamma P^{\pi}), R^{\pi}$
+                self.verbose("Constructing linear system...")
+                A = self.__I - self.mdp.discount * self.policy_matrix()
+                if np.all(A.diagonal()):
+                    b = self.mdp.rewards[self.mdp.policy.one_hot()]
+                    if self.mdp.rewards.issparse:
+                        b = b.T
+                    if direct_method:
+                        self.verbose("Solving linear system (SuperLU)...")
+                        new_values = spsolve(A, b)
+                    else:
+                        self.verbose("Solving linear system (BiCGstab)...")
+                        new_values, info = bicgstab(
                             A,
                             b,
-                            x0=new_values,
+                            x0=self.values,
                             tol=1e-8,
-                            maxiter=int(max(np.sqrt(self.__innerloop_maxiter), 10)),
+                            maxiter=self.__innerloop_maxiter,
                         )
+                        if info < 0:
+                            self.verbose("BiCGstab failed. Call LGMRES...")
+                            new_values, info = lgmres(
+                                A,
+                                b,
+                                x0=new_values,
+                                tol=1e-8,
+                                maxiter=int(max(np.sqrt(self.__innerloop_maxiter), 10)),
+                            )
+                else:
+                    self.verbose(
+                        "det(A) is zero. Use value iteration update instead..."
+                    )
+                    new_values = np.max(self.__action_values(self.values), axis=1)
 
-                self.verbose("Updating policy...")
-                self.mdp.policy.update(
-                    np.argmax(
-                        self.mdp.rewards.toarray()
-                        + np.multiply(
-                            self.mdp.discount,
-                            self.mdp.state_transition_probability.dot(new_values),
-                        ).reshape(self.mdp.rewards.shape),
-                        axis=1,
-                    ).astype(self.mdp.policy.dtype)
+            # greedy policy with respect to the evaluated values
+            self.verbose("Updating policy...")
+            self.mdp.policy.update(
+                np.argmax(self.__action_values(new_values), axis=1).astype(
+                    self.mdp.policy.dtype
                 )
-
-            else:
-                self.verbose("det(A) is zero. Use value iteration update instead...")
-                q = self.mdp.rewards.toarray() + np.multiply(
-                    self.mdp.discount,
-                    self.mdp.state_transition_probability.dot(self.values),
-                ).reshape(self.mdp.rewards.shape)
-                self.verbose("Updating policy...")
-                policy = np.argmax(q, axis=1).astype(self.mdp.policy.dtype)
-                new_values = np.take_along_axis(
-                    q, policy[:, np.newaxis], axis=1
-                ).ravel()
-                self.mdp.policy.update(policy)
+            )
 
             value_diff = self.values[:] - new_values[:]
             # if np.mean(value_diff)>0:
@@ -363,3 +786,231 @@ class PolicyIteration:
             self.values = new_values.copy()
 
         return value_diff
+
+
+class BatchValueIteration:
+    """Value iteration of several models on the same states and actions at once.
+
+    The models in ``mdps``, e.g. a sweep over ``sigma`` or the discount, may differ
+    in their rewards, discounts and transition probabilities. Their value vectors
+    are the columns of ``values`` and are backed up together, by one sparse-matrix
+    times dense-matrix product when all models share their transition
+    probabilities, or by segment sums over the rows of a shared sparsity pattern
+    when only the probabilities differ. Converged models are left out of the following backups. The
+    policies are kept in the columns of ``policy`` and in the ``policy`` of every
+    model.
+    """
+
+    def __init__(self, mdps, values=None):
+        self.mdps = list(mdps)
+        num_states, num_actions = self.mdps[0].rewards.shape
+        for mdp in self.mdps[1:]:
+            if mdp.rewards.shape != (num_states, num_actions):
+                raise ValueError("The models must have the same states and actions.")
+        # model-major rewards, so that the maximum over the actions is contiguous
+        self.rewards = np.stack([mdp.rewards.toarray() for mdp in self.mdps])
+        self.discount = np.array(
+            [mdp.discount for mdp in self.mdps], dtype=self.rewards.dtype
+        )
+        if values is None:
+            self.values = np.max(self.rewards, axis=2).T.copy()
+        else:
+            self.values = np.array(values, dtype=self.rewards.dtype)
+        self.policy = np.stack([mdp.policy.toarray() for mdp in self.mdps], axis=1)
+        self.iteration = -1
+
+        matrices = []
+        for mdp in self.mdps:
+            mdp.state_transition_probability.tocsr()
+            matrices.append(mdp.state_transition_probability.tospmat())
+        first = matrices[0]
+        self.__shared = None
+        self.__pattern = None
+        if all(
+            matrix is first
+            or (
+                np.array_equal(matrix.indptr, first.indptr)
+                and np.array_equal(matrix.indices, first.indices)
+            )
+            for matrix in matrices[1:]
+        ):
+            if all(
+                matrix is first or np.array_equal(matrix.data, first.data)
+                for matrix in matrices[1:]
+            ):
+                self.__shared = first
+            else:
+                # one sparsity pattern with the probabilities of the models in the
+                # columns of data; rows without successors (terminal states) are
+                # left out of the segment sums
+                nonempty = np.diff(first.indptr) > 0
+                self.__pattern = (
+                    first.indices,
+                    np.stack([matrix.data for matrix in matrices], axis=1),
+                    nonempty,
+                    first.indptr[:-1][nonempty],
+                )
+        self.__matrices = matrices
+
+    def __q_values(self, models):
+        # discount_k * P_k @ values[:, k] + rewards_k, one row per model of models
+        q = np.empty((len(models), self.rewards[0].size), dtype=self.rewards.dtype)
+        # all models in their own order, so that their tables need no gather
+        in_order = np.array_equal(models, np.arange(len(self.mdps)))
+        discount = self.discount[models, np.newaxis]
+        if self.__shared is not None and len(models) >= BATCH_MIN_MODELS:
+            np.multiply(self.__shared.dot(self.values[:, models]).T, discount, out=q)
+        elif self.__pattern is not None and len(models) >= BATCH_MIN_MODELS:
+            # the products of every model in one pass over the shared pattern
+            indices, data, nonempty, starts = self.__pattern
+            products = np.ascontiguousarray(self.values[:, models]).take(
+                indices, axis=0
+            )
+            products *= data if in_order else data[:, models]
+            sums = np.zeros((len(nonempty), len(models)), dtype=products.dtype)
+            sums[nonempty] = np.add.reduceat(products, starts, axis=0)
+            np.multiply(sums.T, discount, out=q)
+        else:
+            for i, k in enumerate(models):
+                values = np.ascontiguousarray(self.values[:, k])
+                np.multiply(self.__matrices[k].dot(values), discount[i], out=q[i])
+        q = q.reshape((len(models),) + self.rewards.shape[1:])
+        q += self.rewards if in_order else self.rewards[models]
+        return q
+
+    def update(self, models=None):
+        # backs up the models with the given indices (default: all) and returns the
+        # root-mean-square change of their values
+        models = np.arange(len(self.mdps)) if models is None else np.asarray(models)
+        q = self.__q_values(models)
+        policy = np.argmax(q, axis=2)
+        new_values = np.take_along_axis(q, policy[:, :, np.newaxis], axis=2)[:, :, 0]
+        new_values = new_values.T.astype(self.values.dtype)
+        self.policy[:, models] = policy.T
+        for k, model_policy in zip(models, policy):
+            self.mdps[k].policy.update(model_policy.astype(self.policy.dtype))
+        value_diff = np.sqrt(
+            np.mean(np.square(self.values[:, models] - new_values), axis=0)
+        )
+        self.values[:, models] = new_values
+        return value_diff
+
+    def solve(
+        self,
+        max_iteration=1e3,
+        tolerance=1e-8,
+        verbose=True,
+        callback=None,
+        sigmas=None,
+        n_r=None,
+        n_alpha=None,
+    ):
+        """Iterates until the value difference of every model is below tolerance.
+
+        With ``sigmas`` (one per model), ``n_r`` and ``n_alpha`` the results are
+        written as ``result_<sigma>.npz`` and plots, as ``ValueIteration.solve``
+        does.
+        """
+
+        self.verbose = Verbose(verbose)
+        self.verbose("solving %d models with Value Iteration..." % len(self.mdps))
+        start_time = time()
+        models = np.arange(len(self.mdps))
+        last_time = time()
+        for iter in range(self.iteration + 1, int(max_iteration)):
+            value_diff = self.update(models)
+            self.iteration = iter
+            if np.any(np.isnan(value_diff)) or np.any(np.isinf(value_diff)):
+                raise OverflowError("Divergence detected.")
+            current_time = time()
+            self.verbose(
+                "Iter.: %d, Value diff.: %f, Models left: %d, Step time: %f (sec).\n"
+                % (
+                    iter + 1,
+                    np.max(value_diff),
+                    np.count_nonzero(value_diff >= tolerance),
+                    current_time - last_time,
+                )
+            )
+            last_time = current_time
+            if callback is not None:
+                callback(self)
+            models = models[value_diff >= tolerance]
+            if len(models) == 0:
+                break
+
+        if sigmas is not None:
+            for k, sigma in enumerate(sigmas):
+                _result_writer(sigma, n_r, n_alpha)(
+                    self.values[:, k], self.policy[:, k]
+                )
+        self.verbose("Time elapsed: %f (sec).\n" % (time() - start_time))
+        del self.verbose
+
+    def save(self, filename):
+        np.savez(filename, values=self.values, policy=self.policy)
+
+
+def _prolong(coarse_states, states, values, policy):
+    # barycentric interpolation of the coarse values at the fine grid points and
+    # the action of the nearest coarse state
+    points = states.as_array()
+    S, P = coarse_states.computeBarycentricBatch(points)
+    fine_values = np.sum(P * values[S], axis=1).astype(values.dtype)
+    return fine_values, policy[coarse_states.indices(points)]
+
+
+def multigrid_solve(
+    build,
+    states,
+    solver=ValueIteration,
+    levels=3,
+    factor=2,
+    coarse_tolerance=1e-4,
+    coarse_max_iteration=1e4,
+    **solve_kwargs,
+):
+    """Solves the model on a ``States`` grid coarse to fine.
+
+    ``build(states)`` returns the ``MarkovDecisionProcess`` on a grid. The grid is
+    coarsened ``levels - 1`` times by ``factor`` (see :meth:`States.coarsen`), the
+    coarsest model is solved first, and every solution is prolonged to the next
+    finer grid as the initial values and policy of its ``solver``
+    (``ValueIteration`` or ``PolicyIteration``). Coarse levels iterate until the
+    value difference drops below ``coarse_tolerance``; the finest level is solved
+    with ``solver.solve(**solve_kwargs)`` and its solver is returned.
+    """
+
+    grids = [states]
+    for _ in range(levels - 1):
+        coarse = grids[-1].coarsen(factor)
+        if coarse.shape == grids[-1].shape:
+            break
+        grids.append(coarse)
+    verbose = Verbose(solve_kwargs.get("verbose", True))
+    values = policy = previous = None
+    for grid in grids[:0:-1]:
+        start_time = time()
+        if values is not None:
+            values, policy = _prolong(previous, grid, values, policy)
+        dp = solver(build(grid), values=values)
+        if policy is not None:
+            dp.mdp.policy.update(policy.astype(dp.mdp.policy.dtype))
+        dp.verbose = Verbose(False)
+        iteration = -1
+        for iteration in range(int(coarse_max_iteration)):
+            if dp.update() < coarse_tolerance:
+                break
+        del dp.verbose
+        verbose(
+            "Coarse grid %s solved in %d iterations, %f (sec).\n"
+            % (grid.shape, iteration + 1, time() - start_time)
+        )
+        values, policy, previous = dp.values, dp.mdp.policy.toarray(), grid
+    if values is not None:
+        values, policy = _prolong(previous, states, values, policy)
+    dp = solver(build(states), values=values)
+    if policy is not None:
+        dp.mdp.policy.update(policy.astype(dp.mdp.policy.dtype))
+    dp.solve(**solve_kwargs)
+    return dp
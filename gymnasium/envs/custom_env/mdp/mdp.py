@@ -1,4 +1,7 @@
-from multiprocessing import Manager, Pool, cpu_count
+import json
+import os
+from bisect import bisect_left
+from multiprocessing import Pool, RawArray, cpu_count
 from time import time
 
 import numpy as np
@@ -15,12 +18,176 @@ __all__ = [
 ]
 
 
+_sampling = {}
+
+
+def _shared_array(dtype, size):
+    return RawArray(np.ctypeslib.as_ctypes_type(dtype), max(int(size), 1))
+
+
+def _init_sampling(sampler, states, num_actions, sample_reward, buffers, capacity):
+    _sampling.update(
+        sampler=sampler,
+        states=states,
+        num_actions=num_actions,
+        sample_reward=sample_reward,
+        capacity=capacity,
+        buffers=buffers,
+    )
+
+
+def _sample_chunk(chunk):
+    # samples the states of one chunk and writes their COO triplets into its
+    # segment of the shared buffers; triplets that do not fit are returned
+    (start, stop), segment = chunk
+    sampler, states = _sampling["sampler"], _sampling["states"]
+    num_actions, capacity = _sampling["num_actions"], _sampling["capacity"]
+    rows, cols, probs, rewards = [
+        None if buffer is None else np.frombuffer(buffer, dtype=dtype)
+        for buffer, dtype in _sampling["buffers"]
+    ]
+    offset = segment * capacity
+    count = 0
+    overflow = []
+    for s, state in zip(range(start, stop), states.as_array(start, stop)):
+        if any(ArrEq(state) == terminal for terminal in states.terminal_states):
+            continue
+        if _sampling["sample_reward"]:
+            spmat, arr = sampler(state)
+            rewards[s * num_actions : (s + 1) * num_actions] = np.ravel(arr)
+        else:
+            spmat = sampler(state)
+        spmat = sp.coo_matrix(spmat)
+        nnz = spmat.nnz
+        if count + nnz <= capacity:
+            rows[offset + count : offset + count + nnz] = spmat.row + s * num_actions
+            cols[offset + count : offset + count + nnz] = spmat.col
+            probs[offset + count : offset + count + nnz] = spmat.data
+            count += nnz
+        else:
+            overflow.append((spmat.row + s * num_actions, spmat.col, spmat.data))
+    if overflow:
+        overflow = [np.concatenate(triplet) for triplet in zip(*overflow)]
+    return segment, stop - start, count, overflow
+
+
+def _index_dtype(*sizes):
+    # narrowest CSR index dtype for the given dimensions and number of non-zeros
+    return np.int32 if max(sizes) <= np.iinfo(np.int32).max else np.int64
+
+
+def _action_index_dtype(num_actions):
+    # narrowest unsigned dtype that holds the action indices
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if num_actions - 1 <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _compact_csr(matrix, dtype=np.float32):
+    matrix = matrix.tocsr()
+    index_dtype = _index_dtype(matrix.nnz, *matrix.shape)
+    return sp.csr_matrix(
+        (
+            matrix.data.astype(dtype, copy=False),
+            matrix.indices.astype(index_dtype, copy=False),
+            matrix.indptr.astype(index_dtype, copy=False),
+        ),
+        shape=matrix.shape,
+        copy=False,
+    )
+
+
+def _action_indices(data, num_actions):
+    # converts a policy table (possibly stored as floats) to compact action indices
+    indices = np.asarray(data).astype(np.int64)
+    if not np.array_equal(indices, data):
+        raise ValueError("The policy does not hold action indices.")
+    if len(indices) and (indices.min() < 0 or indices.max() >= num_actions):
+        raise ValueError(
+            "Policy action indices are out of range [0, {}).".format(num_actions)
+        )
+    return indices.astype(_action_index_dtype(num_actions))
+
+
+def _axis_lookup(state_list):
+    # (sorted, origin, inverse spacing, grid values) of a state axis for
+    # nearest-index queries.
+    # The spacing is only kept if every grid point lies within a quarter cell of
+    # the uniform grid, so that the closed-form position is at most one off.
+    grid = state_list.astype(np.float64)
+    values = grid.tolist()
+    n = len(grid)
+    if n < 2:
+        return True, None, None, values
+    if np.any(np.diff(grid) <= 0):
+        return False, None, None, values
+    spacing = (grid[-1] - grid[0]) / (n - 1)
+    if np.abs(grid - (grid[0] + spacing * np.arange(n))).max() <= spacing / 4:
+        return True, grid[0], 1 / spacing, values
+    return True, None, None, values
+
+
+def _nearest_index(state_list, lookup, x):
+    # nearest grid point of every x; ties go to the lower index, as with np.argmin
+    is_sorted, origin, inv_spacing, _ = lookup
+    x = np.asarray(x)
+    x = x.astype(np.result_type(x, state_list))
+    if not is_sorted:
+        return np.argmin(np.abs(state_list - x[..., np.newaxis]), axis=-1)
+    n = len(state_list)
+    if inv_spacing is None:
+        idx = np.searchsorted(state_list, x)
+    else:
+        idx = np.clip(np.ceil((x - origin) * inv_spacing), 0, n).astype(int)
+        # correct the estimate to the searchsorted position
+        idx -= (idx > 0) & (x <= state_list[np.maximum(idx - 1, 0)])
+        idx += (idx < n) & (x > state_list[np.minimum(idx, n - 1)])
+    below = np.maximum(idx - 1, 0)
+    above = np.minimum(idx, n - 1)
+    return np.where(
+        np.abs(state_list[below] - x) <= np.abs(state_list[above] - x), below, above
+    )
+
+
+def _triplets_to_csr(rows, cols, probs, shape, dtype, atol):
+    # sums duplicate triplets into a CSR matrix and checks that every non-empty
+    # row (terminal states have none) is a probability distribution
+    index_dtype = _index_dtype(len(probs), *shape)
+    matrix = sp.coo_matrix(
+        (
+            np.asarray(probs, dtype=dtype),
+            (
+                np.asarray(rows).astype(index_dtype, copy=False),
+                np.asarray(cols).astype(index_dtype, copy=False),
+            ),
+        ),
+        shape=shape,
+    ).tocsr()
+    if atol is not None:
+        if len(matrix.data) and matrix.data.min() < 0:
+            raise ValueError("Transition probabilities must be non-negative.")
+        sums = np.asarray(matrix.sum(axis=1, dtype=np.float64)).ravel()
+        invalid = np.flatnonzero((np.diff(matrix.indptr) > 0) & (abs(sums - 1) > atol))
+        if len(invalid):
+            state, action = divmod(invalid[0], shape[0] // shape[1])
+            raise ValueError(
+                "Transition probabilities of {} (state, action) pairs do not sum "
+                "to 1, e.g. state {} action {} sums to {}.".format(
+                    len(invalid), state, action, sums[invalid[0]]
+                )
+            )
+    return matrix
+
+
 class States:
     def __init__(
         self, *state_lists, cycles=None, terminal_states=None, dtype=np.float32
     ):
         self.__data = None
         self.__cycles = None
+        self.__lookup = None
+        self.__strides = None
         self.terminal_states = None
         self.update(
             *state_lists, cycles=cycles, terminal_states=terminal_states, dtype=dtype
@@ -29,12 +196,19 @@ class States:
     def update(self, *state_lists, cycles=None, terminal_states=None, dtype=np.float32):
 
         self.__data = [np.array(state_list, dtype=dtype) for state_list in state_lists]
+        self.__lookup = [_axis_lookup(state_list) for state_list in self.__data]
+        self.__strides = [
+            int(np.prod(self.shape[idx + 1 :], dtype=int))
+            for idx in range(len(self.__data))
+        ]
         # print("printing state__data:")
         # print(self.__data)
         if cycles is None:
             self.__cycles = [np.inf] * len(state_lists)
         elif len(cycles) == len(state_lists):
-            self.__cycles = np.array(cycles, dtype=dtype)
+            self.__cycles = np.array(
+                [np.inf if cycle is None else cycle for cycle in cycles], dtype=dtype
+            )
         else:
             raise ValueError(
                 "operands could not be broadcast together with shapes ({},) ({},)".format(
@@ -81,34 +255,8 @@ class States:
             raise KeyError("Unsupported key type.")
 
     def __iter__(self):
-        class SubIterator:
-            def __init__(cls, data, shape, num_states, dtype):
-                cls.dtype = dtype
-                cls.__data = data
-                cls.__shape = shape
-                cls.__num_states = num_states
-                cls.__dim = len(cls.__shape)
-                cls.__counters = [0] * cls.__dim
-                cls.__total_count = 0
-
-            def __next__(cls):
-                cls.__total_count += 1
-                if cls.__total_count > cls.__num_states:
-                    raise StopIteration()
-                else:
-                    ret = [
-                        state_list[count]
-                        for count, state_list in zip(cls.__counters, cls.__data)
-                    ]
-                for d in range(cls.__dim)[::-1]:
-                    if cls.__counters[d] < (cls.__shape[d] - 1):
-                        cls.__counters[d] += 1
-                        break
-                    else:
-                        cls.__counters[d] = 0
-                return np.array(ret, dtype=cls.dtype)
-
-        return SubIterator(self.__data, self.shape, self.num_states, self.dtype)
+        for _, chunk in self.iter_chunks():
+            yield from chunk
 
     @property
     def shape(self):
@@ -137,24 +285,24 @@ class States:
                 else:
                     d1 = state_list[idx] - x
                     if idx == 0:
-                        if cycle is np.inf:
+                        if not np.isfinite(cycle):
                             i.append(np.array([idx], dtype=int))
                             p.append(np.ones((1,), dtype=self.dtype))
                         else:
                             d2 = x - state_list[-1] + cycle
                             i.append(np.array([idx, len(state_list) - 1]))
-                            p.append(np.array([d1, d2]) / (d1 + d2))
+                            p.append(np.array([d2, d1]) / (d1 + d2))
                     else:
                         d2 = x - state_list[idx - 1]
                         i.append(np.array([idx - 1, idx], dtype=int))
                         p.append(np.array([d1, d2]) / (d1 + d2))
             else:
-                if cycle is np.inf:
+                if not np.isfinite(cycle):
                     i.append(np.array([idx - 1], dtype=int))
                     p.append(np.ones((1,), dtype=self.dtype))
                 else:
                     d1 = x - state_list[-1]
-                    d2 = state_list[0] - x + state_list[0]
+                    d2 = state_list[0] - x + cycle
                     i.append(np.array([0, idx - 1]))
                     p.append(np.array([d1, d2]) / (d1 + d2))
         indices = np.zeros((1,), dtype=int)
@@ -166,14 +314,76 @@ class States:
             probs = np.repeat(probs, len(idx)) * np.tile(prob, len(probs))
         return indices, probs
 
+    def computeBarycentricBatch(self, items):
+        """Batched version of :meth:`computeBarycentric`.
+
+        Takes an ``(N, D)`` array of query points and returns ``(N, 2**D)`` arrays
+        of flat state indices and barycentric weights. Dimensions where a query
+        lies exactly on a grid point (or is clamped to the boundary) yield a
+        duplicated index with zero weight, so every row has the same length.
+        """
+
+        if not isinstance(items, np.ndarray):
+            items = np.array(items, dtype=self.dtype)
+        if items.ndim == 1:
+            items = items.reshape((-1, len(self.__data)))
+        num_items = items.shape[0]
+        indices = np.zeros((num_items, 1), dtype=int)
+        probs = np.ones((num_items, 1), dtype=self.dtype)
+        for state_list, cycle, x in zip(self.__data, self.__cycles, items.T):
+            n = len(state_list)
+            x = x.astype(np.result_type(x, state_list))
+            idx = np.searchsorted(state_list, x)
+            first = np.maximum(idx - 1, 0)
+            second = np.minimum(idx, n - 1)
+            dist_first = x - state_list[first]
+            dist_second = state_list[second] - x
+            exact = (idx < n) & (state_list[second] == x)
+            below = (idx == 0) & ~exact
+            above = idx == n
+            if np.isfinite(cycle):
+                single = exact
+                first[below | above] = 0
+                second[below | above] = n - 1
+                dist_first[below] = state_list[0] - x[below]
+                dist_second[below] = x[below] - state_list[-1] + cycle
+                dist_first[above] = state_list[0] - x[above] + cycle
+                dist_second[above] = x[above] - state_list[-1]
+            else:
+                single = exact | below | above
+            # each neighbour is weighted by the distance to the other one
+            with np.errstate(invalid="ignore", divide="ignore"):
+                p_first = dist_second / (dist_first + dist_second)
+                p_second = dist_first / (dist_first + dist_second)
+            first[single] = second[single]
+            p_first[single] = 0
+            p_second[single] = 1
+            pair_indices = np.stack([first, second], axis=1)
+            pair_probs = np.stack([p_first, p_second], axis=1)
+            indices = indices[:, :, np.newaxis] * n + pair_indices[:, np.newaxis, :]
+            indices = indices.reshape((num_items, -1))
+            probs = probs[:, :, np.newaxis] * pair_probs[:, np.newaxis, :]
+            probs = probs.reshape((num_items, -1))
+        return indices, probs
+
     def index(self, state):
 
         if len(state) == len(self.__data):
             n = 0
-            for idx, x in enumerate(state):
-                n += np.argmin(np.abs(self.__data[idx] - x)) * np.prod(
-                    self.shape[idx + 1 :], dtype=int
-                )
+            for state_list, lookup, stride, x in zip(
+                self.__data, self.__lookup, self.__strides, state
+            ):
+                if not lookup[0]:
+                    n += int(_nearest_index(state_list, lookup, x)) * stride
+                    continue
+                # bisect on the grid values is cheaper than array calls for one query
+                x = state_list.dtype.type(x)
+                idx = bisect_left(lookup[3], float(x))
+                below = max(idx - 1, 0)
+                above = min(idx, len(state_list) - 1)
+                if abs(state_list[below] - x) > abs(state_list[above] - x):
+                    below = above
+                n += below * stride
             return n
         else:
             raise ValueError(
@@ -182,6 +392,77 @@ class States:
                 )
             )
 
+    def indices(self, states):
+        """Batched version of :meth:`index`.
+
+        Takes an ``(N, D)`` array of query points and returns the ``(N,)`` flat
+        indices of their nearest states. Uniform axes are resolved in closed form,
+        other sorted axes by ``np.searchsorted``.
+        """
+
+        if not isinstance(states, np.ndarray):
+            states = np.array(states, dtype=self.dtype)
+        states = states.reshape((-1, len(self.__data)))
+        n = np.zeros((states.shape[0],), dtype=int)
+        for state_list, lookup, stride, x in zip(
+            self.__data, self.__lookup, self.__strides, states.T
+        ):
+            n += _nearest_index(state_list, lookup, x) * stride
+        return n
+
+    def as_array(self, start=0, stop=None):
+        """Returns the states ``start`` to ``stop`` as an ``(N, D)`` array.
+
+        By default the whole grid is returned. Rows are in flat index order, i.e.
+        ``as_array()[s]`` equals ``self[s]``.
+        """
+
+        num_states = int(self.num_states)
+        stop = num_states if stop is None else min(stop, num_states)
+        if start == 0 and stop == num_states:
+            grids = np.meshgrid(*self.__data, indexing="ij")
+        else:
+            indices = np.unravel_index(np.arange(start, stop), self.shape)
+            grids = [state_list[idx] for state_list, idx in zip(self.__data, indices)]
+        return np.stack([grid.reshape(-1) for grid in grids], axis=1)
+
+    def iter_chunks(self, chunk_size=4096):
+        """Yields ``(start, states)`` blocks of at most ``chunk_size`` states.
+
+        Blocks are generated on demand by :meth:`as_array`, so the whole grid is
+        never materialized.
+        """
+
+        for start in range(0, int(self.num_states), chunk_size):
+            yield start, self.as_array(start, start + chunk_size)
+
+    def coarsen(self, factor=2, min_size=4):
+        # every factor-th point of each axis with at least min_size * factor points;
+        # non-cyclic axes keep their last point so that the range is unchanged
+        state_lists = []
+        for state_list, cycle in zip(self.__data, self.__cycles):
+            if len(state_list) >= min_size * factor:
+                coarse = state_list[::factor]
+                if not np.isfinite(cycle) and coarse[-1] != state_list[-1]:
+                    coarse = np.append(coarse, state_list[-1])
+                state_list = coarse
+            state_lists.append(state_list)
+        return States(
+            *state_lists,
+            cycles=self.__cycles,
+            terminal_states=self.terminal_states,
+            dtype=self.dtype,
+        )
+
+    def compact(self):
+        # float32 grids, terminal states and cycles
+        self.update(
+            *self.__data,
+            cycles=self.__cycles,
+            terminal_states=self.terminal_states,
+            dtype=np.float32,
+        )
+
     def info(self, return_data=False, return_cycles=False):
 
         if return_data:
@@ -311,6 +592,12 @@ class Rewards:
     def update(self, data):
         self.__data = data
 
+    def compact(self):
+        if self.issparse:
+            self.__data = _compact_csr(self.__data)
+        else:
+            self.__data = self.__data.astype(np.float32, copy=False)
+
     def load(self, filename):
         filetype = filename.split(".")[-1]
         if filetype == "npz":
@@ -333,9 +620,30 @@ class StateTransitionProbability:
         self.__data = sp.dok_matrix(
             (states.num_states * actions.num_actions, states.num_states), dtype=dtype
         )
+        # triplets of set_rows() waiting to be merged by finalize()
+        self.__pending = None
+        self.__count = 0
+
+    @classmethod
+    def from_coo(cls, states, actions, rows, cols, probs, dtype=np.float32, atol=1e-4):
+        # rows are flat (state * num_actions + action) indices and cols successor
+        # states; duplicate entries are summed and the row sums are checked once
+        state_transition_probability = cls(states, actions, dtype=dtype)
+        state_transition_probability.update(
+            _triplets_to_csr(
+                rows,
+                cols,
+                probs,
+                (states.num_states * actions.num_actions, states.num_states),
+                dtype,
+                atol,
+            )
+        )
+        return state_transition_probability
 
     def __setitem__(self, key, val):
 
+        self.finalize()
         if isinstance(key, tuple):
             if len(key) == 1:
                 return self.__data[key[0]]
@@ -370,6 +678,7 @@ class StateTransitionProbability:
 
     def __getitem__(self, key):
 
+        self.finalize()
         if isinstance(key, tuple):
             if len(key) == 1:
                 return self.__data[key[0]]
@@ -401,6 +710,7 @@ class StateTransitionProbability:
             raise IndexError("Indices mismatch.")
 
     def __iter__(self):
+        self.finalize()
         return self.__data.__iter__()
 
     @property
@@ -412,31 +722,112 @@ class StateTransitionProbability:
         sa, s = self.__data.shape
         return (s, sa // s, s)
 
+    def set_rows(self, state_idx, action_idx, successor_idx, probs):
+        # replaces the rows of the given (state, action) pairs. The arguments are
+        # broadcast against each other and appended to growable buffers, which are
+        # merged into the CSR matrix by finalize() (called by every accessor). A
+        # row set again before that keeps only the triplets of the last call.
+        state_idx, action_idx, successor_idx, probs = (
+            np.ravel(arr)
+            for arr in np.broadcast_arrays(state_idx, action_idx, successor_idx, probs)
+        )
+        rows = np.ravel_multi_index((state_idx, action_idx), self.shape[:2])
+        count = self.__count + len(rows)
+        if self.__pending is None or count > len(self.__pending[0]):
+            capacity = max(count, 1024)
+            if self.__pending is not None:
+                capacity = max(capacity, 2 * len(self.__pending[0]))
+            pending = (
+                np.empty(capacity, dtype=np.int64),
+                np.empty(capacity, dtype=np.int64),
+                np.empty(capacity, dtype=self.dtype),
+                np.empty(capacity, dtype=np.int64),
+            )
+            if self.__pending is not None:
+                for buffer, old in zip(pending, self.__pending):
+                    buffer[: self.__count] = old[: self.__count]
+            self.__pending = pending
+        # the calls are told apart by their offset in the buffers
+        for buffer, arr in zip(
+            self.__pending, (rows, successor_idx, probs, self.__count)
+        ):
+            buffer[self.__count : count] = arr
+        self.__count = count
+
+    def finalize(self, atol=1e-4):
+        # merges the pending rows of set_rows() into a CSR matrix and validates
+        # their probabilities
+        if self.__pending is None:
+            return
+        rows, cols, probs, calls = (buffer[: self.__count] for buffer in self.__pending)
+        # the last call that set a row wins, in the order of the buffers
+        unique_rows, last = np.unique(rows[::-1], return_index=True)
+        last_call = calls[::-1][last]
+        latest = calls == last_call[np.searchsorted(unique_rows, rows)]
+        rows, cols, probs = rows[latest], cols[latest], probs[latest]
+        current = sp.coo_matrix(self.__data)
+        touched = np.zeros(current.shape[0], dtype=bool)
+        touched[rows] = True
+        keep = ~touched[current.row]
+        # the pending rows are kept if they fail validation
+        self.__data = _triplets_to_csr(
+            np.concatenate([current.row[keep], rows]),
+            np.concatenate([current.col[keep], cols]),
+            np.concatenate([current.data[keep], probs]),
+            current.shape,
+            self.dtype,
+            atol,
+        )
+        self.__pending = None
+        self.__count = 0
+
     def dot(self, other):
+        self.finalize()
         return self.__data.dot(other)
 
     def tocsr(self):
+        self.finalize()
         if not sp.isspmatrix_csr(self.__data):
             self.__data = self.__data.tocsr()
 
     def todok(self):
+        self.finalize()
         if not sp.isspmatrix_dok(self.__data):
             self.__data = self.__data.todok()
 
     def tospmat(self):
+        self.finalize()
         return self.__data
 
     def toarray(self):
+        self.finalize()
         return self.__data.toarray()
 
     def update(self, data):
         self.__data = data
+        self.__pending = None
+        self.__count = 0
+
+    def compact(self):
+        # CSR with float32 probabilities and int32 indices (int64 if needed)
+        self.finalize()
+        self.__data = _compact_csr(self.__data)
 
     def load(self, filename):
-        self.__data = np.load(filename, allow_pickle=True)
+        self.__pending = None
+        self.__count = 0
+        if filename.endswith(".npz"):
+            self.__data = sp.load_npz(filename)
+        else:
+            self.__data = np.load(filename, allow_pickle=True)
 
     def save(self, filename):
-        np.save(filename, self.__data, allow_pickle=True)
+        self.finalize()
+        # .npz files hold the sparse matrix without pickling it
+        if filename.endswith(".npz"):
+            sp.save_npz(filename, self.__data.tocsr(), compressed=False)
+        else:
+            np.save(filename, self.__data, allow_pickle=True)
 
     # End of class StateTransitionProbability
 
@@ -450,7 +841,7 @@ class Policy:
         self.reset(dtype=dtype)
 
     def __setitem__(self, key, val):
-        self.__data[key] = min(val, self.__actions.num_actions - 1)
+        self.toarray()[key] = min(val, self.__actions.num_actions - 1)
 
     def __getitem__(self, key):
         return self.__data[key]
@@ -479,6 +870,11 @@ class Policy:
             action += p * self.__actions[int(self.__data[s])]
         return action
 
+    def get_actions(self, states):
+        S, P = self.__states.computeBarycentricBatch(states)
+        actions = self.__actions.toarray()[self.__data[S].astype(int)]
+        return np.sum(P.astype(actions.dtype)[..., np.newaxis] * actions, axis=1)
+
     def update(self, data):
         self.__data = data
 
@@ -488,13 +884,22 @@ class Policy:
         )
 
     def toarray(self, copy=False):
+        if not isinstance(self.__data, np.ndarray):
+            # e.g. a RunLengthPolicy, decompressed once for in-place updates
+            self.__data = np.asarray(self.__data)
         if copy:
             return self.__data.copy()
         else:
             return self.__data
 
-    def load(self, filename):
+    def compact(self):
+        # uint8 action indices (uint16 etc. for more than 256 actions)
+        self.__data = _action_indices(self.__data, self.__actions.num_actions)
+
+    def load(self, filename, compact=False):
         self.__data = np.load(filename)
+        if compact:
+            self.compact()
 
     def save(self, filename):
         np.save(filename, self.__data)
@@ -529,39 +934,85 @@ class MarkovDecisionProcess:
             else state_transition_probability
         )
         self.policy = Policy(self.states, self.actions) if policy is None else policy
-        self.__sampler = None
-        self.__sample_reward = False
-
-    def _worker(self, queue, state):
-        if not ArrEq(state) in self.states.terminal_states:
-            if self.__sample_reward:
-                spmat, arr = self.__sampler(state)
-            else:
-                spmat = self.__sampler(state)
-        queue.put(1)
-        if self.__sample_reward:
-            return np.array([spmat.tocsr(), arr], dtype=object)
-        else:
-            return spmat.tocsr()
 
-    def sample(self, sampler, sample_reward=False, verbose=True):
+    def sample(
+        self,
+        sampler,
+        sample_reward=False,
+        verbose=True,
+        chunk_size=None,
+        nnz_per_state=None,
+        processes=None,
+    ):
+        # sampler(state) returns the (num_actions, num_states) transition rows of a
+        # state (and its rewards if sample_reward). Workers sample contiguous chunks
+        # of states and write COO triplets into shared buffers preallocated for
+        # nnz_per_state entries per state (default: the largest count among a few
+        # probed states); the CSR matrix is built once at the end.
 
         verbose = Verbose(verbose)
         verbose("Start sampling...")
         start_time = time()
-        self.__sampler = sampler
-        self.__sample_reward = sample_reward
-        queue = Manager().Queue()
-        with Pool(cpu_count()) as p:
-            data = p.starmap_async(
-                self._worker, [(queue, state) for state in self.states]
-            )
+        num_states = int(self.states.num_states)
+        num_actions = self.actions.num_actions
+        processes = cpu_count() if processes is None else processes
+        if chunk_size is None:
+            chunk_size = min(max(num_states // (processes * 16), 1), 4096)
+        if nnz_per_state is None:
+            nnz_per_state = 1
+            for s in np.linspace(0, num_states - 1, 8).astype(int):
+                state = self.states[int(s)]
+                if any(
+                    ArrEq(state) == terminal for terminal in self.states.terminal_states
+                ):
+                    continue
+                spmat = sampler(state)[0] if sample_reward else sampler(state)
+                nnz_per_state = max(nnz_per_state, sp.coo_matrix(spmat).nnz)
+        index_dtype = (
+            np.int32 if num_states * num_actions <= np.iinfo(np.int32).max else np.int64
+        )
+        dtype = self.state_transition_probability.dtype
+        chunks = [
+            (start, min(start + chunk_size, num_states))
+            for start in range(0, num_states, chunk_size)
+        ]
+        capacity = chunk_size * nnz_per_state
+        buffers = [
+            (_shared_array(index_dtype, len(chunks) * capacity), index_dtype),
+            (_shared_array(index_dtype, len(chunks) * capacity), index_dtype),
+            (_shared_array(dtype, len(chunks) * capacity), dtype),
+            (
+                _shared_array(self.rewards.dtype, num_states * num_actions)
+                if sample_reward
+                else None,
+                self.rewards.dtype,
+            ),
+        ]
+        counts = np.zeros(len(chunks), dtype=int)
+        overflows = []
+        with Pool(
+            processes,
+            initializer=_init_sampling,
+            initargs=(
+                sampler,
+                self.states,
+                num_actions,
+                sample_reward,
+                buffers,
+                capacity,
+            ),
+        ) as p:
             counter = 0
             tic = time()
-            while counter < self.states.num_states:
-                counter += queue.get()
+            for segment, num_sampled, count, overflow in p.imap_unordered(
+                _sample_chunk, zip(chunks, range(len(chunks)))
+            ):
+                counts[segment] = count
+                if overflow:
+                    overflows.append(overflow)
+                counter += num_sampled
                 if time() - tic > 0.1:
-                    progress = counter / self.states.num_states
+                    progress = counter / num_states
                     rt = (time() - start_time) * (1 - progress) / progress
                     rh = rt // 3600
                     rt %= 3600
@@ -573,19 +1024,55 @@ class MarkovDecisionProcess:
                         % (progress, rh, rm, rs)
                     )
                     tic = time()
-            if self.__sample_reward:
-                data = np.array(data.get(), dtype=object)
-                self.state_transition_probability.update(sp.vstack(data[:, 0]))
-                self.rewards.update(
-                    np.array(data[:, 1].tolist(), dtype=self.rewards.dtype)
-                )
-            else:
-                self.state_transition_probability.update(sp.vstack(data.get()))
-        self.__sampler = None
+        rows, cols, probs, rewards = [
+            None if buffer is None else np.frombuffer(buffer, dtype=dtype)
+            for buffer, dtype in buffers
+        ]
+        # keep the filled part of every chunk segment, then the overflow
+        filled = np.arange(capacity) < counts[:, np.newaxis]
+        filled = filled.reshape(-1)
+        triplets = [rows[filled], cols[filled], probs[filled]]
+        if overflows:
+            triplets = [
+                np.concatenate([triplet] + [overflow[k] for overflow in overflows])
+                for k, triplet in enumerate(triplets)
+            ]
+        self.state_transition_probability.update(
+            sp.csr_matrix(
+                (triplets[2], (triplets[0], triplets[1])),
+                shape=(num_states * num_actions, num_states),
+                dtype=dtype,
+            )
+        )
+        if sample_reward:
+            self.rewards.update(rewards.reshape((num_states, num_actions)).copy())
         end_time = time()
         verbose("Sampling is done. %f (sec) elapsed.\n" % (end_time - start_time))
 
-    def load(self, filename):
+    def compact(self):
+
+        # float32 states, rewards and probabilities, int32 CSR indices and uint8
+        # policy action indices, with wider types only where the sizes need them
+        self.states.compact()
+        self.rewards.compact()
+        self.state_transition_probability.compact()
+        self.policy.compact()
+
+    def nbytes(self):
+
+        # bytes held by the arrays of the model
+        arrays = list(self.states.info(return_data=True)) + [self.policy.toarray()]
+        self.state_transition_probability.tocsr()
+        matrices = [self.state_transition_probability.tospmat()]
+        if self.rewards.issparse:
+            matrices.append(self.rewards.tocsr())
+        else:
+            arrays.append(self.rewards.toarray())
+        for matrix in matrices:
+            arrays += [matrix.data, matrix.indices, matrix.indptr]
+        return sum(array.nbytes for array in arrays)
+
+    def load(self, filename, compact=False):
 
         data = np.load(filename, allow_pickle=False)
         state_lists = []
@@ -635,6 +1122,8 @@ class MarkovDecisionProcess:
         self.policy = Policy(self.states, self.actions)
         self.policy.update(data["policy.data"])
         self.discount = data["discount"].item()
+        if compact:
+            self.compact()
 
     def save(self, filename):
 
@@ -664,6 +1153,113 @@ class MarkovDecisionProcess:
 
         savez(filename, **kwargs)
 
+    def load_mmap(self, directory, mmap_mode="c"):
+
+        # maps the arrays written by save_mmap instead of reading them; with the
+        # default copy-on-write mode processes share the pages of the transition
+        # model and solvers can still update the policy in place
+        with open(os.path.join(directory, "mdp.json")) as f:
+            meta = json.load(f)
+
+        def load(name, mmap=True):
+            return np.load(
+                os.path.join(directory, name + ".npy"),
+                mmap_mode=mmap_mode if mmap else None,
+            )
+
+        state_lists = [
+            load("states.data." + str(idx), mmap=False)
+            for idx in range(meta["states.num_lists"])
+        ]
+        terminal_states = load("states.terminal_states", mmap=False)
+        self.states = States(
+            *state_lists,
+            cycles=load("states.cycles", mmap=False),
+            terminal_states=list(terminal_states) if len(terminal_states) else None,
+            dtype=state_lists[0].dtype,
+        )
+        self.actions = Actions(load("actions.data", mmap=False))
+        num_states = self.states.num_states
+        num_actions = self.actions.num_actions
+
+        rewards = load("rewards.data")
+        self.rewards = Rewards(
+            self.states,
+            self.actions,
+            dtype=rewards.dtype,
+            sparse=meta["rewards.issparse"],
+        )
+        if self.rewards.issparse:
+            self.rewards.update(
+                sp.csr_matrix(
+                    (rewards, load("rewards.indices"), load("rewards.indptr")),
+                    shape=(num_states, num_actions),
+                    copy=False,
+                )
+            )
+        else:
+            self.rewards.update(rewards)
+
+        self.state_transition_probability = StateTransitionProbability(
+            self.states, self.actions
+        )
+        self.state_transition_probability.update(
+            sp.csr_matrix(
+                (
+                    load("state_transition_probability.data"),
+                    load("state_transition_probability.indices"),
+                    load("state_transition_probability.indptr"),
+                ),
+                shape=(num_states * num_actions, num_states),
+                copy=False,
+            )
+        )
+        self.policy = Policy(self.states, self.actions)
+        self.policy.update(load("policy.data"))
+        self.discount = meta["discount"]
+
+    def save_mmap(self, directory):
+
+        # one uncompressed .npy file (64-byte aligned data) per array, so that
+        # load_mmap can map them; the metadata is written last
+        self.state_transition_probability.tocsr()
+        P = self.state_transition_probability.tospmat()
+        # scipy copies index arrays that are wider than needed or of mixed types
+        index_dtype = _index_dtype(P.nnz, *P.shape)
+        arrays = {
+            "states.cycles": np.asarray(self.states.info(return_cycles=True)),
+            "states.terminal_states": np.array(
+                self.states.terminal_states, dtype=self.states.dtype
+            ).reshape((-1, len(self.states.shape))),
+            "actions.data": self.actions.toarray(),
+            "state_transition_probability.data": P.data,
+            "state_transition_probability.indices": P.indices.astype(index_dtype),
+            "state_transition_probability.indptr": P.indptr.astype(index_dtype),
+            "policy.data": self.policy.toarray(),
+        }
+        for idx, state_list in enumerate(self.states.info(return_data=True)):
+            arrays["states.data." + str(idx)] = state_list
+        if self.rewards.issparse:
+            rewards = self.rewards.tocsr()
+            arrays["rewards.data"] = rewards.data
+            arrays["rewards.indices"] = rewards.indices
+            arrays["rewards.indptr"] = rewards.indptr
+        else:
+            arrays["rewards.data"] = self.rewards.toarray()
+
+        os.makedirs(directory, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), array, allow_pickle=False)
+        with open(os.path.join(directory, "mdp.json"), "w") as f:
+            json.dump(
+                {
+                    "states.num_lists": len(self.states.shape),
+                    "rewards.issparse": bool(self.rewards.issparse),
+                    "discount": float(self.discount),
+                },
+                f,
+            )
+
     # End of class MarkovDecisionProcess
 
 
@@ -676,9 +1272,13 @@ if __name__ == "__main__":
     rewards = Rewards(states, actions)
 
     state_transition_prob = StateTransitionProbability(states, actions)
-    for s in range(states.num_states):
-        for a in range(actions.num_actions):
-            state_transition_prob[s, a, s] = 1.0
+    state_transition_prob.set_rows(
+        np.arange(states.num_states)[:, np.newaxis],
+        np.arange(actions.num_actions),
+        np.arange(states.num_states)[:, np.newaxis],
+        1.0,
+    )
+    state_transition_prob.finalize()
 
     policy = Policy()
 
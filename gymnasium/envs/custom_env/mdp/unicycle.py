@@ -0,0 +1,104 @@
+import numpy as np
+
+from .mdp import Rewards, StateTransitionProbability
+
+__all__ = ["unicycle_transitions"]
+
+
+def _wrap(theta):
+    return (theta + np.pi) % (2 * np.pi) - np.pi
+
+
+def unicycle_transitions(
+    states,
+    actions,
+    dt,
+    v=1.0,
+    sigma=0.0,
+    reward=None,
+    num_noise_points=3,
+    chunk_size=4096,
+    dtype=np.float32,
+):
+    """Builds the transition model of the unicycle relative to a target at the origin.
+
+    ``states`` is an (r, alpha) grid as observed by ``DKC_Unicycle`` and
+    ``TOC_Unicycle`` and ``actions`` holds turn rates. Every (state, action) pair is
+    integrated over ``dt`` at once, the successors are perturbed by Gaussian position
+    noise of standard deviation ``sigma`` (``num_noise_points`` Gauss-Hermite nodes
+    per axis) and spread over the grid by barycentric interpolation. Terminal states
+    have no transitions. If ``reward(next_states)`` is given, the expected rewards of
+    the pairs are returned as well, as with ``MarkovDecisionProcess.sample``.
+    """
+
+    state_lists = states.info(return_data=True)
+    if len(state_lists) != 2:
+        raise ValueError("unicycle_transitions expects (r, alpha) states.")
+    num_states = int(states.num_states)
+    num_actions = actions.num_actions
+    omega = actions.toarray().reshape((num_actions, -1))[:, 0].astype(np.float64)
+    if sigma > 0:
+        nodes, weights = np.polynomial.hermite_e.hermegauss(num_noise_points)
+        weights = weights / weights.sum()
+        noise = sigma * np.stack(np.meshgrid(nodes, nodes, indexing="ij"), axis=-1)
+        noise = noise.reshape((-1, 2))
+        noise_weights = np.outer(weights, weights).reshape(-1)
+    else:
+        noise = np.zeros((1, 2))
+        noise_weights = np.ones(1)
+    terminal = np.zeros(num_states, dtype=bool)
+    if states.terminal_states:
+        terminal[states.indices(np.array(states.terminal_states))] = True
+
+    # exact arc of the unicycle over dt for every action, as in DKC_Unicycle.step
+    dtheta = omega * dt
+    _lambda = dtheta / 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ds = np.where(_lambda == 0, v * dt, v * dt * np.sin(_lambda) / _lambda)
+
+    rows, cols, probs = [], [], []
+    rewards = np.zeros((num_states, num_actions))
+    for start, chunk in states.iter_chunks(chunk_size):
+        index = np.arange(start, start + len(chunk))
+        chunk = chunk[~terminal[index]].astype(np.float64)
+        index = index[~terminal[index]]
+        r = chunk[:, 0:1]
+        alpha = chunk[:, 1:2]
+        # the uav sits at (r, 0) with the heading that gives the observed alpha
+        theta = -alpha - np.pi
+        x = r + ds * np.cos(theta + _lambda)
+        y = ds * np.sin(theta + _lambda)
+        theta = theta + dtheta
+        x = x[..., np.newaxis] + noise[:, 0]
+        y = y[..., np.newaxis] + noise[:, 1]
+        next_states = np.stack(
+            [np.hypot(x, y), _wrap(np.arctan2(y, x) - theta[..., np.newaxis] - np.pi)],
+            axis=-1,
+        ).reshape((-1, 2))
+        S, P = states.computeBarycentricBatch(next_states)
+        pair = (
+            index[:, np.newaxis, np.newaxis] * num_actions
+            + np.arange(num_actions)[:, np.newaxis]
+        )
+        pair = np.broadcast_to(pair, x.shape).reshape(-1)
+        weights = np.broadcast_to(noise_weights, x.shape).reshape(-1)
+        rows.append(np.repeat(pair, S.shape[1]))
+        cols.append(S.reshape(-1))
+        probs.append((P * weights[:, np.newaxis]).reshape(-1))
+        if reward is not None:
+            expected = np.asarray(reward(next_states)).reshape(x.shape) * noise_weights
+            rewards[index] = expected.sum(axis=-1)
+
+    state_transition_probability = StateTransitionProbability.from_coo(
+        states,
+        actions,
+        np.concatenate(rows),
+        np.concatenate(cols),
+        np.concatenate(probs),
+        dtype=dtype,
+    )
+    if reward is None:
+        return state_transition_probability
+    mdp_rewards = Rewards(states, actions, dtype=dtype)
+    mdp_rewards.update(rewards.astype(dtype))
+    return state_transition_probability, mdp_rewards
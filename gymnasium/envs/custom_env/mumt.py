@@ -1,19 +1,31 @@
 import os
+import random
 import sys
+from typing import Optional
+
+import numpy as np
+from numpy import arctan2, array, cos, pi, sin
+from PIL import ImageFont
+
+from gymnasium import Env, error
+from gymnasium.spaces import Box, Dict, Discrete, MultiDiscrete
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+
+
 current_file_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_file_path)
 desired_path = os.path.expanduser("~/Project/PERSISTENT/Gymnasium")
 sys.path.append(desired_path)
-import numpy as np
-import random
-from gymnasium import Env
-from gymnasium.spaces import Box, Dict, Discrete, MultiDiscrete
-from typing import Optional
-import rendering
+# the sibling modules are imported from the directory of this file
+try:
+    import rendering
+except ImportError:  # no pyglet or OpenGL: frames are rasterized offscreen only
+    rendering = None
+import headless_rendering  # noqa: E402
+from frame_writer import write_frame  # noqa: E402
+from mdp import Actions, LookupTableController, States  # noqa: E402
 
-from mdp import Actions, States
-from numpy import arctan2, array, cos, pi, sin
-from PIL import Image, ImageDraw, ImageFont
 
 def wrap(theta):
     if theta > pi:
@@ -22,11 +34,246 @@ def wrap(theta):
         theta += 2 * pi
     return theta
 
+
+def wrap_array(theta):  # element-wise wrap for arrays of angles
+    return theta - 2 * pi * (theta > pi) + 2 * pi * (theta < -pi)
+
+
+def mumt_observation_space(m, n, r_min=0, r_max=80):
+    # Create the observation space
+    obs_space = {}
+
+    # Add observation spaces for each UAV-target pair according to the rule
+    for uav_id in range(1, m + 1):
+        for target_id in range(1, n + 1):
+            key = f"uav{uav_id}_target{target_id}"
+            obs_space[key] = Box(
+                low=np.float32([r_min, -np.pi]),
+                high=np.float32([r_max, np.pi]),
+                dtype=np.float32,
+            )
+
+    # Add observation spaces for each UAV-charging station
+    for uav_id in range(1, m + 1):
+        key = f"uav{uav_id}_charge_station"
+        obs_space[key] = Box(
+            low=np.float32([r_min, -np.pi]),
+            high=np.float32([r_max, np.pi]),
+            dtype=np.float32,
+        )
+
+    # Add observation space for battery and age
+    # Assuming one battery value per UAV and one age value per target
+    obs_space["battery"] = Box(
+        low=np.float32([0] * m), high=np.float32([3000] * m), dtype=np.float32
+    )
+    obs_space["age"] = Box(
+        low=np.float32([0] * n), high=np.float32([1000] * n), dtype=np.float32
+    )
+    return Dict(obs_space)
+
+
+def mumt_flat_layout(m, n):
+    # index layout of the flat observation (float32 Box of size 2mn + 3m + n):
+    # pairs: r, alpha of every uav-target pair, uav-major as MUMT.pair_keys,
+    # at 2 * (uav * n + target)
+    # stations: r, alpha of every uav relative to the charging station, at 2 * uav
+    # battery: m battery levels, age: n ages of the targets
+    pairs = slice(0, 2 * m * n)
+    stations = slice(pairs.stop, pairs.stop + 2 * m)
+    battery = slice(stations.stop, stations.stop + m)
+    age = slice(battery.stop, battery.stop + n)
+    return {"pairs": pairs, "stations": stations, "battery": battery, "age": age}
+
+
+def mumt_flat_observation_space(m, n, r_min=0, r_max=80):
+    # the bounds of mumt_observation_space in the layout of mumt_flat_layout
+    layout = mumt_flat_layout(m, n)
+    low = np.zeros(layout["age"].stop, dtype=np.float32)
+    high = np.zeros(layout["age"].stop, dtype=np.float32)
+    low[layout["pairs"]] = np.tile([r_min, -np.pi], m * n)
+    high[layout["pairs"]] = np.tile([r_max, np.pi], m * n)
+    low[layout["stations"]] = np.tile([r_min, -np.pi], m)
+    high[layout["stations"]] = np.tile([r_max, np.pi], m)
+    high[layout["battery"]] = 3000
+    high[layout["age"]] = 1000
+    return Box(low=low, high=high, dtype=np.float32)
+
+
+def mumt_flat_observation(rel_obs, station_obs, batteries, ages, out):
+    # (..., m, n, 3) relative and (..., m, 3) station observations written in place into
+    # the (..., 2mn + 3m + n) array out
+    layout = mumt_flat_layout(*rel_obs.shape[-3:-1])
+    out[..., layout["pairs"]] = rel_obs[..., :2].reshape(rel_obs.shape[:-3] + (-1,))
+    out[..., layout["stations"]] = station_obs[..., :2].reshape(
+        station_obs.shape[:-2] + (-1,)
+    )
+    out[..., layout["battery"]] = batteries
+    out[..., layout["age"]] = ages
+    return out
+
+
+def mumt_flat_to_dict(observation, m, n):
+    # flat observations (with any leading batch axes) -> the keys and shapes of
+    # MUMT.dict_observation, for analysis
+    layout = mumt_flat_layout(m, n)
+    batch_shape = observation.shape[:-1]
+    pairs = observation[..., layout["pairs"]].reshape(batch_shape + (m * n, 2))
+    stations = observation[..., layout["stations"]].reshape(batch_shape + (m, 2))
+    pair_keys = [
+        f"uav{uav_id}_target{target_id}"
+        for uav_id in range(1, m + 1)
+        for target_id in range(1, n + 1)
+    ]
+    station_keys = [f"uav{uav_id}_charge_station" for uav_id in range(1, m + 1)]
+    dictionary_obs = dict(zip(pair_keys, np.moveaxis(pairs, -2, 0)))
+    dictionary_obs.update(zip(station_keys, np.moveaxis(stations, -2, 0)))
+    dictionary_obs["battery"] = observation[..., layout["battery"]]
+    dictionary_obs["age"] = observation[..., layout["age"]]
+    return dictionary_obs
+
+
+def load_mumt_controllers(n_r=800, n_alpha=360, n_u=2):
+    # state/action grids of Dynamic Programming and the lookup-table controllers
+    # (distance keeping, time optimal)
+    states = States(
+        np.linspace(0.0, 80.0, n_r, dtype=np.float32),
+        np.linspace(
+            -np.pi,
+            np.pi - np.pi / n_alpha,
+            n_alpha,
+            dtype=np.float32,
+        ),
+        cycles=[np.inf, np.pi * 2],
+    )
+
+    actions = Actions(
+        np.linspace(-1.0 / 4.5, 1.0 / 4.5, n_u, dtype=np.float32).reshape((-1, 1))
+    )
+
+    # lookup-table controllers are compiled once per policy file and shared between
+    # instances
+    current_file_path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        distance_keeping_controller = LookupTableController.load(
+            current_file_path + os.path.sep + "v1_80_2a_dkc_val_iter.npz",
+            states,
+            actions,
+            key="policy",
+        )
+        time_optimal_controller = LookupTableController.load(
+            current_file_path
+            + os.path.sep
+            + "v1_terminal_40+40_2a_toc_policy_fp64.npy",
+            states,
+            actions,
+        )
+    except (
+        FileNotFoundError
+    ) as e:  # the policy tables are data files, not part of every checkout
+        raise error.DependencyNotInstalled(
+            f"Policy table {e.filename} is missing; run the DP solvers to generate it"
+        ) from e
+    return states, actions, distance_keeping_controller, time_optimal_controller
+
+
+def relative_polar(
+    uav_states, target_states
+):  # r, alpha, beta of targets relative to uavs, broadcast over leading axes
+    x = target_states[..., 0] - uav_states[..., 0]
+    y = target_states[..., 1] - uav_states[..., 1]
+    r = np.sqrt(x**2 + y**2)
+    beta = arctan2(y, x)
+    alpha = wrap_array(beta - wrap_array(uav_states[..., 2]))
+    obs = np.empty(r.shape + (3,), dtype=np.float32)
+    obs[..., 0], obs[..., 1], obs[..., 2] = r, alpha, beta
+    return obs
+
+
+def station_polar(
+    uav_states,
+):  # r, alpha, beta of uavs relative to the charging station, as MUMT.UAV.obs
+    x, y, theta = uav_states[..., 0], uav_states[..., 1], uav_states[..., 2]
+    r = np.sqrt(x**2 + y**2)
+    beta = arctan2(y, x)
+    alpha = wrap_array(beta - wrap_array(theta) - pi)
+    obs = np.empty(r.shape + (3,), dtype=np.float32)
+    obs[..., 0], obs[..., 1], obs[..., 2] = r, alpha, beta
+    return obs
+
+
+def unicycle_moves(uav_states, turn_rates, v, dt):
+    # MUMT.UAV.move for (k, 3) states; as in UAV.move, turning UAVs are updated in the
+    # precision of the turn rate
+    x, y, theta = uav_states.T
+    dtheta = turn_rates * dt
+    _lambda = dtheta / 2
+    straight = _lambda == 0.0
+    if straight.any():
+        _lambda = np.where(straight, 1, _lambda)  # straight moves are overwritten below
+    ds = v * dt * sin(_lambda) / _lambda
+    heading = theta.astype(_lambda.dtype)
+    state = np.empty(uav_states.shape, dtype=uav_states.dtype)
+    state[:, 0] = x.astype(_lambda.dtype) + ds * cos(heading + _lambda)
+    state[:, 1] = y.astype(_lambda.dtype) + ds * sin(heading + _lambda)
+    state[:, 2] = wrap_array((heading + dtheta).astype(theta.dtype))
+    if straight.any():
+        state[straight, 0] = x[straight] + v * dt * cos(theta[straight])
+        state[straight, 1] = y[straight] + v * dt * sin(theta[straight])
+        state[straight, 2] = theta[straight]
+    return state
+
+
+def fleet_control(batteries, station_r, actions, r_c):
+    # battery rule of MUMT: returns new batteries and masks of landed, to-station
+    # (flying) and to-target UAVs
+    alive = batteries > 0  # dead UAVs can not take action
+    to_station = alive & (actions == 0)  # go to charging station
+    landed = to_station & (station_r < r_c)  # uav no move
+    to_station ^= landed  # not able to land on charge station(too far)
+    to_target = alive & (actions != 0)  # surveil target
+    batteries = np.where(
+        landed, np.minimum(batteries + 10, 3000), batteries - (to_station | to_target)
+    )
+    return batteries, landed, to_station, to_target
+
+
+def surveil(ranges, batteries, charging, ages, d, l):  # noqa
+    # (..., m, n) ranges -> (..., n) surveillance flags and ages
+    surveillance_matrix = (
+        (batteries > 0)[..., np.newaxis]  # UAV alive
+        & (d - l < ranges)
+        & (ranges < d + l)
+        & (charging != 1)[
+            ..., np.newaxis
+        ]  # uav is not charging(on the way to charge is ok)
+    )
+    surveillance = surveillance_matrix.any(axis=-2).astype(int)
+    ages = np.where(surveillance == 0, np.minimum(1000, ages + 1), 0)  # changeage
+    return surveillance, ages
+
+
+def mumt_dict_observation(
+    pair_keys, station_keys, rel_obs, station_obs, batteries, ages
+):
+    # (..., m, n, 3) relative and (..., m, 3) station observations ->
+    # MUMT.dict_observation with leading batch axes
+    pairs = rel_obs[..., :2].reshape(rel_obs.shape[:-3] + (-1, 2))
+    dictionary_obs = dict(zip(pair_keys, np.moveaxis(pairs, -2, 0)))
+    dictionary_obs.update(zip(station_keys, np.moveaxis(station_obs[..., :2], -2, 0)))
+    # Add observation for battery levels and ages of targets
+    dictionary_obs["battery"] = batteries.astype(np.float32)
+    dictionary_obs["age"] = ages.astype(np.float32)
+    return dictionary_obs
+
+
 class MUMT(Env):
     '''
     ver 1: 
     - if initial # of uavs, targets don't change,
     - include all uav-target pairs as observation for value comparison
+    - UAV poses, batteries, target positions and ages are stored as arrays
+      (uav_states, batteries, ...); self.uavs and self.targets are views on them
     '''
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 30}
     class UAV:
@@ -93,6 +340,68 @@ class MUMT(Env):
             beta = arctan2(y, x)
             return array([r, beta], dtype=np.float32)  # beta
 
+    class UAVView(UAV):
+        # UAV whose pose, battery and charging flag live in the arrays of the env
+        def __init__(self, env, idx):
+            self.env = env
+            self.idx = idx
+            self.v = env.v
+            self.dt = env.dt
+
+        @property
+        def state(self):
+            return self.env.uav_states[self.idx]
+
+        @state.setter
+        def state(self, state):
+            self.env.uav_states[self.idx] = state
+
+        @property
+        def battery(self):
+            return self.env.batteries[self.idx]
+
+        @battery.setter
+        def battery(self, battery):
+            self.env.batteries[self.idx] = battery
+
+        @property
+        def charging(self):
+            return self.env.charging[self.idx]
+
+        @charging.setter
+        def charging(self, charging):
+            self.env.charging[self.idx] = charging
+
+    class TargetView(Target):
+        # Target whose position, age and surveillance flag live in the arrays of the env
+        def __init__(self, env, idx):
+            self.env = env
+            self.idx = idx
+
+        @property
+        def state(self):
+            return self.env.target_states[self.idx]
+
+        @state.setter
+        def state(self, state):
+            self.env.target_states[self.idx] = state
+
+        @property
+        def age(self):
+            return self.env.ages[self.idx]
+
+        @age.setter
+        def age(self, age):
+            self.env.ages[self.idx] = age
+
+        @property
+        def surveillance(self):
+            return self.env.surveillance[self.idx]
+
+        @surveillance.setter
+        def surveillance(self, surveillance):
+            self.env.surveillance[self.idx] = surveillance
+
     def __init__(
         self,
         render_mode: Optional[str] = None,
@@ -105,39 +414,21 @@ class MUMT(Env):
         n=2, # of targets
         r_c=3,
         max_step=6000,
-        seed = None # one circle 1200 time steps
+        seed=None,  # one circle 1200 time steps
+        flat_observation=False,
     ):
         super().__init__()
         self.render_mode = render_mode
         self.seed = seed
-        # Create the observation space
-        obs_space = {}
-
-        # Add observation spaces for each UAV-target pair according to the rule
-        for uav_id in range(1, m + 1):
-            for target_id in range(1, n + 1):
-                key = f"uav{uav_id}_target{target_id}"
-                obs_space[key] = Box(low=np.float32([r_min, -np.pi]),
-                                        high=np.float32([r_max, np.pi]),
-                                        dtype=np.float32)
-
-        # Add observation spaces for each UAV-charging station
-        for uav_id in range(1, m + 1):
-            key = f"uav{uav_id}_charge_station"
-            obs_space[key] = Box(low=np.float32([r_min, -np.pi]),
-                                 high=np.float32([r_max, np.pi]),
-                                 dtype=np.float32)
-
-        # Add observation space for battery and age
-        # Assuming one battery value per UAV and one age value per target
-        obs_space["battery"] = Box(low=np.float32([0]*m),
-                                   high=np.float32([3000]*m),
-                                   dtype=np.float32)
-        obs_space["age"] = Box(low=np.float32([0]*n),
-                               high=np.float32([1000]*n),
-                               dtype=np.float32)
-
-        self.observation_space = Dict(obs_space)
+        # opt-in flat Box observation (see mumt_flat_layout), written in place into
+        # self.observation: the same array is returned by every reset and step, copy it
+        # to keep an observation
+        self.flat_observation = flat_observation
+        if flat_observation:
+            self.observation_space = mumt_flat_observation_space(m, n, r_min, r_max)
+            self.observation = np.zeros(self.observation_space.shape, dtype=np.float32)
+        else:
+            self.observation_space = mumt_observation_space(m, n, r_min, r_max)
         self.action_space = MultiDiscrete([n + 1] * m, seed=self.seed)
         self.dt = dt
         self.discount = 0.999
@@ -145,19 +436,43 @@ class MUMT(Env):
         self.l = l  # coverage gap: coverage: d-l ~ d+l # noqa
         self.m = m  # of uavs
         self.n = n  # of targets
+        self.v = 1.0  # uav speed
         self.uavs = []
         self.uav_color = [(random.randrange(0, 11) / 10, random.randrange(0, 11) / 10, random.randrange(0, 11) / 10) for _ in range(m)]
         self.targets = []
+        self.uav_states = np.zeros((m, 3))  # x, y, theta
+        self.batteries = np.zeros(m, dtype=int)
+        self.charging = np.zeros(m, dtype=int)
+        self.target_states = np.zeros((n, 2))  # x, y
+        self.ages = np.zeros(n, dtype=int)
+        self.surveillance = np.zeros(n, dtype=int)
+        self.pair_keys = [
+            f"uav{uav_id}_target{target_id}"
+            for uav_id in range(1, m + 1)
+            for target_id in range(1, n + 1)
+        ]
+        self.station_keys = [
+            f"uav{uav_id}_charge_station" for uav_id in range(1, m + 1)
+        ]
         self.r_c = r_c  # charge station radius
         self.step_count = None
-        self.font = ImageFont.truetype("/usr/share/fonts/truetype/freefont/FreeMono.ttf", 20)
+        try:
+            self.font = ImageFont.truetype(
+                "/usr/share/fonts/truetype/freefont/FreeMono.ttf", 20
+            )
+        except OSError:  # FreeMono is not installed everywhere
+            self.font = ImageFont.load_default()
         self.num2str = {0: "charge", 1: "target_1"}
         self.max_step = max_step
+        self.rollout_envs = {}
         self.viewer = None
+        self.rendering = None
         self.SAVE_FRAMES_PATH = f"../../../../visualized/{self.m}U{self.n}T"
         self.episode_counter = 0
         self.frame_counter = 0
         self.save_frames = False
+        # FrameWriter that saves frames off the step thread, synchronous if None
+        self.frame_writer = None
         self.action = None
 
         # initialization for Dynamic Programming
@@ -165,27 +480,16 @@ class MUMT(Env):
         self.n_alpha = 360
         self.n_u = 2 #21
 
-        current_file_path = os.path.dirname(os.path.abspath(__file__))
-        self.distance_keeping_result00 = np.load(current_file_path+ os.path.sep + "v1_80_2a_dkc_val_iter.npz")
-        self.distance_keeping_straightened_policy00 = self.distance_keeping_result00["policy"] # .data
-        self.time_optimal_straightened_policy00 = np.load(current_file_path+ os.path.sep + "v1_terminal_40+40_2a_toc_policy_fp64.npy")
-
-        self.states = States(
-            np.linspace(0.0, 80.0, self.n_r, dtype=np.float32),
-            np.linspace(
-                -np.pi,
-                np.pi - np.pi / self.n_alpha,
-                self.n_alpha,
-                dtype=np.float32,
-            ),
-            cycles=[np.inf, np.pi * 2],
-        )
-
-        self.actions = Actions(
-            np.linspace(-1.0 / 4.5, 1.0 / 4.5, self.n_u, dtype=np.float32).reshape(
-                (-1, 1)
-            )
+        (
+            self.states,
+            self.actions,
+            self.distance_keeping_controller,
+            self.time_optimal_controller,
+        ) = load_mumt_controllers(self.n_r, self.n_alpha, self.n_u)
+        self.distance_keeping_straightened_policy00 = (
+            self.distance_keeping_controller.policy
         )
+        self.time_optimal_straightened_policy00 = self.time_optimal_controller.policy
 
     def reset(
         self,
@@ -196,8 +500,6 @@ class MUMT(Env):
         seed: Optional[int] = None,
         options: Optional[dict] = None,
     ):
-        self.uavs = []
-        self.targets = []
         np.random.seed(seed)
         self.episode_counter += 1
         self.step_count = 0
@@ -223,9 +525,10 @@ class MUMT(Env):
             batteries = np.random.randint(1500, 3000, self.m)
         else:
             batteries = batteries
-        # Create UAV instances
-        for i in range(self.m):
-            self.uavs.append(self.UAV(state=uav_states[i], battery=batteries[i]))
+        self.uav_states = np.array(uav_states, dtype=np.float64).reshape((self.m, 3))
+        self.batteries = np.array(batteries).reshape(self.m)
+        self.charging = np.zeros(self.m, dtype=int)
+        self.uavs = [self.UAVView(self, i) for i in range(self.m)]
 
         if target_pose is None:
             target1_r = np.random.uniform(20, 35, self.n)  # 0~ D-d
@@ -234,39 +537,61 @@ class MUMT(Env):
             ages = [0] * self.n
         else:
             target_states, ages = target_pose  # Assuming target_pose is an iterable of target states
-        # Create Target instances
-        for i in range(self.n):
-            self.targets.append(self.Target(state=target_states[i], age=ages[i]))
-        return self.dict_observation, {}
+        self.target_states = np.array(target_states, dtype=np.float64).reshape(
+            (self.n, 2)
+        )
+        self.ages = np.array(ages).reshape(self.n)
+        self.surveillance = np.zeros(self.n, dtype=int)
+        self.targets = [self.TargetView(self, i) for i in range(self.n)]
+        return (
+            self.build_observation(
+                self.rel_observations(), self.station_observations()
+            ),
+            {},
+        )
 
     def toc_get_action(self, state):
-        S, P = self.states.computeBarycentric(state)
-        action = sum(p * self.actions[int(self.time_optimal_straightened_policy00[s])] for s, p in zip(S, P))
-        return action
+        return self.time_optimal_controller.get_action(state)
 
     def dkc_get_action(self, state):
-        S, P = self.states.computeBarycentric(state)
-        action = sum(p * self.actions[int(self.distance_keeping_straightened_policy00[s])] for s, p in zip(S, P))
-        return action
+        return self.distance_keeping_controller.get_action(state)
+
+    def toc_get_actions(self, states):  # (N, 2) states -> (N, 1) turn rates
+        return self.time_optimal_controller.get_actions(states)
+
+    def dkc_get_actions(self, states):  # (N, 2) states -> (N, 1) turn rates
+        return self.distance_keeping_controller.get_actions(states)
 
     def control_uav(self, uav_idx, action):
-        self.uavs[uav_idx].charging = 0
-        if self.uavs[uav_idx].battery <= 0: # UAV dead
-            pass
-        else: # UAV alive: can take action
-            if action == 0:  # go to charging station
-                if (self.uavs[uav_idx].obs[0] < self.r_c):
-                    # uav1 no move
-                    self.uavs[uav_idx].charging = 1
-                    self.uavs[uav_idx].battery = min(self.uavs[uav_idx].battery + 10, 3000)
-                else:  # not able to land on charge station(too far)
-                    self.uavs[uav_idx].battery -= 1
-                    w1_action = self.toc_get_action(self.uavs[uav_idx].obs[:2])
-                    self.uavs[uav_idx].move(w1_action)
-            else:  # surveil target1
-                self.uavs[uav_idx].battery -= 1
-                w1_action = self.dkc_get_action(self.rel_observation(uav_idx, action-1)[:2])
-                self.uavs[uav_idx].move(w1_action)
+        self.control_uavs([uav_idx], [action])
+
+    def control_uavs(self, uav_indices, actions):
+        # update batteries and charging flags of all UAVs at once, then resolve the
+        # low-level turn rates with one lookup per controller
+        uav_indices = np.asarray(uav_indices, dtype=int).reshape(-1)
+        actions = np.asarray(actions, dtype=int).reshape(-1)
+        station_obs = self.station_observations(uav_indices)
+        self.batteries[uav_indices], landed, to_station, to_target = fleet_control(
+            self.batteries[uav_indices], station_obs[:, 0], actions, self.r_c
+        )
+        self.charging[uav_indices] = landed
+        turn_rates = np.zeros(len(uav_indices), dtype=self.actions.dtype)
+        if to_station.any():
+            turn_rates[to_station] = self.toc_get_actions(station_obs[to_station, :2])[
+                :, 0
+            ]
+        if to_target.any():
+            rel_obs = self.rel_observations(
+                uav_indices[to_target], actions[to_target] - 1
+            )
+            turn_rates[to_target] = self.dkc_get_actions(rel_obs[:, :2])[:, 0]
+        flying = to_station | to_target
+        self.move_uavs(uav_indices[flying], turn_rates[flying])
+
+    def move_uavs(self, uav_indices, turn_rates):
+        self.uav_states[uav_indices] = unicycle_moves(
+            self.uav_states[uav_indices], turn_rates, self.v, self.dt
+        )
 
     def cal_surveillance(self, uav_idx, target_idx):
         if self.uavs[uav_idx].battery <= 0:
@@ -285,22 +610,18 @@ class MUMT(Env):
         terminal = False
         truncated = False
         action = np.squeeze(action)
-        reward = 0
         if action.ndim == 0:
             action = np.expand_dims(action, axis=0)
-        for uav_idx, uav_action in enumerate(action):
-            self.control_uav(uav_idx, uav_action)
-
-        surveillance_matrix = np.zeros((self.m, self.n))
-        for uav_idx in range(self.m):
-            for target_idx in range(self.n):
-                surveillance_matrix[uav_idx, target_idx] = self.cal_surveillance(uav_idx, target_idx)
-        surveillance = np.any(surveillance_matrix, axis=0).astype(int)
-        for target_idx in range(self.n):
-            self.targets[target_idx].surveillance = surveillance[target_idx]
-            self.targets[target_idx].cal_age()
-            reward += -self.targets[target_idx].age
-        reward = reward / self.n # average reward of all targets
+        self.control_uavs(np.arange(self.m), action)
+
+        # all m x n relative observations once per step, shared by surveillance and
+        # observation
+        rel_obs = self.rel_observations()
+        station_obs = self.station_observations()
+        self.surveillance, self.ages = surveil(
+            rel_obs[..., 0], self.batteries, self.charging, self.ages, self.d, self.l
+        )
+        reward = -self.ages.sum() / self.n  # average reward of all targets
         if self.save_frames and int(self.step_count) % 6 == 0:
             image = self.render(mode="rgb_array")
             path = os.path.join(
@@ -308,14 +629,21 @@ class MUMT(Env):
                 f"{self.episode_counter:03d}",
                 f"{self.frame_counter+1:04d}.bmp",
             )
-            image = Image.fromarray(image)
             '''setup text label here'''
-            image.save(path)
+            (write_frame if self.frame_writer is None else self.frame_writer.write)(
+                path, image
+            )
             self.frame_counter += 1
         self.step_count += 1
         if self.step_count >= self.max_step:
             truncated = True
-        return self.dict_observation, reward, terminal, truncated, {}
+        return (
+            self.build_observation(rel_obs, station_obs),
+            reward,
+            terminal,
+            truncated,
+            {},
+        )
 
     def dry_cal_surveillance(self, uav1_copy, target1_copy, r_t):
         if uav1_copy.battery <= 0: # UAV dead
@@ -328,6 +656,43 @@ class MUMT(Env):
                 target1_copy.surveillance = 0
         return target1_copy.surveillance
 
+    def rollout_env(self, num_envs):
+        # batched simulator with the parameters of this env, created once per number of
+        # candidates
+        if num_envs not in self.rollout_envs:
+            self.rollout_envs[num_envs] = MUMTVectorEnv(
+                num_envs=num_envs,
+                max_episode_steps=self.max_step,
+                dt=self.dt,
+                d=self.d,
+                l=self.l,
+                m=self.m,
+                n=self.n,
+                r_c=self.r_c,
+                flat_observation=self.flat_observation,
+            )
+        return self.rollout_envs[num_envs]
+
+    def rollout(self, candidate_actions, future, discount=None):
+        # lookahead: every candidate joint action (K, m) is held for up to future steps
+        # from the current state, all K candidates simulated together; returns final
+        # observations (K, ...), discounted returns (K,) and truncations (K,)
+        candidate_actions = np.asarray(candidate_actions, dtype=int).reshape(
+            (-1, self.m)
+        )
+        sim = self.rollout_env(len(candidate_actions))
+        sim.uav_states[:] = self.uav_states
+        sim.batteries[:] = self.batteries
+        sim.charging[:] = self.charging
+        sim.target_states[:] = self.target_states
+        sim.ages[:] = self.ages
+        sim.surveillance[:] = self.surveillance
+        sim.steps[:] = self.step_count
+        sim.max_episode_steps = self.max_step
+        return sim.rollout(
+            candidate_actions, future, self.discount if discount is None else discount
+        )
+
     def dry_step(self, uav_idx, target_idx, action, future, discount):
         # Copying relevant instance variables
         uav1_copy = self.uavs[uav_idx].copy()
@@ -390,8 +755,19 @@ class MUMT(Env):
         return dry_dict_observation, reward, terminal, truncated, {}
 
     def render(self, mode="human"):
+        # rgb_array frames (e.g. save_frames) never need a window or display
+        backend = (
+            rendering
+            if mode == "human" and rendering is not None
+            else headless_rendering
+        )
+        if self.viewer is not None and self.rendering is not backend:
+            # the mode switched backends since the last call; reopen the viewer
+            self.viewer.close()
+            self.viewer = None
         if self.viewer is None:
-            self.viewer = rendering.Viewer(1000, 1000)
+            self.rendering = backend
+            self.viewer = self.rendering.Viewer(1000, 1000)
             bound = int(40 * 1.05)
             self.viewer.set_bounds(-bound, bound, -bound, bound)
 
@@ -444,7 +820,9 @@ class MUMT(Env):
             if uav.battery <= 0:  # UAV dead
                 continue
             uav_x, uav_y, uav_theta = uav.state
-            uav_transform = rendering.Transform(translation=(uav_x, uav_y), rotation=uav_theta)
+            uav_transform = self.rendering.Transform(
+                translation=(uav_x, uav_y), rotation=uav_theta
+            )
             uav_tri = self.viewer.draw_polygon([(-0.8, 0.8), (-0.8, -0.8), (1.6, 0)])
             try:
                 uav_tri.set_color(*self.uav_color[uav_idx])
@@ -456,36 +834,300 @@ class MUMT(Env):
 
         return self.viewer.render(return_rgb_array=mode == "rgb_array")
 
+    def close(self):
+        # writes the frames still queued for the frame writer
+        if self.frame_writer is not None:
+            self.frame_writer.close()
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+
     # @property
     def rel_observation(self, uav_idx, target_idx): # of target relative to uav
-        uav_x, uav_y, theta = self.uavs[uav_idx].state
-        target_x, target_y = self.targets[target_idx].state
-        x = target_x - uav_x
-        y = target_y - uav_y
-        r = np.sqrt(x**2 + y**2)
-        beta = arctan2(y, x)
-        alpha = wrap(beta - wrap(theta))
-        return array([r, alpha, beta],dtype=np.float32)
+        return self.rel_observations(uav_idx, target_idx)
+
+    def rel_observations(self, uav_indices=None, target_indices=None):
+        # r, alpha, beta of targets relative to uavs: (m, n, 3) for all pairs, else one
+        # row per (uav, target) pair
+        if uav_indices is None:
+            return relative_polar(
+                self.uav_states[:, np.newaxis], self.target_states[np.newaxis]
+            )
+        return relative_polar(
+            self.uav_states[uav_indices], self.target_states[target_indices]
+        )
+
+    def station_observations(self, uav_indices=None):
+        return station_polar(
+            self.uav_states if uav_indices is None else self.uav_states[uav_indices]
+        )
+
+    def build_dict_observation(self, rel_obs, station_obs):
+        return mumt_dict_observation(
+            self.pair_keys,
+            self.station_keys,
+            rel_obs,
+            station_obs,
+            self.batteries,
+            self.ages,
+        )
+
+    def build_observation(
+        self, rel_obs, station_obs
+    ):  # in the layout of the observation space
+        if self.flat_observation:
+            return mumt_flat_observation(
+                rel_obs, station_obs, self.batteries, self.ages, self.observation
+            )
+        return self.build_dict_observation(rel_obs, station_obs)
 
     @property
     def dict_observation(self):
-        dictionary_obs = {}
-        # Add observations for UAV-target pairs according to the rule
-        for uav_id in range(self.m):
-            for target_id in range(self.n):
-                key = f"uav{uav_id+1}_target{target_id+1}"
-                dictionary_obs[key] = self.rel_observation(uav_id, target_id)[:2]
-
-        # Add observations for each UAV-charging station
-        for uav_id in range(self.m):
-            key = f"uav{uav_id+1}_charge_station"
-            dictionary_obs[key] = self.uavs[uav_id].obs[:2]
-
-        # Add observation for battery levels and ages of targets
-        dictionary_obs["battery"] = np.float32([self.uavs[uav_id].battery for uav_id in range(self.m)])
-        dictionary_obs["age"] = np.float32([self.targets[target_id].age for target_id in range(self.n)])
-
-        return dictionary_obs
+        return self.build_dict_observation(
+            self.rel_observations(), self.station_observations()
+        )
+
+
+class MUMTVectorEnv(VectorEnv):
+    """
+    num_envs independent MUMT episodes simulated together in (num_envs, m, ...) arrays
+    - same dynamics, rewards and Dict (or, with flat_observation, flat Box)
+      observation layout as MUMT, batched with batch_space
+    - a truncated episode is reset on the next step (reward 0), as in SyncVectorEnv
+    """
+
+    metadata = {"render_modes": []}
+
+    def __init__(
+        self,
+        num_envs: int = 2,
+        max_episode_steps: int = 6000,
+        render_mode: Optional[str] = None,
+        r_max=80,
+        r_min=0,
+        dt=0.05,
+        d=10.0,
+        l=3,  # noqa
+        m=2,  # of uavs
+        n=2,  # of targets
+        r_c=3,
+        flat_observation=False,
+    ):
+        if render_mode is not None:
+            raise ValueError(
+                f"MUMTVectorEnv does not render, render_mode must be None, got {render_mode!r}"
+            )
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps
+        self.render_mode = render_mode
+        # (num_envs, 2mn + 3m + n) observations written in place into self.observations
+        self.flat_observation = flat_observation
+        if flat_observation:
+            self.single_observation_space = mumt_flat_observation_space(
+                m, n, r_min, r_max
+            )
+        else:
+            self.single_observation_space = mumt_observation_space(m, n, r_min, r_max)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.observations = (
+            np.zeros(self.observation_space.shape, dtype=np.float32)
+            if flat_observation
+            else None
+        )
+        self.single_action_space = MultiDiscrete([n + 1] * m)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.dt = dt
+        self.discount = 0.999
+        self.d = d  # target distance
+        self.l = l  # coverage gap: coverage: d-l ~ d+l # noqa
+        self.m = m  # of uavs
+        self.n = n  # of targets
+        self.v = 1.0  # uav speed
+        self.r_c = r_c  # charge station radius
+        self.pair_keys = [
+            f"uav{uav_id}_target{target_id}"
+            for uav_id in range(1, m + 1)
+            for target_id in range(1, n + 1)
+        ]
+        self.station_keys = [
+            f"uav{uav_id}_charge_station" for uav_id in range(1, m + 1)
+        ]
+
+        self.uav_states = np.zeros((num_envs, m, 3))  # x, y, theta
+        self.batteries = np.zeros((num_envs, m), dtype=int)
+        self.charging = np.zeros((num_envs, m), dtype=int)
+        self.target_states = np.zeros((num_envs, n, 2))  # x, y
+        self.ages = np.zeros((num_envs, n), dtype=int)
+        self.surveillance = np.zeros((num_envs, n), dtype=int)
+        self.steps = np.zeros(num_envs, dtype=int)
+        self._autoreset_envs = np.zeros(num_envs, dtype=np.bool_)
+
+        self.n_r = 800
+        self.n_alpha = 360
+        self.n_u = 2  # 21
+        (
+            self.states,
+            self.actions,
+            self.distance_keeping_controller,
+            self.time_optimal_controller,
+        ) = load_mumt_controllers(self.n_r, self.n_alpha, self.n_u)
+
+    def reset(
+        self,
+        *,
+        seed: Optional[int] = None,
+        options: Optional[dict] = None,
+    ):
+        super().reset(seed=seed)
+        self.reset_envs(np.ones(self.num_envs, dtype=np.bool_))
+        self._autoreset_envs = np.zeros(self.num_envs, dtype=np.bool_)
+        rel_obs = relative_polar(
+            self.uav_states[:, :, np.newaxis], self.target_states[:, np.newaxis]
+        )
+        return self.build_observations(rel_obs, station_polar(self.uav_states)), {}
+
+    def reset_envs(self, mask):
+        # initial states drawn as in MUMT.reset
+        k = np.count_nonzero(mask)
+        uav_r = self.np_random.uniform(0, 40, (k, self.m))  # D=40
+        uav_beta = self.np_random.uniform(-pi, pi, (k, self.m))
+        uav_theta = self.np_random.uniform(-pi, pi, (k, self.m))
+        self.uav_states[mask] = np.stack(
+            [uav_r * np.cos(uav_beta), uav_r * np.sin(uav_beta), uav_theta], axis=-1
+        )
+        self.batteries[mask] = self.np_random.integers(1500, 3000, (k, self.m))
+        self.charging[mask] = 0
+        target_r = self.np_random.uniform(20, 35, (k, self.n))  # 0~ D-d
+        target_beta = self.np_random.uniform(-pi, pi, (k, self.n))
+        self.target_states[mask] = np.stack(
+            [target_r * np.cos(target_beta), target_r * np.sin(target_beta)], axis=-1
+        )
+        self.ages[mask] = 0
+        self.surveillance[mask] = 0
+        self.steps[mask] = 0
+
+    def simulate(self, actions, active=None):
+        # one step of the dynamics for (num_envs, m) actions, only for the active
+        # episodes if given; returns relative observations and rewards
+        actions = np.asarray(actions, dtype=int).reshape((self.num_envs, self.m))
+        station_obs = station_polar(self.uav_states)
+        batteries, landed, to_station, to_target = fleet_control(
+            self.batteries, station_obs[..., 0], actions, self.r_c
+        )
+        if active is not None:
+            batteries = np.where(active[:, np.newaxis], batteries, self.batteries)
+            landed = np.where(active[:, np.newaxis], landed, self.charging == 1)
+            to_station &= active[:, np.newaxis]
+            to_target &= active[:, np.newaxis]
+        self.batteries = batteries
+        self.charging = landed.astype(int)
+        # one lookup per controller for all UAVs of all episodes
+        turn_rates = np.zeros((self.num_envs, self.m), dtype=self.actions.dtype)
+        if to_station.any():
+            turn_rates[to_station] = self.time_optimal_controller.get_actions(
+                station_obs[to_station][:, :2]
+            )[:, 0]
+        if to_target.any():
+            env_idx, uav_idx = np.nonzero(to_target)
+            rel_obs = relative_polar(
+                self.uav_states[env_idx, uav_idx],
+                self.target_states[env_idx, actions[env_idx, uav_idx] - 1],
+            )
+            turn_rates[to_target] = self.distance_keeping_controller.get_actions(
+                rel_obs[:, :2]
+            )[:, 0]
+        flying = to_station | to_target
+        self.uav_states[flying] = unicycle_moves(
+            self.uav_states[flying], turn_rates[flying], self.v, self.dt
+        )
+
+        rel_obs = relative_polar(
+            self.uav_states[:, :, np.newaxis], self.target_states[:, np.newaxis]
+        )
+        surveillance, ages = surveil(
+            rel_obs[..., 0], self.batteries, self.charging, self.ages, self.d, self.l
+        )
+        if active is not None:
+            surveillance = np.where(
+                active[:, np.newaxis], surveillance, self.surveillance
+            )
+            ages = np.where(active[:, np.newaxis], ages, self.ages)
+        self.surveillance, self.ages = surveillance, ages
+        rewards = -self.ages.sum(axis=1) / self.n  # average reward of all targets
+        return rel_obs, rewards
+
+    def step(self, actions):
+        rel_obs, rewards = self.simulate(actions)
+        self.steps += 1
+        terminations = np.zeros(self.num_envs, dtype=np.bool_)
+        truncations = self.steps >= self.max_episode_steps
+
+        resetting = self._autoreset_envs
+        if resetting.any():
+            self.reset_envs(resetting)
+            rewards[resetting] = 0.0
+            truncations[resetting] = False
+            rel_obs[resetting] = relative_polar(
+                self.uav_states[resetting][:, :, np.newaxis],
+                self.target_states[resetting][:, np.newaxis],
+            )
+        self._autoreset_envs = terminations | truncations
+        observations = self.build_observations(rel_obs, station_polar(self.uav_states))
+        return observations, rewards, terminations, truncations, {}
+
+    def rollout(self, actions, future, discount=None):
+        # holds the (num_envs, m) actions for up to future steps from the current
+        # states, without autoreset; returns the final observations, discounted returns
+        # and truncations, an episode stops once truncated
+        if discount is None:
+            discount = self.discount
+        returns = np.zeros(self.num_envs)
+        active = np.ones(
+            self.num_envs, dtype=np.bool_
+        )  # the first step is always taken, as in MUMT.dry_step
+        for i in range(future):
+            _, rewards = self.simulate(actions, active)
+            returns[active] += discount**i * rewards[active]
+            self.steps[active] += 1
+            active &= self.steps < self.max_episode_steps
+            if not active.any():
+                break
+        # from the final states, so that future=0 observes the current ones
+        rel_obs = relative_polar(
+            self.uav_states[:, :, np.newaxis], self.target_states[:, np.newaxis]
+        )
+        observations = self.build_observations(rel_obs, station_polar(self.uav_states))
+        return observations, returns, self.steps >= self.max_episode_steps
+
+    def build_observations(
+        self, rel_obs, station_obs
+    ):  # in the layout of the observation space
+        if self.flat_observation:
+            return mumt_flat_observation(
+                rel_obs, station_obs, self.batteries, self.ages, self.observations
+            )
+        return mumt_dict_observation(
+            self.pair_keys,
+            self.station_keys,
+            rel_obs,
+            station_obs,
+            self.batteries,
+            self.ages,
+        )
+
+    @property
+    def dict_observation(self):
+        rel_obs = relative_polar(
+            self.uav_states[:, :, np.newaxis], self.target_states[:, np.newaxis]
+        )
+        return mumt_dict_observation(
+            self.pair_keys,
+            self.station_keys,
+            rel_obs,
+            station_polar(self.uav_states),
+            self.batteries,
+            self.ages,
+        )
 
 
 if __name__ == "__main__":
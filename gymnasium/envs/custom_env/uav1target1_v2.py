@@ -5,14 +5,19 @@ sys.path.append(current_file_path)
 desired_path = os.path.expanduser("~/Project/PERSISTENT/Gymnasium")
 sys.path.append(desired_path)
 import numpy as np
-from gymnasium import Env
+from gymnasium import Env, error
 from gymnasium.spaces import Box, Dict, Discrete # MultiBinary, MultiDiscrete
 from typing import Optional
-import rendering
-
-from mdp import Actions, States
+try:
+    import rendering
+except ImportError: # no pyglet or OpenGL: frames are rasterized offscreen only
+    rendering = None
+import headless_rendering
+from frame_writer import write_frame
+
+from mdp import Actions, LookupTableController, States
 from numpy import arctan2, array, cos, pi, sin
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageFont
 
 def wrap(theta):
     if theta > pi:
@@ -139,14 +144,19 @@ class UAV1Target1_v2(Env):
         self.n = n  # of uavs
         self.r_c = r_c  # charge station radius
         self.step_count = None
-        self.font = ImageFont.truetype("/usr/share/fonts/truetype/freefont/FreeMono.ttf", 20)
+        try:
+            self.font = ImageFont.truetype("/usr/share/fonts/truetype/freefont/FreeMono.ttf", 20)
+        except OSError:  # FreeMono is not installed everywhere
+            self.font = ImageFont.load_default()
         self.num2str = {0: "charge", 1: "target_1"}
         self.max_step = max_step
         self.viewer = None
+        self.rendering = None
         self.SAVE_FRAMES_PATH = "../../../../visualized/1U1T" # example. save frames path is set at surveillance_PPO.py
         self.episode_counter = 0
         self.frame_counter = 0
         self.save_frames = False
+        self.frame_writer = None # FrameWriter that saves frames off the step thread, synchronous if None
         self.action = None
         # self.print_q_init()
         self.future = 10
@@ -156,12 +166,6 @@ class UAV1Target1_v2(Env):
         self.n_alpha = 360
         self.n_u = 2 #21
 
-        current_file_path = os.path.dirname(os.path.abspath(__file__))
-        self.distance_keeping_result00 = np.load(current_file_path+ os.path.sep + "v1_80_2a_dkc_val_iter.npz")
-        self.distance_keeping_straightened_policy00 = self.distance_keeping_result00["policy"] # .data
-        self.time_optimal_straightened_policy00 = np.load(current_file_path+ os.path.sep + "v1_terminal_40+40_2a_toc_policy_fp64.npy")
-        # print('shape of time_optimal_straightened_policy00',np.shape(self.time_optimal_straightened_policy00)) # 288000
-
         self.states = States(
             np.linspace(0.0, 80.0, self.n_r, dtype=np.float32),
             np.linspace(
@@ -179,6 +183,20 @@ class UAV1Target1_v2(Env):
             )
         )
 
+        # lookup-table controllers are compiled once per policy file and shared between instances
+        current_file_path = os.path.dirname(os.path.abspath(__file__))
+        try:
+            self.distance_keeping_controller = LookupTableController.load(
+                current_file_path + os.path.sep + "v1_80_2a_dkc_val_iter.npz", self.states, self.actions, key="policy"
+            )
+            self.time_optimal_controller = LookupTableController.load(
+                current_file_path + os.path.sep + "v1_terminal_40+40_2a_toc_policy_fp64.npy", self.states, self.actions
+            )
+        except FileNotFoundError as e:  # the policy tables are data files, not part of every checkout
+            raise error.DependencyNotInstalled(f"Policy table {e.filename} is missing; run the DP solvers to generate it") from e
+        self.distance_keeping_straightened_policy00 = self.distance_keeping_controller.policy
+        self.time_optimal_straightened_policy00 = self.time_optimal_controller.policy
+
     def reset(
         self,
         uav_pose=None,
@@ -265,18 +283,16 @@ class UAV1Target1_v2(Env):
         )
 
     def toc_get_action(self, state):
-        S, P = self.states.computeBarycentric(state)
-        action = 0
-        for s, p in zip(S, P):
-            action += p * self.actions[int(self.time_optimal_straightened_policy00[s])]
-        return action
+        return self.time_optimal_controller.get_action(state)
 
     def dkc_get_action(self, state):
-        S, P = self.states.computeBarycentric(state)
-        action = 0
-        for s, p in zip(S, P):
-            action += p * self.actions[int(self.distance_keeping_straightened_policy00[s])]
-        return action
+        return self.distance_keeping_controller.get_action(state)
+
+    def toc_get_actions(self, states): # (N, 2) states -> (N, 1) turn rates
+        return self.time_optimal_controller.get_actions(states)
+
+    def dkc_get_actions(self, states): # (N, 2) states -> (N, 1) turn rates
+        return self.distance_keeping_controller.get_actions(states)
 
     def step(self, action):
         self.action = action
@@ -314,8 +330,6 @@ class UAV1Target1_v2(Env):
                     f"{self.episode_counter:03d}",
                     f"{self.frame_counter+1:04d}.bmp",
                 )
-                image = Image.fromarray(image)
-                draw = ImageDraw.Draw(image)
                 # left upper corner
                 text0 = f"r_c: {self.uav1.obs[0]}, a_c: {self.uav1.obs[1]}"
                 text1 = f"r_t: {self.target1.obs[0]}, a_t: {self.target1.obs[1]}"
@@ -326,15 +340,18 @@ class UAV1Target1_v2(Env):
                 text6 = "age: {}".format(self.target1.age)
                 text7 = "Reward: {}".format(reward)
 
-                draw.text((0, 0), text0, color=(200, 200, 200), font=self.font)
-                draw.text((0, 20), text1, color=(200, 200, 200), font=self.font)
-                # draw.text((0, 40), text2, color=(255, 255, 0), font=self.font)
-                # draw.text((0, 60), text3, color=(200, 200, 200), font=self.font)
-                # draw.text((0, 80), text4, color=(200, 200, 200), font=self.font)
-                draw.text((0, 100), text5, color=(255, 255, 255), font=self.font)
-                draw.text((0, 120), text6, color=(255, 255, 255), font=self.font)
-                draw.text((0, 140), text7, color=(255, 255, 255), font=self.font)         
-                image.save(path)
+                texts = [
+                    ((0, 0), text0, (200, 200, 200)),
+                    ((0, 20), text1, (200, 200, 200)),
+                    # ((0, 40), text2, (255, 255, 0)),
+                    # ((0, 60), text3, (200, 200, 200)),
+                    # ((0, 80), text4, (200, 200, 200)),
+                    ((0, 100), text5, (255, 255, 255)),
+                    ((0, 120), text6, (255, 255, 255)),
+                    ((0, 140), text7, (255, 255, 255)),
+                ]
+                # labels are drawn and the frame encoded by the writer thread, if any
+                (write_frame if self.frame_writer is None else self.frame_writer.write)(path, image, texts, self.font)
                 self.frame_counter += 1
         self.step_count += 1
         if self.step_count >= self.max_step:
@@ -412,8 +429,15 @@ class UAV1Target1_v2(Env):
 
 
     def render(self, mode="human"):
+        # rgb_array frames (e.g. save_frames) never need a window or display
+        backend = rendering if mode == "human" and rendering is not None else headless_rendering
+        if self.viewer is not None and self.rendering is not backend:
+            # the mode switched backends since the last call; reopen the viewer
+            self.viewer.close()
+            self.viewer = None
         if self.viewer is None:
-            self.viewer = rendering.Viewer(1000, 1000)
+            self.rendering = backend
+            self.viewer = self.rendering.Viewer(1000, 1000)
             bound = int(40 * 1.05)
             self.viewer.set_bounds(-bound, bound, -bound, bound)
 
@@ -460,12 +484,20 @@ class UAV1Target1_v2(Env):
             pass
         else:
             uav1_x, uav1_y, uav1_theta = self.uav1.state
-            uav1_tf = rendering.Transform(translation=(uav1_x, uav1_y), rotation=uav1_theta)
+            uav1_tf = self.rendering.Transform(translation=(uav1_x, uav1_y), rotation=uav1_theta)
             uav1_tri = self.viewer.draw_polygon([(-0.8, 0.8), (-0.8, -0.8), (1.6, 0)])
             uav1_tri.set_color(1, 1, 1)  # (1,1,0)yellow
             uav1_tri.add_attr(uav1_tf)
         return self.viewer.render(return_rgb_array=mode == "rgb_array")
 
+    def close(self):
+        # writes the frames still queued for the frame writer
+        if self.frame_writer is not None:
+            self.frame_writer.close()
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+
     @property
     def rel_observation(self): # of target relative to uav
         uav_x, uav_y, theta = self.uav1.state
@@ -0,0 +1,102 @@
+"""Tests that the lookup-table controllers match the policies they are built from."""
+import numpy as np
+import pytest
+
+from gymnasium.envs.custom_env.mdp import (
+    LookupTableController,
+    Policy,
+    RunLengthPolicy,
+    load_policy_table,
+)
+from tests.envs.custom_env.utils import (
+    N_ALPHA,
+    N_R,
+    N_U,
+    edge_queries,
+    synthetic_grid,
+)
+
+
+def blocky_policy(seed=0):
+    """Runs of equal actions along alpha, as in the solved DKC and TOC tables."""
+    rng = np.random.default_rng(seed)
+    runs = rng.integers(1, 8, N_R * N_ALPHA)
+    actions = rng.integers(0, N_U, len(runs))
+    return np.repeat(actions, runs)[: N_R * N_ALPHA]
+
+
+def random_queries(num_queries=100, seed=0, dtype=np.float32):
+    """(r, alpha) queries, some of them beyond the r axis."""
+    rng = np.random.default_rng(seed)
+    return np.stack(
+        [
+            rng.uniform(-5.0, 85.0, num_queries),
+            rng.uniform(-np.pi, np.pi, num_queries),
+        ],
+        axis=1,
+    ).astype(dtype)
+
+
+def test_run_length_policy_round_trip(tmp_path):
+    policy = blocky_policy()
+    table = RunLengthPolicy.from_array(policy)
+    assert table.values.dtype == np.uint8
+    np.testing.assert_array_equal(table.toarray(), policy)
+    np.testing.assert_array_equal(table[::7], policy[::7])
+    np.testing.assert_array_equal(table[[-1, 0, 5]], policy[[-1, 0, 5]])
+    assert table[-1] == policy[-1]
+
+    table.save(tmp_path / "policy.npz")
+    loaded = RunLengthPolicy.load(tmp_path / "policy.npz")
+    np.testing.assert_array_equal(loaded.toarray(), policy)
+
+    empty = RunLengthPolicy.from_array(np.array([], dtype=int))
+    assert len(empty) == 0
+    assert len(empty.toarray()) == 0
+
+
+def test_run_length_policy_as_policy_data():
+    states, actions = synthetic_grid()
+    policy = blocky_policy()
+    dense = Policy(states, actions)
+    dense.update(RunLengthPolicy.from_array(policy))
+    np.testing.assert_array_equal(dense.toarray(copy=True), policy)
+    dense.toarray()[:3] = 0
+    np.testing.assert_array_equal(dense.toarray()[:3], 0)
+
+
+def test_run_length_controller_matches_dense(tmp_path):
+    states, actions = synthetic_grid()
+    policy = blocky_policy()
+    np.save(tmp_path / "policy.npy", policy)
+    dense = LookupTableController(states, actions, policy)
+    compressed = LookupTableController(
+        states,
+        actions,
+        load_policy_table(str(tmp_path / "policy.npy"), compressed=True),
+    )
+    queries = random_queries()
+    expected = dense.get_actions(queries)
+    np.testing.assert_array_equal(compressed.get_actions(queries), expected)
+    for query, action in zip(queries[:20], expected):
+        np.testing.assert_allclose(compressed.get_action(query), action, rtol=1e-6)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_lookup_table_controller_matches_policy(dtype):
+    states, actions = synthetic_grid(dtype=dtype)
+    policy = Policy(states, actions)
+    policy.update(blocky_policy().astype(policy.toarray().dtype))
+    controller = LookupTableController(states, actions, policy.toarray())
+    queries = np.concatenate([random_queries(dtype=dtype), edge_queries(states)])
+
+    expected = np.array([policy.get_action(query) for query in queries])
+    np.testing.assert_allclose(controller.get_actions(queries), expected, rtol=1e-6)
+    # batches up to small_batch_size take the per-query path
+    small = queries[: LookupTableController.small_batch_size]
+    np.testing.assert_allclose(
+        controller.get_actions(small), expected[: len(small)], rtol=1e-6
+    )
+    for query, action in zip(queries, expected):
+        np.testing.assert_allclose(controller.get_action(query), action, rtol=1e-6)
+    np.testing.assert_allclose(policy.get_actions(queries), expected, rtol=1e-6)
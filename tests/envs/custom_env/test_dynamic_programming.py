@@ -0,0 +1,171 @@
+"""Tests that the fast paths of the custom_env DP solvers reach the reference results."""
+import numpy as np
+import pytest
+
+from gymnasium.envs.custom_env.mdp import (
+    BatchValueIteration,
+    PolicyIteration,
+    load_checkpoint,
+    multigrid_solve,
+)
+from tests.envs.custom_env.utils import N_ALPHA, N_R, solve, synthetic_mdp
+
+
+@pytest.fixture(autouse=True)
+def _in_tmp_path(tmp_path, monkeypatch):
+    # the solvers write their results and plots to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize("method", ["gauss-seidel", "prioritized"])
+def test_value_iteration_sweeps_match_jacobi(method):
+    """Gauss-Seidel and prioritized sweeping converge to the Jacobi fixed point."""
+    values, _ = solve(synthetic_mdp())
+    sweep_values, _ = solve(synthetic_mdp(), method=method, block_size=64)
+    np.testing.assert_allclose(sweep_values, values, rtol=1e-4, atol=1e-3)
+
+
+def test_parallel_backups_match_serial():
+    """Backups split over worker processes give the serial values and policy."""
+    values, policy = solve(synthetic_mdp())
+    parallel_values, parallel_policy = solve(
+        synthetic_mdp(), parallel=True, processes=2
+    )
+    np.testing.assert_allclose(parallel_values, values, rtol=1e-6)
+    np.testing.assert_array_equal(parallel_policy, policy)
+
+
+def _renormalized(mdp, seed):
+    # the same sparsity pattern with other probabilities
+    matrix = mdp.state_transition_probability.tospmat().tocsr().copy()
+    matrix.data *= (
+        np.random.default_rng(seed).uniform(0.5, 1.5, matrix.nnz).astype(matrix.dtype)
+    )
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    matrix.data /= np.repeat(np.where(sums > 0, sums, 1), np.diff(matrix.indptr))
+    mdp.state_transition_probability.update(matrix)
+    return mdp
+
+
+@pytest.mark.parametrize(
+    "make_mdps",
+    [
+        # one shared matrix, batched in one sparse-matrix product
+        lambda: [
+            synthetic_mdp(discount=discount) for discount in (0.8, 0.85, 0.9, 0.95)
+        ],
+        # one sparsity pattern with different probabilities
+        lambda: [_renormalized(synthetic_mdp(), seed) for seed in range(4)],
+        # different matrices, one product per model
+        lambda: [synthetic_mdp(sigma=sigma) for sigma in (0.0, 0.5, 1.0)],
+    ],
+    ids=["shared", "pattern", "separate"],
+)
+def test_batch_value_iteration_matches_separate_solves(make_mdps):
+    mdps = make_mdps()
+    batch = BatchValueIteration(mdps)
+    batch.solve(max_iteration=2000, tolerance=1e-6, verbose=False)
+    for k, mdp in enumerate(make_mdps()):
+        values, _ = solve(mdp)
+        np.testing.assert_allclose(batch.values[:, k], values, rtol=1e-4, atol=1e-3)
+
+
+def test_batch_value_iteration_update_in_any_model_order():
+    mdps = [synthetic_mdp(d=d) for d in (5.0, 10.0, 15.0, 20.0)]
+    in_order = BatchValueIteration(mdps)
+    in_order.update()
+    reordered = BatchValueIteration(mdps)
+    reordered.update([3, 1, 2, 0])
+    np.testing.assert_allclose(reordered.values, in_order.values)
+
+
+@pytest.mark.parametrize("coarse_max_iteration", [0, 1e4])
+def test_multigrid_solve_matches_cold_solve(coarse_max_iteration):
+    """The coarse-grid warm start does not change the fixed point."""
+    mdp = synthetic_mdp()
+    values, policy = solve(mdp)
+    dp = multigrid_solve(
+        lambda states: synthetic_mdp(states=states),
+        mdp.states,
+        coarse_max_iteration=coarse_max_iteration,
+        sigma=0.5,
+        n_r=N_R,
+        n_alpha=N_ALPHA,
+        max_iteration=2000,
+        tolerance=1e-6,
+        verbose=True,
+        parallel=False,
+    )
+    np.testing.assert_allclose(dp.values, values, rtol=1e-4, atol=1e-3)
+    np.testing.assert_array_equal(dp.mdp.policy.toarray(), policy)
+
+
+def policy_iteration(mdp, **kwargs):
+    solver = PolicyIteration(mdp)
+    solver.solve(0.5, *mdp.states.shape, verbose=False, tolerance=1e-6, **kwargs)
+    return solver.values, mdp.policy.toarray(copy=True)
+
+
+def test_modified_policy_iteration_matches_policy_iteration():
+    """k evaluation sweeps per policy converge to the policy of exact evaluation."""
+    values, policy = policy_iteration(synthetic_mdp())
+    sweep_values, sweep_policy = policy_iteration(
+        synthetic_mdp(), evaluation_sweeps=5, max_iteration=2000
+    )
+    np.testing.assert_array_equal(sweep_policy, policy)
+    np.testing.assert_allclose(sweep_values, values, rtol=1e-4, atol=1e-3)
+
+
+def test_policy_matrix_matches_one_hot_rows():
+    mdp = synthetic_mdp()
+    rng = np.random.default_rng(0)
+    policy = rng.integers(0, mdp.actions.num_actions, mdp.states.num_states)
+    mdp.policy.update(policy.astype(mdp.policy.dtype))
+    P = mdp.state_transition_probability.tospmat()
+    # rows (s, policy[s]) of P selected by the one-hot policy mask, in state order
+    expected = P[mdp.policy.one_hot().ravel()]
+    np.testing.assert_array_equal(
+        PolicyIteration(mdp).policy_matrix().toarray(), expected.toarray()
+    )
+
+
+def test_value_iteration_resumes_from_checkpoint(tmp_path):
+    values, policy = solve(synthetic_mdp())
+    checkpoint = str(tmp_path / "checkpoint")
+    solve(synthetic_mdp(), max_iteration=30, checkpoint=checkpoint)
+    iteration, _, _ = load_checkpoint(checkpoint, (N_R, N_ALPHA))
+    assert iteration == 29
+
+    resumed_values, resumed_policy = solve(synthetic_mdp(), checkpoint=checkpoint)
+    np.testing.assert_allclose(resumed_values, values, rtol=1e-6)
+    np.testing.assert_array_equal(resumed_policy, policy)
+
+
+@pytest.mark.parametrize("n_r, n_alpha", [(N_ALPHA, N_R), (N_R // 2, N_ALPHA)])
+def test_checkpoint_of_another_grid_is_rejected(tmp_path, n_r, n_alpha):
+    checkpoint = str(tmp_path / "checkpoint")
+    solve(synthetic_mdp(), max_iteration=3, checkpoint=checkpoint)
+    with pytest.raises(ValueError, match="does not match"):
+        solve(synthetic_mdp(n_r=n_r, n_alpha=n_alpha), checkpoint=checkpoint)
+    # without resume the checkpoint is overwritten
+    solve(
+        synthetic_mdp(n_r=n_r, n_alpha=n_alpha),
+        max_iteration=3,
+        checkpoint=checkpoint,
+        resume=False,
+    )
+    assert load_checkpoint(checkpoint, (n_r, n_alpha))[0] == 2
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"epsilon": 1e-3}, {"acceleration": "anderson"}],
+    ids=["epsilon", "anderson"],
+)
+def test_value_iteration_stops_at_jacobi_policy(kwargs):
+    """The epsilon stop and Anderson mixing end with the plain Jacobi policy."""
+    values, policy = solve(synthetic_mdp())
+    fast_values, fast_policy = solve(synthetic_mdp(), **kwargs)
+    np.testing.assert_array_equal(fast_policy, policy)
+    if "acceleration" in kwargs:
+        np.testing.assert_allclose(fast_values, values, rtol=1e-4, atol=1e-3)
@@ -0,0 +1,53 @@
+"""Tests for writing rendered frames from a background thread."""
+import numpy as np
+import pytest
+from PIL import Image
+
+from gymnasium.envs.custom_env import frame_writer
+from gymnasium.envs.custom_env.frame_writer import FrameWriter
+
+
+def frames(num_frames):
+    # frames that differ in their first pixel
+    for i in range(num_frames):
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        frame[0, 0] = i
+        yield frame
+
+
+def test_frame_writer_writes_every_frame_in_order(tmp_path, monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        frame_writer,
+        "write_frame",
+        lambda path, frame, *args: written.append((path, int(frame[0, 0, 0]))),
+    )
+    # a short queue so that write blocks while the thread catches up
+    with FrameWriter(max_queue=2) as writer:
+        for i, frame in enumerate(frames(50)):
+            assert writer.write(str(tmp_path / f"{i:04d}.bmp"), frame)
+    assert written == [(str(tmp_path / f"{i:04d}.bmp"), i) for i in range(50)]
+
+
+def test_frame_writer_encodes_files(tmp_path):
+    with FrameWriter(format="png") as writer:
+        for i, frame in enumerate(frames(5)):
+            writer.write(str(tmp_path / f"{i:04d}.bmp"), frame)
+    for i, frame in enumerate(frames(5)):
+        with Image.open(tmp_path / f"{i:04d}.png") as image:
+            np.testing.assert_array_equal(np.asarray(image), frame)
+
+
+def test_frame_writer_raises_write_errors_on_close(tmp_path, monkeypatch):
+    def write_frame(path, *args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(frame_writer, "write_frame", write_frame)
+    writer = FrameWriter()
+    assert writer.write(str(tmp_path / "0000.bmp"), next(frames(1)))
+    with pytest.raises(OSError, match="disk full"):
+        writer.close()
+    # the error is raised once and the writer stays closed
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(str(tmp_path / "0001.bmp"), next(frames(1)))
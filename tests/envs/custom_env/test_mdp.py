@@ -0,0 +1,268 @@
+"""Tests for the storage and construction of the custom_env MDP components."""
+from functools import partial
+
+import numpy as np
+import pytest
+from scipy import sparse as sp
+
+from gymnasium.envs.custom_env.mdp import (
+    MarkovDecisionProcess,
+    Rewards,
+    States,
+    StateTransitionProbability,
+)
+from tests.envs.custom_env.utils import (
+    N_ALPHA,
+    N_U,
+    edge_queries,
+    solve,
+    synthetic_grid,
+    synthetic_mdp,
+)
+
+
+def test_from_coo_and_set_rows_match_dok():
+    """Bulk construction gives the matrix of per-entry DOK assignment."""
+    mdp = synthetic_mdp()
+    states, actions = mdp.states, mdp.actions
+    rng = np.random.default_rng(0)
+    num_rows = states.num_states * actions.num_actions
+    rows = np.repeat(rng.choice(num_rows, 50, replace=False), 3)
+    cols = rng.integers(0, states.num_states, len(rows))
+    probs = rng.dirichlet(np.ones(3), 50).ravel().astype(np.float32)
+
+    dok = StateTransitionProbability(states, actions)
+    for row, col, prob in zip(rows, cols, probs):
+        state, action = divmod(row, actions.num_actions)
+        dok[state, action, col] += prob
+
+    coo = StateTransitionProbability.from_coo(states, actions, rows, cols, probs)
+    np.testing.assert_allclose(coo.toarray(), dok.toarray(), atol=1e-6)
+
+    bulk = StateTransitionProbability(states, actions)
+    state, action = np.divmod(rows, actions.num_actions)
+    # rows written twice before finalize keep only the last write
+    bulk.set_rows(state, action, rng.integers(0, states.num_states, len(rows)), probs)
+    bulk.set_rows(state, action, cols, probs)
+    np.testing.assert_allclose(bulk.toarray(), dok.toarray(), atol=1e-6)
+
+
+def test_set_rows_keeps_pending_rows_on_invalid_probabilities():
+    mdp = synthetic_mdp()
+    probability = StateTransitionProbability(mdp.states, mdp.actions)
+    probability.set_rows(0, 0, [1, 2], [0.5, 0.5])
+    probability.set_rows(1, 0, [1, 2], [0.3, 0.3])
+    with pytest.raises(ValueError):
+        probability.finalize()
+    probability.set_rows(1, 0, [1, 2], [0.5, 0.5])
+    array = probability.toarray()
+    np.testing.assert_allclose(array[0, 1:3], [0.5, 0.5])
+    np.testing.assert_allclose(array[N_U, 1:3], [0.5, 0.5])
+
+
+def mapped(array):
+    # whether array is a view of a memory-mapped file
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+@pytest.mark.parametrize("sparse_rewards", [False, True])
+def test_save_mmap_round_trip(tmp_path, monkeypatch, sparse_rewards):
+    grid, _ = synthetic_grid()
+    state_lists, cycles = grid.info(return_data=True, return_cycles=True)
+    terminal_states = [grid[0], grid[N_ALPHA + 3]]
+    states = States(
+        *state_lists, cycles=cycles, terminal_states=terminal_states, dtype=grid.dtype
+    )
+    mdp = synthetic_mdp(states=states)
+    if sparse_rewards:
+        rewards = mdp.rewards.toarray(copy=True)
+        rewards[rewards < -5] = 0
+        mdp.rewards = Rewards(states, mdp.actions, sparse=True)
+        mdp.rewards.update(sp.csr_matrix(rewards))
+    rng = np.random.default_rng(0)
+    mdp.policy.update(rng.integers(0, N_U, states.num_states).astype(mdp.policy.dtype))
+
+    saved_policy = mdp.policy.toarray(copy=True)
+    mdp.save_mmap(str(tmp_path / "mdp"))
+    loaded = MarkovDecisionProcess()
+    loaded.load_mmap(str(tmp_path / "mdp"))
+
+    assert loaded.states.shape == states.shape
+    assert loaded.states.dtype == states.dtype
+    for loaded_list, state_list in zip(
+        loaded.states.info(return_data=True), state_lists
+    ):
+        np.testing.assert_array_equal(loaded_list, state_list)
+    np.testing.assert_array_equal(loaded.states.info(return_cycles=True), cycles)
+    np.testing.assert_array_equal(loaded.states.terminal_states, terminal_states)
+    np.testing.assert_array_equal(loaded.actions.toarray(), mdp.actions.toarray())
+    assert loaded.rewards.issparse == sparse_rewards
+    np.testing.assert_array_equal(loaded.rewards.toarray(), mdp.rewards.toarray())
+    P = loaded.state_transition_probability.tospmat()
+    assert all(mapped(array) for array in (P.data, P.indices, P.indptr))
+    np.testing.assert_array_equal(
+        P.toarray(), mdp.state_transition_probability.toarray()
+    )
+    np.testing.assert_array_equal(loaded.policy.toarray(), mdp.policy.toarray())
+    assert loaded.discount == mdp.discount
+
+    # the mapped model solves like the original one, without changing the files
+    monkeypatch.chdir(tmp_path)
+    values, policy = solve(mdp)
+    loaded_values, loaded_policy = solve(loaded)
+    np.testing.assert_array_equal(loaded_values, values)
+    np.testing.assert_array_equal(loaded_policy, policy)
+    np.testing.assert_array_equal(
+        np.load(tmp_path / "mdp" / "policy.data.npy"), saved_policy
+    )
+
+
+def shift_sampler(states, num_actions, state, sample_reward=False):
+    # action a moves the state by (a + 1, (a - 1) / 2), spread over the grid points
+    rows, cols, probs = [], [], []
+    for action in range(num_actions):
+        S, P = states.computeBarycentric(state + [action + 1, (action - 1) / 2])
+        rows += [action] * len(S)
+        cols += list(S)
+        probs += list(P)
+    spmat = sp.coo_matrix((probs, (rows, cols)), shape=(num_actions, states.num_states))
+    if sample_reward:
+        return spmat, -np.abs(state[0] - 10.0) * np.ones(num_actions)
+    return spmat
+
+
+def per_state_sample(mdp, sampler, sample_reward):
+    # the former sampler: one sampler call per state and a vstack of the rows
+    num_states, num_actions = mdp.rewards.shape
+    blocks, rewards = [], np.zeros((num_states, num_actions))
+    for s in range(num_states):
+        state = mdp.states[s]
+        if any(
+            np.array_equal(state, terminal) for terminal in mdp.states.terminal_states
+        ):
+            blocks.append(sp.csr_matrix((num_actions, num_states)))
+        elif sample_reward:
+            spmat, rewards[s] = sampler(state)
+            blocks.append(sp.csr_matrix(spmat))
+        else:
+            blocks.append(sp.csr_matrix(sampler(state)))
+    return sp.vstack(blocks).toarray(), rewards
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize(
+    "sample_reward, terminal, nnz_per_state",
+    [(False, False, None), (True, True, None), (True, False, 1)],
+)
+def test_sample_matches_per_state_sampling(
+    processes, sample_reward, terminal, nnz_per_state
+):
+    """Chunked sampling gives the matrix of sampling the states one by one.
+
+    With ``nnz_per_state=1`` nearly every state overflows its preallocated
+    buffer segment.
+    """
+    grid, actions = synthetic_grid()
+    state_lists, cycles = grid.info(return_data=True, return_cycles=True)
+    terminal_states = [grid[3], grid[N_ALPHA * 2 + 5]] if terminal else None
+    states = States(
+        *state_lists, cycles=cycles, terminal_states=terminal_states, dtype=grid.dtype
+    )
+    mdp = MarkovDecisionProcess(states, actions, Rewards(states, actions))
+    sampler = partial(
+        shift_sampler, states, actions.num_actions, sample_reward=sample_reward
+    )
+    mdp.sample(
+        sampler,
+        sample_reward=sample_reward,
+        verbose=False,
+        chunk_size=7,
+        nnz_per_state=nnz_per_state,
+        processes=processes,
+    )
+    expected, rewards = per_state_sample(mdp, sampler, sample_reward)
+    np.testing.assert_allclose(mdp.state_transition_probability.toarray(), expected)
+    if sample_reward:
+        np.testing.assert_allclose(mdp.rewards.toarray(), rewards)
+
+
+def wide_mdp(sparse_rewards):
+    # the synthetic model in float64 and int64 arrays
+    grid, _ = synthetic_grid(dtype=np.float64)
+    state_lists, cycles = grid.info(return_data=True, return_cycles=True)
+    states = States(
+        *state_lists, cycles=cycles, terminal_states=[grid[4]], dtype=np.float64
+    )
+    mdp = synthetic_mdp(states=states)
+    rewards = mdp.rewards.toarray().astype(np.float64)
+    mdp.rewards = Rewards(states, mdp.actions, sparse=sparse_rewards)
+    mdp.rewards.update(sp.csr_matrix(rewards) if sparse_rewards else rewards)
+    P = mdp.state_transition_probability.tospmat()
+    mdp.state_transition_probability.update(
+        sp.csr_matrix(
+            (
+                P.data.astype(np.float64),
+                P.indices.astype(np.int64),
+                P.indptr.astype(np.int64),
+            ),
+            shape=P.shape,
+        )
+    )
+    mdp.policy.update(np.zeros(states.num_states, dtype=np.int64))
+    return mdp
+
+
+@pytest.mark.parametrize("sparse_rewards", [False, True])
+def test_compact_narrows_dtypes_and_keeps_policy(tmp_path, monkeypatch, sparse_rewards):
+    monkeypatch.chdir(tmp_path)
+    _, policy = solve(wide_mdp(sparse_rewards))
+
+    mdp = wide_mdp(sparse_rewards)
+    nbytes = mdp.nbytes()
+    mdp.compact()
+    assert mdp.nbytes() < nbytes
+    assert mdp.states.dtype == np.float32
+    assert all(state_list.dtype == np.float32 for state_list in mdp.states.info(True))
+    assert mdp.states.terminal_states[0].dtype == np.float32
+    assert mdp.rewards.dtype == np.float32
+    assert mdp.rewards.issparse == sparse_rewards
+    P = mdp.state_transition_probability.tospmat()
+    assert P.data.dtype == np.float32
+    assert P.indices.dtype == P.indptr.dtype == np.int32
+    assert mdp.policy.toarray().dtype == np.uint8
+
+    _, compact_policy = solve(mdp)
+    np.testing.assert_array_equal(compact_policy, policy)
+
+
+def dense_weights(states, indices, probs):
+    weights = np.zeros(states.num_states)
+    np.add.at(weights, indices, probs)
+    return weights
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_barycentric_batch_matches_single_queries(dtype):
+    states, _ = synthetic_grid(dtype=dtype)
+    rng = np.random.default_rng(0)
+    queries = np.stack(
+        [rng.uniform(-5, 85, 200), rng.uniform(-np.pi, np.pi, 200)], axis=1
+    )
+    queries = np.concatenate([queries.astype(dtype), edge_queries(states)])
+
+    indices, probs = states.computeBarycentricBatch(queries)
+    assert indices.shape == probs.shape == (len(queries), 4)
+    assert probs.dtype == dtype
+    np.testing.assert_allclose(probs.sum(axis=1), 1, rtol=1e-6)
+    for query, query_indices, query_probs in zip(queries, indices, probs):
+        np.testing.assert_allclose(
+            dense_weights(states, query_indices, query_probs),
+            dense_weights(states, *states.computeBarycentric(query)),
+            rtol=1e-5,
+            atol=1e-6,
+            err_msg=str(query),
+        )
@@ -0,0 +1,139 @@
+"""Tests for the batched simulation and observations of MUMT."""
+import numpy as np
+import pytest
+
+from gymnasium.envs.custom_env import mumt
+
+
+M, N = 2, 3
+
+
+def synthetic_controllers(n_r=800, n_alpha=360, n_u=2):
+    """Lookup-table controllers of the MUMT grid on synthetic policy tables."""
+    states = mumt.States(
+        np.linspace(0.0, 80.0, n_r, dtype=np.float32),
+        np.linspace(-np.pi, np.pi - np.pi / n_alpha, n_alpha, dtype=np.float32),
+        cycles=[np.inf, np.pi * 2],
+    )
+    actions = mumt.Actions(
+        np.linspace(-1.0 / 4.5, 1.0 / 4.5, n_u, dtype=np.float32).reshape((-1, 1))
+    )
+    r, alpha = np.meshgrid(np.arange(n_r), np.arange(n_alpha), indexing="ij")
+    distance_keeping = ((alpha // 37 + r // 53) % n_u).ravel()
+    time_optimal = ((alpha // 90 + r // 200) % n_u).ravel()
+    return (
+        states,
+        actions,
+        mumt.LookupTableController(states, actions, distance_keeping),
+        mumt.LookupTableController(states, actions, time_optimal),
+    )
+
+
+@pytest.fixture(autouse=True)
+def _synthetic_policies(monkeypatch):
+    # the solved policy tables are data files that are not part of the repository
+    monkeypatch.setattr(mumt, "load_mumt_controllers", synthetic_controllers)
+
+
+def assert_dict_equal(flat, dictionary, m=M, n=N):
+    unpacked = mumt.mumt_flat_to_dict(flat, m, n)
+    assert unpacked.keys() == dictionary.keys()
+    for key, value in dictionary.items():
+        np.testing.assert_allclose(unpacked[key], value, rtol=1e-6, err_msg=key)
+
+
+@pytest.mark.parametrize("flat_observation", [False, True])
+def test_rollout_without_steps_observes_current_state(flat_observation):
+    env = mumt.MUMT(m=M, n=N, flat_observation=flat_observation)
+    env.reset(seed=0)
+    observations, returns, truncations = env.rollout([[0, 1], [2, 3]], 0)
+    np.testing.assert_array_equal(returns, 0)
+    assert not truncations.any()
+    if flat_observation:
+        observations = mumt.mumt_flat_to_dict(observations, M, N)
+    for key, value in env.dict_observation.items():
+        np.testing.assert_allclose(observations[key][0], value, rtol=1e-6)
+
+
+def test_flat_observation_matches_dict():
+    dict_env = mumt.MUMT(m=M, n=N)
+    flat_env = mumt.MUMT(m=M, n=N, flat_observation=True)
+    dict_obs, _ = dict_env.reset(seed=0)
+    flat_obs, _ = flat_env.reset(seed=0)
+    assert flat_env.observation_space.contains(flat_obs)
+    assert_dict_equal(flat_obs, dict_obs)
+
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        action = rng.integers(0, N + 1, M)
+        dict_obs, dict_reward, _, _, _ = dict_env.step(action)
+        flat_obs, flat_reward, _, _, _ = flat_env.step(action)
+        assert_dict_equal(flat_obs, dict_obs)
+        assert flat_reward == dict_reward
+
+
+def test_vector_flat_observation_matches_dict():
+    dict_env = mumt.MUMTVectorEnv(num_envs=3, m=M, n=N)
+    flat_env = mumt.MUMTVectorEnv(num_envs=3, m=M, n=N, flat_observation=True)
+    dict_obs, _ = dict_env.reset(seed=0)
+    flat_obs, _ = flat_env.reset(seed=0)
+    assert flat_env.observation_space.contains(flat_obs)
+    assert_dict_equal(flat_obs, dict_obs)
+
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        actions = rng.integers(0, N + 1, (3, M))
+        dict_obs, dict_rewards, _, _, _ = dict_env.step(actions)
+        flat_obs, flat_rewards, _, _, _ = flat_env.step(actions)
+        assert_dict_equal(flat_obs, dict_obs)
+        np.testing.assert_array_equal(flat_rewards, dict_rewards)
+
+
+STATE_ARRAYS = ("uav_states", "batteries", "charging", "target_states", "ages")
+
+
+def test_vector_env_matches_single_envs():
+    """MUMTVectorEnv steps like one MUMT per episode, with autoreset on the next step."""
+    num_envs, max_step = 3, 20
+    envs = [mumt.MUMT(m=M, n=N, max_step=max_step) for _ in range(num_envs)]
+    vector_env = mumt.MUMTVectorEnv(
+        num_envs=num_envs, max_episode_steps=max_step, m=M, n=N
+    )
+    vector_env.reset(seed=0)
+    for i, env in enumerate(envs):
+        env.reset(seed=i)
+        for name in STATE_ARRAYS + ("surveillance",):
+            getattr(vector_env, name)[i] = getattr(env, name)
+        # staggered episodes truncate on different steps
+        env.step_count = vector_env.steps[i] = i
+
+    rng = np.random.default_rng(0)
+    resets = np.zeros(num_envs, dtype=int)
+    for _ in range(2 * max_step):
+        actions = rng.integers(0, N + 1, (num_envs, M))
+        resetting = vector_env._autoreset_envs.copy()
+        resets += resetting
+        observations, rewards, terminations, truncations, _ = vector_env.step(actions)
+        for i, env in enumerate(envs):
+            if resetting[i]:
+                # the vector env starts a new episode instead of stepping
+                assert rewards[i] == 0 and not truncations[i]
+                for name in STATE_ARRAYS:
+                    getattr(env, name)[:] = getattr(vector_env, name)[i]
+                env.step_count = 0
+                observation = env.dict_observation
+            else:
+                observation, reward, terminated, truncated, _ = env.step(actions[i])
+                assert rewards[i] == reward
+                assert terminations[i] == terminated
+                assert truncations[i] == truncated
+            for key, value in observation.items():
+                np.testing.assert_allclose(
+                    observations[key][i], value, rtol=1e-6, err_msg=key
+                )
+    assert resets.all()
+
+
+def test_vector_env_rejects_render_mode():
+    with pytest.raises(ValueError, match="render_mode"):
+        mumt.MUMTVectorEnv(render_mode="rgb_array")
@@ -0,0 +1,43 @@
+"""Tests for the offscreen rendering of the custom UAV environments."""
+import numpy as np
+
+import gymnasium as gym
+from gymnasium.envs.custom_env import dkc_unicycle, headless_rendering
+
+
+def test_headless_viewer_rasterizes_geoms():
+    viewer = headless_rendering.Viewer(100, 100)
+    viewer.set_bounds(-10, 10, -10, 10)
+    circle = viewer.draw_circle(radius=2, x=5, y=5, filled=True)
+    circle.set_color(1, 0, 0)
+    triangle = viewer.draw_polygon([(-1, 1), (-1, -1), (2, 0)])
+    triangle.set_color(0, 0, 1)
+    triangle.add_attr(headless_rendering.Transform(translation=(-5, -5)))
+
+    frame = viewer.render(return_rgb_array=True)
+    assert frame.shape == (100, 100, 3) and frame.dtype == np.uint8
+    # world (5, 5) is column 75, row 25 (rows count from the top)
+    np.testing.assert_array_equal(frame[25, 75], [255, 0, 0])
+    np.testing.assert_array_equal(frame[75, 25], [0, 0, 255])
+    np.testing.assert_array_equal(frame[50, 50], [0, 0, 0])
+
+    # one-time geoms are drawn in a single frame only
+    np.testing.assert_array_equal(viewer.render(return_rgb_array=True), 0)
+    viewer.close()
+    assert not viewer.isopen
+
+
+def test_rgb_array_without_pyglet(monkeypatch):
+    monkeypatch.setattr(dkc_unicycle, "rendering", None)
+    env = gym.make("DKC_Unicycle", render_mode="rgb_array")
+    env.reset(seed=0)
+    first = env.render()
+    for _ in range(20):
+        env.step(env.action_space.high)
+    second = env.render()
+    assert env.unwrapped.rendering is headless_rendering
+    for frame in (first, second):
+        assert frame.shape == (1000, 1000, 3) and frame.dtype == np.uint8
+        assert frame.any()
+    assert np.any(first != second)
+    env.close()
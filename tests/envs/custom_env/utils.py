@@ -0,0 +1,77 @@
+"""Small synthetic models for testing the custom UAV environments and their solvers."""
+import numpy as np
+
+from gymnasium.envs.custom_env.mdp import (
+    Actions,
+    MarkovDecisionProcess,
+    Policy,
+    States,
+    ValueIteration,
+    unicycle_transitions,
+)
+
+
+N_R, N_ALPHA, N_U = 20, 10, 3
+
+
+def synthetic_grid(n_r=N_R, n_alpha=N_ALPHA, n_u=N_U, dtype=np.float32):
+    """The (r, alpha) grid and turn rates of the DP models."""
+    states = States(
+        np.linspace(0.0, 80.0, n_r, dtype=dtype),
+        np.linspace(-np.pi, np.pi - np.pi / n_alpha, n_alpha, dtype=dtype),
+        cycles=[np.inf, np.pi * 2],
+        dtype=dtype,
+    )
+    actions = Actions(
+        np.linspace(-1.0 / 4.5, 1.0 / 4.5, n_u, dtype=dtype).reshape((-1, 1))
+    )
+    return states, actions
+
+
+def edge_queries(states):
+    """Grid points, the bounds of r and both sides of the alpha wrap."""
+    r, alpha = states.info(return_data=True)
+    return np.array(
+        [
+            [r[0], alpha[0]],
+            [r[3], alpha[4]],
+            [r[-1], alpha[-1]],
+            [-1.0, -np.pi],
+            [90.0, np.pi],
+            [r[5], (alpha[-1] + np.pi) / 2],
+            [(r[1] + r[2]) / 2, np.nextafter(alpha[0], -np.inf)],
+        ]
+    ).astype(states.dtype)
+
+
+def synthetic_mdp(
+    sigma=0.5, discount=0.9, dt=1.0, d=10.0, n_r=N_R, n_alpha=N_ALPHA, states=None
+):
+    """Distance keeping of the unicycle on a small (r, alpha) grid, or on ``states``."""
+    grid, actions = synthetic_grid(n_r, n_alpha)
+    states = grid if states is None else states
+    state_transition_probability, rewards = unicycle_transitions(
+        states,
+        actions,
+        dt,
+        sigma=sigma,
+        reward=lambda next_states: -np.abs(next_states[:, 0] - d),
+    )
+    return MarkovDecisionProcess(
+        states,
+        actions,
+        rewards,
+        state_transition_probability,
+        Policy(states, actions),
+        discount=discount,
+    )
+
+
+def solve(mdp, **kwargs):
+    """Values and policy of value iteration to convergence, serial by default."""
+    solver = ValueIteration(mdp)
+    kwargs.setdefault("parallel", False)
+    kwargs.setdefault("max_iteration", 2000)
+    kwargs.setdefault("tolerance", 1e-6)
+    solver.solve(0.5, *mdp.states.shape, verbose=False, **kwargs)
+    return solver.values, mdp.policy.toarray(copy=True)